@@ -10,8 +10,12 @@
 
 #### imports
 import os.path
+import copy
 import math
 import shutil
+import hashlib
+import filecmp
+from fractions import Fraction
 
 
 ####  classes to describe a HybridOdeSge model
@@ -39,18 +43,48 @@ class SignalingReaction (object) :
 		self.reactants = reactants
 		self.products = products
 
+class ThresholdEvent (object) :
+	def __init__ ( self , name , species , threshold , direction , relativeTo , terminal ) :
+		if name == "" : raise Exception ("Empty name forbidden.")
+		if direction not in [-1,0,1] : raise Exception ("Event direction must be -1, 0 or 1.")
+		self.name = name
+		self.species = species
+		self.threshold = threshold
+		self.direction = direction
+		self.relativeTo = relativeTo
+		self.terminal = terminal
+
+class ConservationLaw (object) :
+	def __init__ ( self , coefficients , lossRate ) :
+		self.coefficients = coefficients # name -> integer weight of the species in the conserved total
+		self.lossRate = lossRate # common loss rate (rp or degRate) of the species of the law, None if they differ
+
+class EliminatedSpecies (object) :
+	def __init__ ( self , name , productions , lossRate ) :
+		# quasi-steady-state species of a reduced model : level = sum ( kreac * prod ( y[reactants] ) ) / lossRate
+		if name == "" : raise Exception ("Empty name forbidden.")
+		self.name = name
+		self.productions = productions # [ (kreac,reactants) ]
+		self.lossRate = lossRate
+
 class FluctuProtSTModel (object) :
 	def __init__ ( self , name = "Mymodel" ) :
 		self.name = name
 		self.nativeProteins = []
 		self.modifiedProteins = []
 		self.signalingReactions = []
+		self.events = []
+		# name lookups and sparse stoichiometry, kept up to date by the add methods
+		self.nativeIndexes = {} # name -> position in nativeProteins
+		self.modifiedIndexes = {} # name -> position in modifiedProteins
+		self.speciesReactions = {} # name -> [ (idxReac,numAsReactant,numAsProduct) ] in reaction order
+		self.eliminatedSpecies = [] # species removed by giveReducedModel, reconstructed from the others
 	def addNativeProtein ( self , name , Ton , Toff , EM , HLM , EP , HLP ) :
 		if name == "" : raise Exception ("Empty name forbidden.")
 		for s in ["*",":"] : 
 			if s in name : raise Exception ("Symbols * or , not allowed in names.")
-		if name in [ prot.name for prot in self.nativeProteins ] : raise Exception ("Name already taken by a nativeProt.")
-		if name in [ prot.name for prot in self.modifiedProteins ] : raise Exception ("Name already taken by a modifiedProt.")
+		if name in self.nativeIndexes : raise Exception ("Name already taken by a nativeProt.")
+		if name in self.modifiedIndexes : raise Exception ("Name already taken by a modifiedProt.")
 		koff = 1./Ton
 		kon = 1./Toff
 		EG = kon / (kon+koff)
@@ -59,36 +93,39 @@ class FluctuProtSTModel (object) :
 		rp = math.log(2.) / HLP
 		ksp = EP * rp / EM
 		nativeProt = NativeProtein ( name=name , kon=kon , koff=koff , ksm=ksm , rm=rm , ksp=ksp , rp=rp )
+		self.nativeIndexes[name] = len(self.nativeProteins)
+		self.speciesReactions[name] = []
 		self.nativeProteins.append (nativeProt)
 	def addNativeProteinStdFluct ( self , name , EP , dilutionHalfLife ) :
 		if name == "" : raise Exception ("Empty name forbidden.")
-		if name in [ prot.name for prot in self.nativeProteins ] : raise Exception ("Name already taken by a nativeProt.")
-		if name in [ prot.name for prot in self.modifiedProteins ] : raise Exception ("Name already taken by a modifiedProt.")
+		if name in self.nativeIndexes : raise Exception ("Name already taken by a nativeProt.")
+		if name in self.modifiedIndexes : raise Exception ("Name already taken by a modifiedProt.")
 		self.addNativeProtein ( name=name , Ton=0.1 , Toff=2.58 , EM=17. , HLM=9. , EP=EP , HLP=dilutionHalfLife)		
 	def addModifiedProtein ( self , name , degRate=0. ) :
 		if name == "" : raise Exception ("Empty name forbidden.")
 		if name == "" : raise Exception ("Empty name forbidden.")
 		for s in ["*",":"] : 
 			if s in name : raise Exception ("Symbols * or , not allowed in names.")
-		if name in [ prot.name for prot in self.nativeProteins ] : raise Exception ("Name already taken by a nativeProt.")
-		if name in [ prot.name for prot in self.modifiedProteins ] : raise Exception ("Name already taken by a modifiedProt.")
+		if name in self.nativeIndexes : raise Exception ("Name already taken by a nativeProt.")
+		if name in self.modifiedIndexes : raise Exception ("Name already taken by a modifiedProt.")
 		mprot = ModifiedProtein ( name , degRate )
+		self.modifiedIndexes[name] = len(self.modifiedProteins)
+		self.speciesReactions[name] = []
 		self.modifiedProteins.append (mprot)
 	def setModifiedProteinDegradation ( self , name , halfLife ) :
-		mprot_matches = [ mprot for mprot in self.modifiedProteins if mprot.name == name ]
-		if len(mprot_matches) == 0 : raise Exception ("Not existing modifiedProt.")
-		mprot_matches[0].degRate = math.log(2.) / halfLife
+		if name not in self.modifiedIndexes : raise Exception ("Not existing modifiedProt.")
+		self.modifiedProteins[self.modifiedIndexes[name]].degRate = math.log(2.) / halfLife
 	def setAllModifiedProteinDegradation ( self , halfLife ) :
 		for mprot in self.modifiedProteins : self.setModifiedProteinDegradation ( mprot.name , halfLife )
 	def addReaction ( self , name , reactants , products , rate ) :
 		if len (reactants) == 0 : raise Exception ("I don't accept 0-th order reaction (for now at least.)")
-		for reactant in reactants :
-			if reactant not in [ prot.name for prot in self.nativeProteins ] + [ mprot.name for mprot in self.modifiedProteins ] :
-				self.addModifiedProtein ( name=reactant )
-		for product in products :
-			if product not in [ prot.name for prot in self.nativeProteins ] + [ mprot.name for mprot in self.modifiedProteins ] :
-				self.addModifiedProtein ( name=product )
+		for prot in list(reactants) + list(products) :
+			if prot not in self.nativeIndexes and prot not in self.modifiedIndexes :
+				self.addModifiedProtein ( name=prot )
 		reaction = SignalingReaction ( name=name , reactants=reactants , products=products  , rate=rate)
+		idxReac = len(self.signalingReactions)
+		for prot in sorted ( set(reactants) | set(products) , key=(list(reactants)+list(products)).index ) :
+			self.speciesReactions[prot].append ( ( idxReac , reactants.count(prot) , products.count(prot) ) )
 		self.signalingReactions.append (reaction)
 	def addReversibleReaction ( self , name , reactants , products , rates ) :
 		self.addReaction ( name=name+"_forward" , reactants=reactants , products=products , rate=rates[0] )
@@ -97,13 +134,209 @@ class FluctuProtSTModel (object) :
 		self.addReaction ( name=name+"_binding" , reactants=[substrate,catalyst] , products=[substrate+"_"+catalyst] , rate=rates[0] )
 		self.addReaction ( name=name+"_unbinding" , reactants=[substrate+"_"+catalyst] , products=[substrate,catalyst] , rate=rates[1] )
 		self.addReaction ( name=name+"_catalysis" , reactants=[substrate+"_"+catalyst] , products=[catalyst,product] , rate=rates[2] )
+	def addEvent ( self , name , species , threshold , direction = 1 , relativeTo = [] , terminal = True ) :
+		# the event fires when the level of species crosses threshold (or threshold times the summed levels
+		# of the relativeTo species), upward for direction 1, downward for -1, both ways for 0.
+		# Only its first crossing in a simulate is reported, and a terminal event stops the simulation of the cell.
+		if name in [ event.name for event in self.events ] : raise Exception ("Name already taken by an event.")
+		for prot in [species] + list(relativeTo) : self.giveProteinIndexFromName (prot)
+		self.events.append ( ThresholdEvent ( name , species , threshold , direction , list(relativeTo) , terminal ) )
+	def giveEventCoefficients ( self , event ) :
+		# the event function is sum ( coefficient * y[idxProt] ) - constant, crossing zero at the event
+		coefficients = {}
+		coefficients[self.giveProteinIndexFromName(event.species)] = 1.
+		for prot in event.relativeTo :
+			idxProt = self.giveProteinIndexFromName (prot)
+			coefficients[idxProt] = coefficients.get(idxProt,0.) - event.threshold
+		constant = 0. if len(event.relativeTo) > 0 else event.threshold
+		return coefficients , constant
 	def giveProteinIndexFromName ( self , name ) :
-		if name not in [ nprot.name for nprot in self.nativeProteins ] + [ mprot.name for mprot in self.modifiedProteins ] : raise Exception ("Protein does not exist.")
-		np_matches = [ nprot for nprot in self.nativeProteins if nprot.name==name ]
-		if len(np_matches) > 0 : idxProt = self.nativeProteins.index(np_matches[0])
-		mp_matches = [ mprot for mprot in self.modifiedProteins if mprot.name==name ]
-		if len(mp_matches) > 0 : idxProt = len(self.nativeProteins)+self.modifiedProteins.index(mp_matches[0])
-		return idxProt
+		if name in self.nativeIndexes : return self.nativeIndexes[name]
+		if name in self.modifiedIndexes : return len(self.nativeProteins) + self.modifiedIndexes[name]
+		raise Exception ("Protein does not exist.")
+	def giveRateDerivatives ( self ) :
+		# partial derivatives of the mass-action reaction rates, one entry per distinct reactant of each reaction :
+		# d rate[idxReac] / d y[idxProt] = multiplicity * kreac[idxReac] * prod ( y[otherReactantIndexes] )
+		derivatives = []
+		for idxReac,reac in enumerate(self.signalingReactions) :
+			for reactant in sorted ( set(reac.reactants) , key=reac.reactants.index ) :
+				others = list (reac.reactants)
+				others.remove (reactant)
+				derivatives.append ( ( idxReac , self.giveProteinIndexFromName(reactant) , reac.reactants.count(reactant) , [ self.giveProteinIndexFromName(o) for o in others ] ) )
+		return derivatives
+	def giveModelHash ( self ) :
+		# identifies the species, reactions and rates of the model (used to check checkpoints and caches)
+		description = [ ( nprot.name , nprot.kon , nprot.koff , nprot.ksm , nprot.rm , nprot.ksp , nprot.rp ) for nprot in self.nativeProteins ]
+		description += [ ( mprot.name , mprot.degRate ) for mprot in self.modifiedProteins ]
+		description += [ ( reac.name , list(reac.reactants) , list(reac.products) , reac.rate[1] ) for reac in self.signalingReactions ]
+		if len(self.eliminatedSpecies) > 0 :
+			description += [ ( elim.name , [ ( kreac , list(reactants) ) for kreac,reactants in elim.productions ] , elim.lossRate ) for elim in self.eliminatedSpecies ]
+		return hashlib.sha1 ( repr(description).encode("utf-8") ).hexdigest ()
+	def giveTopologyHash ( self ) :
+		# identifies the species, reactions and events of the model, but not its numeric parameters
+		# (used to check parameter files and to cache generated code)
+		description = [ nprot.name for nprot in self.nativeProteins ]
+		description += [ mprot.name for mprot in self.modifiedProteins ]
+		description += [ ( reac.name , list(reac.reactants) , list(reac.products) ) for reac in self.signalingReactions ]
+		description += [ ( event.name , event.species , list(event.relativeTo) , event.direction , event.terminal ) for event in self.events ]
+		if len(self.eliminatedSpecies) > 0 :
+			description += [ ( elim.name , [ list(reactants) for kreac,reactants in elim.productions ] ) for elim in self.eliminatedSpecies ]
+		return hashlib.sha1 ( repr(description).encode("utf-8") ).hexdigest ()
+
+	#### conservation laws and quasi-steady-state reduction of the signaling ODE
+	def giveLossRate ( self , name ) :
+		# first-order loss of a species outside the signaling reactions : dilution rp of a native, degRate of a modified
+		if name in self.nativeIndexes : return self.nativeProteins[self.nativeIndexes[name]].rp
+		if name in self.modifiedIndexes : return self.modifiedProteins[self.modifiedIndexes[name]].degRate
+		raise Exception ("Protein does not exist.")
+	def giveConservationLaws ( self ) :
+		# Conserved moieties of the signaling reactions : a basis of the integer weights w with w . stoichiometry = 0,
+		# computed by exact (rational) elimination. The modified proteins are eliminated first, so that the laws are
+		# anchored on natives when possible (e.g. a native and all its complexes), then the laws with negative weights
+		# are made nonnegative by adding other laws when possible.
+		# Since every protein is diluted or degraded, and natives are synthesized, the totals are not invariants of
+		# the hybrid model : a total of a law with a common lossRate r follows d T / dt = sum ( w_n ksp_n m_n ) - r T.
+		names = [ mprot.name for mprot in self.modifiedProteins ] + [ nprot.name for nprot in self.nativeProteins ]
+		columns = dict ( (name,k) for k,name in enumerate(names) )
+		rows = []
+		for reac in self.signalingReactions :
+			row = [ Fraction(0) ] * len(names)
+			for prot in reac.reactants : row[columns[prot]] -= 1
+			for prot in reac.products : row[columns[prot]] += 1
+			if any (row) : rows.append (row)
+		pivots = []
+		for c in range(len(names)) :
+			r = len(pivots)
+			if r == len(rows) : break
+			candidates = [ i for i in range(r,len(rows)) if rows[i][c] != 0 ]
+			if len(candidates) == 0 : continue
+			rows[r] , rows[candidates[0]] = rows[candidates[0]] , rows[r]
+			rows[r] = [ value / rows[r][c] for value in rows[r] ]
+			for i in range(len(rows)) :
+				if i != r and rows[i][c] != 0 :
+					factor = rows[i][c]
+					rows[i] = [ a - factor * b for a,b in zip(rows[i],rows[r]) ]
+			pivots.append (c)
+		laws = []
+		for free in range(len(names)) :
+			if free in pivots : continue
+			weights = dict ( [ (names[free],Fraction(1)) ] + [ (names[c],-rows[i][free]) for i,c in enumerate(pivots) if rows[i][free] != 0 ] )
+			scale = 1
+			for value in weights.values () : scale = scale * value.denominator // math.gcd ( scale , value.denominator )
+			laws.append ( dict ( (name,int(value*scale)) for name,value in weights.items () ) )
+		for law in laws :
+			for name in [ name for name in law if law[name] < 0 ] :
+				if law.get(name,0) >= 0 : continue
+				for other in laws :
+					if other is law or other.get(name,0) <= 0 or min(other.values()) < 0 : continue
+					a , b = other[name] , -law[name]
+					combined = dict ( (n, a*law.get(n,0) + b*other.get(n,0)) for n in set(law) | set(other) )
+					if sum ( [ 1 for v in combined.values() if v < 0 ] ) < sum ( [ 1 for v in law.values() if v < 0 ] ) :
+						law.clear ()
+						law.update ( dict ( (n,v) for n,v in combined.items () if v != 0 ) )
+						break
+		conservationLaws = []
+		for law in laws :
+			divisor = 0
+			for value in law.values () : divisor = math.gcd ( divisor , abs(value) )
+			coefficients = dict ( (name,law[name]//divisor) for name in sorted ( law , key=self.giveProteinIndexFromName ) )
+			lossRates = [ self.giveLossRate(name) for name in coefficients ]
+			common = max(lossRates) - min(lossRates) <= 1e-9 * max(lossRates)
+			conservationLaws.append ( ConservationLaw ( coefficients , lossRates[0] if common else None ) )
+		return conservationLaws
+	def giveTypicalLevels ( self , conservationLaws = None ) :
+		# order of magnitude of the level of each species : EP for a native, and for a modified protein the smallest
+		# sum ( w_n EP_n ) / w_x over the nonnegative conservation laws holding natives n (None if there is none,
+		# as for a stimulus)
+		if conservationLaws is None : conservationLaws = self.giveConservationLaws ()
+		levels = dict ( ( nprot.name , nprot.kon / (nprot.kon+nprot.koff) * nprot.ksm / nprot.rm * nprot.ksp / nprot.rp ) for nprot in self.nativeProteins )
+		for mprot in self.modifiedProteins :
+			bounds = []
+			for law in conservationLaws :
+				coefficients = law.coefficients
+				if mprot.name not in coefficients or min(coefficients.values()) < 0 : continue
+				natives = [ name for name in coefficients if name in self.nativeIndexes ]
+				if len(natives) > 0 : bounds.append ( sum ( [ coefficients[name]*levels[name] for name in natives ] ) / coefficients[mprot.name] )
+			levels[mprot.name] = min(bounds) if len(bounds) > 0 else None
+		return levels
+	def giveQuasiSteadyStateForm ( self , name , reactions = None ) :
+		# ( producing reactions , consuming reactions , loss rate ) of a modified protein that can be eliminated :
+		# only consumed by first-order reactions name -> products (without name), and produced once by reactions
+		# not consuming it ; None otherwise
+		if name not in self.modifiedIndexes : return None
+		if reactions is None : reactions = self.signalingReactions
+		producing , consuming = [] , []
+		for reac in reactions :
+			if name in reac.reactants :
+				if list(reac.reactants) != [name] or name in reac.products : return None
+				consuming.append (reac)
+			elif name in reac.products :
+				if reac.products.count(name) > 1 : return None
+				producing.append (reac)
+		if len(producing) == 0 : return None
+		return producing , consuming , sum ( [ reac.rate[1] for reac in consuming ] ) + self.giveLossRate (name)
+	def giveFastSpecies ( self , minLossRate = 100. , maxOccupancy = 0.1 , keepSpecies = [] ) :
+		# Modified proteins in fast quasi-equilibrium, typically the substrate_catalyst complexes of addCatalyticReaction
+		# and the complexes of addReversibleReaction : of quasi-steady-state form, lost at a rate of at least minLossRate,
+		# and binding at most maxOccupancy of each of their reactants (kreac * prod ( typical levels of the other
+		# reactants ) / loss rate). Species of events and keepSpecies are kept.
+		typicalLevels = self.giveTypicalLevels ()
+		eventSpecies = set ( [ event.species for event in self.events ] + [ prot for event in self.events for prot in event.relativeTo ] )
+		fastSpecies = []
+		for mprot in self.modifiedProteins :
+			if mprot.name in eventSpecies or mprot.name in keepSpecies : continue
+			form = self.giveQuasiSteadyStateForm (mprot.name)
+			if form is None : continue
+			producing , consuming , lossRate = form
+			if lossRate < minLossRate : continue
+			occupancy = 0.
+			for reac in producing :
+				for k in range(len(reac.reactants)) :
+					others = [ typicalLevels[prot] for prot in reac.reactants[:k] + reac.reactants[k+1:] ]
+					if None in others : occupancy = float ("inf")
+					else : occupancy = max ( occupancy , reac.rate[1] * math.prod (others) / lossRate )
+			if occupancy <= maxOccupancy : fastSpecies.append (mprot.name)
+		return fastSpecies
+	def giveReducedModel ( self , fastSpecies = None , minLossRate = 100. , maxOccupancy = 0.1 , keepSpecies = [] ) :
+		# Copy of the model without the fastSpecies (by default giveFastSpecies), at quasi-steady-state : each reaction
+		# producing a fast species X is lumped with each reaction consuming X (rate kreac_p * kreac_c / loss rate of X),
+		# and with its degradation. Lumped reactions without net effect (binding then unbinding) are dropped.
+		# The eliminated species keep their level accessors, reconstructed from the remaining species.
+		if fastSpecies is None : fastSpecies = self.giveFastSpecies ( minLossRate , maxOccupancy , keepSpecies )
+		eventSpecies = set ( [ event.species for event in self.events ] + [ prot for event in self.events for prot in event.relativeTo ] )
+		reactions = list (self.signalingReactions)
+		eliminatedSpecies = list (self.eliminatedSpecies)
+		for name in fastSpecies :
+			if name in eventSpecies : raise Exception ("Cannot eliminate " + name + ", used by an event.")
+			form = self.giveQuasiSteadyStateForm ( name , reactions )
+			if form is None : raise Exception ("Cannot eliminate " + name + ", not of quasi-steady-state form.")
+			producing , consuming , lossRate = form
+			channels = [ ( reac.name , reac.rate , list(reac.products) ) for reac in consuming ] + [ ( "degradation" , ( "deg" , self.giveLossRate(name) ) , [] ) ]
+			lumped = []
+			for reac in reactions :
+				if reac in consuming : continue
+				if reac not in producing :
+					lumped.append (reac)
+					continue
+				products = list (reac.products)
+				products.remove (name)
+				for channelName , rate , channelProducts in channels :
+					if rate[1] == 0. or sorted (reac.reactants) == sorted (products+channelProducts) : continue
+					lumped.append ( SignalingReaction ( name=reac.name + "_" + channelName , reactants=list(reac.reactants) , products=products+channelProducts ,
+														rate=( reac.rate[0] + "*" + rate[0] + "/kloss" , reac.rate[1] * rate[1] / lossRate ) ) )
+			reactions = lumped
+			eliminatedSpecies.append ( EliminatedSpecies ( name , [ ( reac.rate[1] , list(reac.reactants) ) for reac in producing ] , lossRate ) )
+		reduced = FluctuProtSTModel (self.name)
+		for nprot in self.nativeProteins :
+			reduced.nativeIndexes[nprot.name] = len(reduced.nativeProteins)
+			reduced.speciesReactions[nprot.name] = []
+			reduced.nativeProteins.append ( copy.copy (nprot) )
+		for mprot in self.modifiedProteins :
+			if mprot.name not in fastSpecies : reduced.addModifiedProtein ( mprot.name , mprot.degRate )
+		for reac in reactions : reduced.addReaction ( reac.name , list(reac.reactants) , list(reac.products) , reac.rate )
+		for event in self.events : reduced.addEvent ( event.name , event.species , event.threshold , event.direction , event.relativeTo , event.terminal )
+		reduced.eliminatedSpecies = eliminatedSpecies
+		return reduced
 
 #### method to place specific code into template files
 def parseTemplateFileAndReplace ( templateFile , replacementList ) :
@@ -114,10 +347,202 @@ def parseTemplateFileAndReplace ( templateFile , replacementList ) :
 		data = data.replace ( replacement[0] , replacement[1] )
 	return data
 
+#### methods to write a file only if its content changes, so that an unchanged file keeps its date and is not recompiled
+def writeFileIfChanged ( filePath , content ) :
+	if os.path.exists (filePath) :
+		with open ( filePath , 'r' ) as readFile :
+			if readFile.read () == content : return False
+	with open ( filePath , 'w' ) as writeFile :
+		writeFile.write (content)
+	return True
+
+def copyFileIfChanged ( sourcePath , targetPath ) :
+	if os.path.exists (targetPath) and filecmp.cmp ( sourcePath , targetPath , shallow=False ) : return False
+	shutil.copy ( sourcePath , targetPath )
+	return True
+
+
+#### parameter files : the numeric parameters of a model, read at runtime by ModelParameters::loadParameterFile
+# one line per parameter array ( name then values ), preceded by the topology hash of the model and its model hash
+PARAMETER_ARRAYS = [ "kons" , "koffs" , "ksms" , "rms" , "ksps" , "rps" , "kreacs" , "degrates" , "eventThresholds" ]
+
+def giveParameterValues ( model ) :
+	values = {}
+	for name,attribute in [ ("kons","kon") , ("koffs","koff") , ("ksms","ksm") , ("rms","rm") , ("ksps","ksp") , ("rps","rp") ] :
+		values[name] = [ getattr(nprot,attribute) for nprot in model.nativeProteins ]
+	values["kreacs"] = [ reac.rate[1] for reac in model.signalingReactions ]
+	values["degrates"] = [ mprot.degRate for mprot in model.modifiedProteins ]
+	values["eventThresholds"] = [ event.threshold for event in model.events ]
+	return values
+
+def giveParameterFileContent ( model ) :
+	values = giveParameterValues (model)
+	lines = [ "# FluctuProtST parameters of model " + model.name + "\n" ]
+	lines.append ( "topologyHash " + model.giveTopologyHash() + "\n" )
+	lines.append ( "modelHash " + model.giveModelHash() + "\n" )
+	for name in PARAMETER_ARRAYS :
+		lines.append ( " ".join ( [name] + [ repr(float(value)) for value in values[name] ] ) + "\n" )
+	return "".join (lines)
+
+def writeParameterFile ( model , filePath ) :
+	return writeFileIfChanged ( filePath , giveParameterFileContent(model) )
+
+def readParameterFile ( filePath ) :
+	# returns the hashes and the parameter arrays of a parameter file, as a dict
+	parameters = {}
+	with open ( filePath , 'r' ) as readFile :
+		for line in readFile :
+			words = line.split ()
+			if len(words) == 0 or words[0].startswith ("#") : continue
+			if words[0] in ["topologyHash","modelHash"] : parameters[words[0]] = words[1]
+			elif words[0] in PARAMETER_ARRAYS : parameters[words[0]] = [ float(word) for word in words[1:] ]
+			else : raise Exception ("Unknown parameter " + words[0] + " in parameter file.")
+	return parameters
+
+
+
+#### unrolled RHS and jacobian : one statement per reaction and per species, with hard-coded indexes
+def giveUnrolledRhsCode ( model , speciesIndexes , rateDerivatives ) :
+	numNatives = len(model.nativeProteins)
+	lines = []
+	for idxProt,nativeProt in enumerate(model.nativeProteins) :
+		lines.append ( "\tdydx[" + str(idxProt) + "] = mf_ModelParameters->mf_ksps[" + str(idxProt) +  "] * mf_Mrnas[" + str(idxProt) + "] " )
+		lines.append ( "- mf_ModelParameters->mf_rps[" + str(idxProt) + "] * y[" + str(idxProt) + "] ; //" + nativeProt.name + "\n" )
+	lines.append ( "\n" )
+	for idxmProt,mProt in enumerate(model.modifiedProteins) :
+		lines.append ( "\tdydx[" + str(idxmProt+numNatives) + "] = - mf_ModelParameters->mf_degrates[" + str(idxmProt) + "] * y[" + str(idxmProt+numNatives) + "] ; //" + mProt.name + "\n" )
+	lines.append ( "\n" )
+	for idxReac,reac in enumerate(model.signalingReactions) :
+		lines.append ( "\tmf_computedReactionRates[" + str(idxReac) + "] = mf_ModelParameters->mf_kreacs[" + str(idxReac) + "] * " )
+		lines.append ( " * ".join ( [ "y[" + str(speciesIndexes[reactant]) + "]" for reactant in reac.reactants ] ) + " ; \n" )
+	# sparse stoichiometry of the model : each species only visits the reactions it takes part in
+	for idxProt,prot in enumerate(model.nativeProteins+model.modifiedProteins) :
+		if idxProt == 0 or idxProt == numNatives : lines.append ( "\n" )
+		terms = []
+		for idxReac,numAsReactant,numAsProduct in model.speciesReactions[prot.name] :
+			if numAsReactant > 0 : terms.append ( "- " + str(numAsReactant) + ". * mf_computedReactionRates[" + str(idxReac) + "] " )
+			if numAsProduct > 0 : terms.append ( "+ " + str(numAsProduct) + ". * mf_computedReactionRates[" + str(idxReac) + "] " )
+		lines.append ( "\tdydx[" + str(idxProt) + "] += " + ( "".join(terms) if len(terms) > 0 else "0." ) + " ;\n" )
+	toInsertRhs = "".join (lines)
+
+	# jacobian of the RHS (for stiff steppers), only structurally non-zero entries are written
+	lines = []
+	for idxProt,nprot in enumerate(model.nativeProteins) :
+		lines.append ( "\tdfdy[" + str(idxProt) + "][" + str(idxProt) + "] = - mf_ModelParameters->mf_rps[" + str(idxProt) + "] ; //" + nprot.name + "\n" )
+	for idxmProt,mprot in enumerate(model.modifiedProteins) :
+		idxProt = idxmProt + numNatives
+		lines.append ( "\tdfdy[" + str(idxProt) + "][" + str(idxProt) + "] = - mf_ModelParameters->mf_degrates[" + str(idxmProt) + "] ; //" + mprot.name + "\n" )
+	lines.append ( "\n" )
+	for idxDeriv,(idxReac,idxProt,multiplicity,others) in enumerate(rateDerivatives) :
+		lines.append ( "\tmf_computedRateDerivatives[" + str(idxDeriv) + "] = " + str(multiplicity) + ". * mf_ModelParameters->mf_kreacs[" + str(idxReac) + "]" )
+		lines.append ( "".join ( [ " * y[" + str(idxOther) + "]" for idxOther in others ] ) + " ;\n" )
+	lines.append ( "\n" )
+	for idxDeriv,(idxReac,idxProt,multiplicity,others) in enumerate(rateDerivatives) :
+		reac = model.signalingReactions[idxReac]
+		for species in sorted ( set(reac.reactants+reac.products) , key=(reac.reactants+reac.products).index ) :
+			netStoich = reac.products.count(species) - reac.reactants.count(species)
+			if netStoich == 0 : continue
+			lines.append ( "\tdfdy[" + str(speciesIndexes[species]) + "][" + str(idxProt) + "] += " + str(netStoich) + ". * mf_computedRateDerivatives[" + str(idxDeriv) + "] ;\n" )
+	toInsertJacobian = "".join (lines)
+	return toInsertRhs , toInsertJacobian
+
+
+#### sparse RHS and jacobian : the model as CSR arrays, read by generic kernels (SPARSE_RHS_KERNEL , SPARSE_JACOBIAN_KERNEL).
+#### The terms are summed in the same order as in the unrolled code.
+def writeCppArray ( cppType , name , values ) :
+	values = list(values) or [0] # no zero-sized array
+	items = [ str(v) for v in values ]
+	rows = [ " , ".join ( items[k:k+20] ) for k in range(0,len(items),20) ]
+	return "static const " + cppType + " " + name + "[] = {\n\t" + " ,\n\t".join(rows) + " } ;\n"
+
+def giveSparseRhsArrays ( model , speciesIndexes , rateDerivatives ) :
+	reactantPtr , reactantIndexes = [0] , []
+	reacStoichPtr , reacStoichSpecies , reacStoichCoefs = [0] , [] , []
+	for reac in model.signalingReactions :
+		reactantIndexes += [ speciesIndexes[reactant] for reactant in reac.reactants ]
+		reactantPtr.append ( len(reactantIndexes) )
+		for species in sorted ( set(reac.reactants+reac.products) , key=(reac.reactants+reac.products).index ) :
+			netStoich = reac.products.count(species) - reac.reactants.count(species)
+			if netStoich == 0 : continue
+			reacStoichSpecies.append ( speciesIndexes[species] )
+			reacStoichCoefs.append ( str(netStoich) + "." )
+		reacStoichPtr.append ( len(reacStoichSpecies) )
+	stoichPtr , stoichReacs , stoichCoefs = [0] , [] , []
+	for prot in model.nativeProteins + model.modifiedProteins :
+		for idxReac,numAsReactant,numAsProduct in model.speciesReactions[prot.name] :
+			if numAsReactant > 0 : stoichReacs.append (idxReac) ; stoichCoefs.append ( "-" + str(numAsReactant) + "." )
+			if numAsProduct > 0 : stoichReacs.append (idxReac) ; stoichCoefs.append ( str(numAsProduct) + "." )
+		stoichPtr.append ( len(stoichReacs) )
+	derivOthersPtr , derivOthers = [0] , []
+	for idxReac,idxProt,multiplicity,others in rateDerivatives :
+		derivOthers += others
+		derivOthersPtr.append ( len(derivOthers) )
+	arrays = [ "// reactants of reaction r : ReactantIndexes[ReactantPtr[r]..ReactantPtr[r+1][\n" ]
+	arrays.append ( writeCppArray ( "Int" , "ReactantPtr" , reactantPtr ) )
+	arrays.append ( writeCppArray ( "Int" , "ReactantIndexes" , reactantIndexes ) )
+	arrays.append ( "\n// reaction terms of species i (CSR) : StoichCoefs * rate of StoichReacs, over [StoichPtr[i]..StoichPtr[i+1][\n" )
+	arrays.append ( writeCppArray ( "Int" , "StoichPtr" , stoichPtr ) )
+	arrays.append ( writeCppArray ( "Int" , "StoichReacs" , stoichReacs ) )
+	arrays.append ( writeCppArray ( "Doub" , "StoichCoefs" , stoichCoefs ) )
+	arrays.append ( "\n// net stoichiometry of reaction r (CSC) : ReacStoichSpecies and ReacStoichCoefs over [ReacStoichPtr[r]..ReacStoichPtr[r+1][\n" )
+	arrays.append ( writeCppArray ( "Int" , "ReacStoichPtr" , reacStoichPtr ) )
+	arrays.append ( writeCppArray ( "Int" , "ReacStoichSpecies" , reacStoichSpecies ) )
+	arrays.append ( writeCppArray ( "Doub" , "ReacStoichCoefs" , reacStoichCoefs ) )
+	arrays.append ( "\n// rate derivative d, with respect to DerivSpecies : DerivMultiplicities * kreac of DerivReacs * y[DerivOthers[DerivOthersPtr[d]..DerivOthersPtr[d+1][]\n" )
+	arrays.append ( writeCppArray ( "Int" , "DerivReacs" , [ d[0] for d in rateDerivatives ] ) )
+	arrays.append ( writeCppArray ( "Int" , "DerivSpecies" , [ d[1] for d in rateDerivatives ] ) )
+	arrays.append ( writeCppArray ( "Doub" , "DerivMultiplicities" , [ str(d[2]) + "." for d in rateDerivatives ] ) )
+	arrays.append ( writeCppArray ( "Int" , "DerivOthersPtr" , derivOthersPtr ) )
+	arrays.append ( writeCppArray ( "Int" , "DerivOthers" , derivOthers ) )
+	return "\n" + "".join (arrays)
+
+SPARSE_RHS_KERNEL = """
+	const Int numGenes = mf_ModelParameters->mf_NumGenes , numSpecies = mf_ModelParameters->mf_NumAllProteinSpecies , numReacs = mf_ModelParameters->mf_NumReacs ;
+	for ( Int r = 0 ; r < numReacs ; r++ )
+	{
+		Doub rate = mf_ModelParameters->mf_kreacs[r] ;
+		for ( Int k = ReactantPtr[r] ; k < ReactantPtr[r+1] ; k++ ) rate *= y[ReactantIndexes[k]] ;
+		mf_computedReactionRates[r] = rate ;
+	}
+	for ( Int i = 0 ; i < numGenes ; i++ ) dydx[i] = mf_ModelParameters->mf_ksps[i] * mf_Mrnas[i] - mf_ModelParameters->mf_rps[i] * y[i] ;
+	for ( Int i = numGenes ; i < numSpecies ; i++ ) dydx[i] = - mf_ModelParameters->mf_degrates[i-numGenes] * y[i] ;
+	for ( Int i = 0 ; i < numSpecies ; i++ )
+	{
+		Doub sum = 0. ;
+		for ( Int k = StoichPtr[i] ; k < StoichPtr[i+1] ; k++ ) sum += StoichCoefs[k] * mf_computedReactionRates[StoichReacs[k]] ;
+		dydx[i] += sum ;
+	}
+"""
+
+SPARSE_JACOBIAN_KERNEL = """	const Int numGenes = mf_ModelParameters->mf_NumGenes , numDerivs = mf_ModelParameters->mf_NumRateDerivatives ;
+	for ( Int i = 0 ; i < numGenes ; i++ ) dfdy[i][i] = - mf_ModelParameters->mf_rps[i] ;
+	for ( Int i = numGenes ; i < n ; i++ ) dfdy[i][i] = - mf_ModelParameters->mf_degrates[i-numGenes] ;
+	for ( Int d = 0 ; d < numDerivs ; d++ )
+	{
+		Doub derivative = DerivMultiplicities[d] * mf_ModelParameters->mf_kreacs[DerivReacs[d]] ;
+		for ( Int k = DerivOthersPtr[d] ; k < DerivOthersPtr[d+1] ; k++ ) derivative *= y[DerivOthers[k]] ;
+		mf_computedRateDerivatives[d] = derivative ;
+	}
+	for ( Int d = 0 ; d < numDerivs ; d++ )
+		for ( Int k = ReacStoichPtr[DerivReacs[d]] ; k < ReacStoichPtr[DerivReacs[d]+1] ; k++ )
+			dfdy[ReacStoichSpecies[k]][DerivSpecies[d]] += ReacStoichCoefs[k] * mf_computedRateDerivatives[d] ;
+"""
 
 
 #### method to build CPP files from a model
-def buildCppFromModel ( model , targetFolderPath , redoMain=True ) :
+# rhsMode "unrolled" writes one statement per reaction and species in HybridRhs.cpp (fastest rhs for small models),
+# "sparse" writes the model as CSR arrays read by a generic kernel (small translation unit for large models).
+# Only the files whose content changes are rewritten, so that an unchanged file is not recompiled.
+# The numeric parameters are also written to parameters.txt : with bakeParameters=False they are not written in
+# ModelParameters.cpp but read from this file at runtime, so that the generated code only depends on the topology
+# of the model and a change of parameter values needs no recompilation.
+# With cacheFolderPath, the generated sources are cached under the topology hash of the model (and the parameter
+# values when they are baked), and taken from the cache when the same model is built again.
+# A model given by FluctuProtSTModel.giveReducedModel integrates fewer species, and CellState.hpp reconstructs the
+# levels of the eliminated ones (with constants baked in the code).
+def buildCppFromModel ( model , targetFolderPath , redoMain=True , rhsMode="unrolled" , bakeParameters=True , cacheFolderPath=None ) :
+
+	if rhsMode not in ["unrolled","sparse"] : raise Exception ("rhsMode must be unrolled or sparse.")
 
 	## create dir if needed
 	# if os.path.exists (targetFolderPath) : raise Exception ("Target folder already exists, I don't like that.")
@@ -126,145 +551,205 @@ def buildCppFromModel ( model , targetFolderPath , redoMain=True ) :
 
 	## copy what to copy from template
 	templateFolder = "template_cpp_code"
-	for f in os.listdir ( templateFolder + "/libs" ) : shutil.copy ( templateFolder + "/libs/" + f , targetFolderPath+"/libs" )
+	for f in os.listdir ( templateFolder + "/libs" ) : copyFileIfChanged ( templateFolder + "/libs/" + f , targetFolderPath + "/libs/" + f )
 	if redoMain :
-		shutil.copy ( templateFolder + "/template_main.cpp" , targetFolderPath + "/main.cpp" )
-	shutil.copy ( templateFolder + "/template_CellState.cpp" , targetFolderPath + "/CellState.cpp" )
-	shutil.copy ( templateFolder + "/template_ModelParameters.hpp" , targetFolderPath + "/ModelParameters.hpp" )
-	shutil.copy ( templateFolder + "/template_HybridSimulator.hpp" , targetFolderPath + "/HybridSimulator.hpp" )
-	shutil.copy ( templateFolder + "/template_HybridSimulator.cpp" , targetFolderPath + "/HybridSimulator.cpp" )
-	shutil.copy ( templateFolder + "/template_HybridRhs.hpp" , targetFolderPath + "/HybridRhs.hpp" )
-
-	## construct ModelParameters.cpp and write it
-	toInsert = "\tmf_NumGenes = " + str(len(model.nativeProteins)) + " ;\n"
-	toInsert = toInsert + "\tmf_NumAllProteinSpecies = " + str(len(model.nativeProteins)+len(model.modifiedProteins)) + " ;\n"
-	toInsert = toInsert + "\tmf_NumModifiedProteins = " + str(len(model.modifiedProteins)) + " ;\n"
-	toInsert = toInsert + "\tmf_NumReacs = " + str(len(model.signalingReactions)) + " ;\n"
-	toInsert = toInsert + "\n\tmf_kons = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_koffs = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_ksms = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_rms = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_ksps = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_rps = VecDoub ( mf_NumGenes , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_kreacs = VecDoub ( mf_NumReacs , 0. ) ;\n"
-	toInsert = toInsert + "\tmf_degrates = VecDoub ( mf_NumModifiedProteins , 0. ) ;\n\n"
-	for nativeProt in model.nativeProteins :
-		toInsert = toInsert + "\tmf_kons[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.kon) + " ;\n"
-		toInsert = toInsert + "\tmf_koffs[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.koff) + " ;\n"
-		toInsert = toInsert + "\tmf_ksms[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.ksm) + " ;\n"
-		toInsert = toInsert + "\tmf_rms[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.rm) + " ;\n"
-		toInsert = toInsert + "\tmf_ksps[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.ksp) + " ;\n"
-		toInsert = toInsert + "\tmf_rps[" + str(model.nativeProteins.index(nativeProt)) + "] = " + str(nativeProt.rp) + " ;\n\n"
-	for reac in model.signalingReactions :
-		toInsert = toInsert + "\tmf_kreacs[" + str(model.signalingReactions.index(reac)) + "] = " + str(reac.rate[1]) + " ; " + "//" + reac.name + "\n"
-	toInsert = toInsert + "\n"
-	for mprot in model.modifiedProteins :
-		toInsert = toInsert + "\tmf_degrates[" + str(model.modifiedProteins.index(mprot)) + "] = " + str(mprot.degRate) + " ;\n"
-
-	replacementList = [ ( "placeholder_parameter_init" , toInsert ) ]
-	toWrite = parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_ModelParameters.cpp" , replacementList=replacementList )
-	writeFile = open ( targetFolderPath + "/ModelParameters.cpp" , 'w' )
-	writeFile.write ( toWrite )
-
-	## construct MrnaSimulator.hpp and write it
-	toInsert = ""
-	commonStr = "(VecDoub &s) {return mf_ModelParameters->mf_"
-	for nativeProt in model.nativeProteins :
-		idxProt = model.nativeProteins.index(nativeProt)
-		toInsert = toInsert + "\tDoub rate" + str(4*idxProt) + commonStr + "koffs[" + str(idxProt) + "]*s[" + str(3*idxProt) + "];}\n"
-		toInsert = toInsert + "\tDoub rate" + str(4*idxProt+1) + commonStr + "kons[" + str(idxProt) + "]*s[" + str(3*idxProt+1) + "];}\n"
-		toInsert = toInsert + "\tDoub rate" + str(4*idxProt+2) + commonStr + "ksms[" + str(idxProt) + "]*s[" + str(3*idxProt) + "];}\n"
-		toInsert = toInsert + "\tDoub rate" + str(4*idxProt+3) + commonStr + "rms[" + str(idxProt) + "]*s[" + str(3*idxProt+2) + "];}\n"
-	replacementList = [ ( "placeholder_rate_functions" , toInsert ) ]
-	toWrite = parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_MrnaSimulator.hpp" , replacementList=replacementList )
-	writeFile = open ( targetFolderPath + "/MrnaSimulator.hpp" , 'w' )
-	writeFile.write ( toWrite )
-
-	## construct MrnaSimulator.cpp and write it
-	toInsert = ""
-	for nativeProt in model.nativeProteins :
-		idxProt = model.nativeProteins.index(nativeProt)
-		for r in range(0,4) :
-			toInsert = toInsert + "\tdispatch[" + str(4*idxProt+r) + "] = &MrnaSimulator::rate" + str(4*idxProt+r) + ";\n"
-	replacementList = [ ( "placeholder_dispatch" , toInsert ) ]
-	toWrite = parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_MrnaSimulator.cpp" , replacementList=replacementList )
-	writeFile = open ( targetFolderPath + "/MrnaSimulator.cpp" , 'w' )
-	writeFile.write ( toWrite )
-
-	## construct RHS
-	toInsert = ""
-	for nativeProt in model.nativeProteins :
-		idxProt = model.nativeProteins.index(nativeProt)
-		toInsert = toInsert + "\tdydx[" + str(idxProt) + "] = mf_ModelParameters->mf_ksps[" + str(idxProt) +  "] * (*mrnatable)[" + str(idxProt) + "][tindex] "
-		toInsert = toInsert + "- mf_ModelParameters->mf_rps[" + str(idxProt) + "] * y[" + str(idxProt) + "] ; //" + nativeProt.name + "\n"
-	toInsert = toInsert + "\n"
-	for mProt in model.modifiedProteins :
-		idxmProt = model.modifiedProteins.index(mProt) + len(model.nativeProteins)
-		toInsert = toInsert + "\tdydx[" + str(idxmProt) + "] = - mf_ModelParameters->mf_degrates[" + str(idxmProt-len(model.nativeProteins)) + "] * y[" + str(idxmProt) + "] ; //" + mProt.name + "\n"
-	toInsert = toInsert + "\n"
-	for reac in model.signalingReactions :
-		idxReac = model.signalingReactions.index(reac)
-		toInsert = toInsert + "\tmf_computedReactionRates[" + str(idxReac) + "] = mf_ModelParameters->mf_kreacs[" + str(idxReac) + "] *"
-		for reactant in reac.reactants :
-			# find reactant either in native or modified prots
-			nprot_reac_match = [ np for np in model.nativeProteins if np.name == reactant ]
-			mprot_reac_match = [ mp for mp in model.modifiedProteins if mp.name == reactant ]
-			if len(nprot_reac_match) > 0 : idxReactant = model.nativeProteins.index (nprot_reac_match[0])
-			if len(mprot_reac_match) > 0 : idxReactant = model.modifiedProteins.index (mprot_reac_match[0]) + len(model.nativeProteins)
-			toInsert = toInsert + " y[" + str(idxReactant) + "] *"
-		toInsert = toInsert[:-2]
-		toInsert = toInsert + " ; \n"
-	toInsert = toInsert + "\n"
-	for nprot in model.nativeProteins :
-		idxProt = model.nativeProteins.index(nprot)
-		toInsert = toInsert + "\tdydx[" + str(idxProt) + "] += "
-		for reac in model.signalingReactions :
-			idxReac = model.signalingReactions.index(reac)
-			reactant_matches = [ reactant for reactant in reac.reactants if reactant == nprot.name ]		
-			if len (reactant_matches) > 0 :
-				toInsert = toInsert + "- " + str(len(reactant_matches)) + ". * mf_computedReactionRates[" + str(idxReac) + "] "
-			product_matches = [ product for product in reac.products if product == nprot.name ]
-			if len (product_matches) > 0 :
-				toInsert = toInsert + "+ " + str(len(product_matches)) + ". * mf_computedReactionRates[" + str(idxReac) + "] "
-		if toInsert[-3:-1] == "+=" : toInsert = toInsert + "0."
-		toInsert = toInsert + " ;\n"
-	toInsert = toInsert + "\n"
-	for mprot in model.modifiedProteins :
-		idxProt = model.modifiedProteins.index(mprot) + len(model.nativeProteins)
-		toInsert = toInsert + "\tdydx[" + str(idxProt) + "] += "
-		for reac in model.signalingReactions :
-			idxReac = model.signalingReactions.index(reac)
-			reactant_matches = [ reactant for reactant in reac.reactants if reactant == mprot.name ]		
-			if len (reactant_matches) > 0 :
-				toInsert = toInsert + "- " + str(len(reactant_matches)) + ". * mf_computedReactionRates[" + str(idxReac) + "] "
-			product_matches = [ product for product in reac.products if product == mprot.name ]
-			if len (product_matches) > 0 :
-				toInsert = toInsert + "+ " + str(len(product_matches)) + ". * mf_computedReactionRates[" + str(idxReac) + "] "
-		if toInsert[-3:-1] == "+= " : toInsert = toInsert + "0."
-		toInsert = toInsert + " ;\n"
-	toInsertRhs = toInsert
-
-	## write RHS in HybridRhs.cpp
-	replacementList = [ ( "placeholder_hybrid_rhs" , toInsertRhs ) ]
-	toWrite = parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_HybridRhs.cpp" , replacementList=replacementList )
-	writeFile = open ( targetFolderPath + "/HybridRhs.cpp" , 'w' )
-	writeFile.write ( toWrite )
-
-	## construct CellState.hpp and write it
-	toInsert = ""
-	for nativeProt in model.nativeProteins :
-		idxProt = model.nativeProteins.index(nativeProt)
-		toInsert = toInsert + "\tinline Doub get_" + nativeProt.name + "_MrnaLevel () { return mf_GeneMrnas[" + str(3*idxProt+2) + "] ; }\n"
-		toInsert = toInsert + "\tinline Doub get_" + nativeProt.name + "_Level () { return mf_AllProts[" + str(idxProt) + "] ; }\n"
-	toInsert = toInsert + "\n"
-	for modProt in model.modifiedProteins :
-		idxProt = model.modifiedProteins.index(modProt) + len(model.nativeProteins)
-		toInsert = toInsert + "\tinline Doub get_" + modProt.name + "_Level () { return mf_AllProts[" + str(idxProt) + "] ; }\n"
-		toInsert = toInsert + "\tinline void set_" + modProt.name + "_Level ( Doub value ) { mf_AllProts[" + str(idxProt) + "] = value ; }\n"
-	replacementList = [ ( "placeholder_name_access" , toInsert ) ]
-	toWrite = parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_CellState.hpp" , replacementList=replacementList )
-	writeFile = open ( targetFolderPath + "/CellState.hpp" , 'w' )
-	writeFile.write ( toWrite )
+		copyFileIfChanged ( templateFolder + "/template_main.cpp" , targetFolderPath + "/main.cpp" )
+	for f in [ "CellState.cpp" , "ModelParameters.hpp" , "HybridSimulator.hpp" , "HybridSimulator.cpp" , "HybridRhs.hpp" ,
+				"MrnaSimulator.hpp" , "MrnaSimulator.cpp" , "Checkpoint.hpp" , "Checkpoint.cpp" , "SimulationProfile.hpp" , "SimulationProfile.cpp" ] :
+		copyFileIfChanged ( templateFolder + "/template_" + f , targetFolderPath + "/" + f )
+
+	## numeric parameters, for ModelParameters::loadParameterFile
+	writeParameterFile ( model , targetFolderPath + "/parameters.txt" )
+
+	## generated sources, taken from the cache if they are there
+	sourceNames = [ "ModelParameters.cpp" , "HybridRhs.cpp" , "CellState.hpp" ]
+	sources = None
+	if cacheFolderPath is not None :
+		key = [ model.giveTopologyHash () , rhsMode , str(bakeParameters) ]
+		if bakeParameters : key.append ( giveParameterFileContent (model) )
+		if len(model.eliminatedSpecies) > 0 : key.append ( model.giveModelHash () ) # reconstruction constants of CellState.hpp
+		for f in [ "template_ModelParameters.cpp" , "template_HybridRhs.cpp" , "template_CellState.hpp" ] :
+			with open ( templateFolder + "/" + f , 'r' ) as readFile : key.append ( readFile.read () )
+		cachePath = cacheFolderPath + "/" + hashlib.sha1 ( "\n".join(key).encode("utf-8") ).hexdigest ()
+		if all ( [ os.path.exists ( cachePath + "/" + f ) for f in sourceNames ] ) :
+			sources = {}
+			for f in sourceNames :
+				with open ( cachePath + "/" + f , 'r' ) as readFile : sources[f] = readFile.read ()
+	if sources is None :
+		sources = giveGeneratedSources ( model , rhsMode , bakeParameters )
+		if cacheFolderPath is not None :
+			if not os.path.exists (cachePath) : os.makedirs (cachePath)
+			for f in sourceNames : writeFileIfChanged ( cachePath + "/" + f , sources[f] )
+	for f in sourceNames : writeFileIfChanged ( targetFolderPath + "/" + f , sources[f] )
+
+
+#### content of the generated sources ModelParameters.cpp, HybridRhs.cpp and CellState.hpp
+def giveGeneratedSources ( model , rhsMode , bakeParameters ) :
+
+	templateFolder = "template_cpp_code"
+	sources = {}
+
+	## indexes of the model, computed once : code is emitted in a single pass over species and reactions,
+	## as lists of lines joined at the end
+	numNatives = len(model.nativeProteins)
+	speciesIndexes = dict ( (prot.name,idxProt) for idxProt,prot in enumerate(model.nativeProteins+model.modifiedProteins) )
+	rateDerivatives = model.giveRateDerivatives ()
+
+	## construct ModelParameters.cpp
+	lines = []
+	lines.append ( "\tmf_NumGenes = " + str(numNatives) + " ;\n" )
+	lines.append ( "\tmf_NumAllProteinSpecies = " + str(len(speciesIndexes)) + " ;\n" )
+	lines.append ( "\tmf_NumModifiedProteins = " + str(len(model.modifiedProteins)) + " ;\n" )
+	lines.append ( "\tmf_NumReacs = " + str(len(model.signalingReactions)) + " ;\n" )
+	lines.append ( "\tmf_NumRateDerivatives = " + str(len(rateDerivatives)) + " ;\n" )
+	lines.append ( "\tmf_TopologyHash = \"" + model.giveTopologyHash() + "\" ;\n" )
+	if bakeParameters :
+		lines.append ( "\tmf_ModelHash = \"" + model.giveModelHash() + "\" ;\n" )
+	for prot in model.nativeProteins + model.modifiedProteins :
+		lines.append ( "\tmf_SpeciesNames.push_back (\"" + prot.name + "\") ;\n" )
+	lines.append ( "\tmf_NumEvents = " + str(len(model.events)) + " ;\n" )
+	lines.append ( "\tmf_EventThresholds = VecDoub ( mf_NumEvents , 0. ) ;\n" )
+	lines.append ( "\tmf_EventDirections = VecInt ( mf_NumEvents , 0 ) ;\n" )
+	for idxEvent,event in enumerate(model.events) :
+		lines.append ( "\tmf_EventNames.push_back (\"" + event.name + "\") ;\n" )
+		if bakeParameters :
+			lines.append ( "\tmf_EventThresholds[" + str(idxEvent) + "] = " + str(event.threshold) + " ;\n" )
+		lines.append ( "\tmf_EventDirections[" + str(idxEvent) + "] = " + str(event.direction) + " ;\n" )
+		lines.append ( "\tmf_EventTerminal.push_back (" + ( "true" if event.terminal else "false" ) + ") ;\n" )
+	lines.append ( "\n\tmf_kons = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_koffs = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_ksms = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_rms = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_ksps = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_rps = VecDoub ( mf_NumGenes , 0. ) ;\n" )
+	lines.append ( "\tmf_kreacs = VecDoub ( mf_NumReacs , 0. ) ;\n" )
+	lines.append ( "\tmf_degrates = VecDoub ( mf_NumModifiedProteins , 0. ) ;\n\n" )
+	if bakeParameters :
+		for idxProt,nativeProt in enumerate(model.nativeProteins) :
+			lines.append ( "\tmf_kons[" + str(idxProt) + "] = " + str(nativeProt.kon) + " ;\n" )
+			lines.append ( "\tmf_koffs[" + str(idxProt) + "] = " + str(nativeProt.koff) + " ;\n" )
+			lines.append ( "\tmf_ksms[" + str(idxProt) + "] = " + str(nativeProt.ksm) + " ;\n" )
+			lines.append ( "\tmf_rms[" + str(idxProt) + "] = " + str(nativeProt.rm) + " ;\n" )
+			lines.append ( "\tmf_ksps[" + str(idxProt) + "] = " + str(nativeProt.ksp) + " ;\n" )
+			lines.append ( "\tmf_rps[" + str(idxProt) + "] = " + str(nativeProt.rp) + " ;\n\n" )
+		for idxReac,reac in enumerate(model.signalingReactions) :
+			lines.append ( "\tmf_kreacs[" + str(idxReac) + "] = " + str(reac.rate[1]) + " ; " + "//" + reac.name + "\n" )
+		lines.append ( "\n" )
+		for idxmProt,mprot in enumerate(model.modifiedProteins) :
+			lines.append ( "\tmf_degrates[" + str(idxmProt) + "] = " + str(mprot.degRate) + " ;\n" )
+	else :
+		lines.append ( "\tif ( parameterFile != \"\" ) loadParameterFile (parameterFile) ;\n" )
+
+	replacementList = [ ( "placeholder_parameter_init" , "".join(lines) ) ]
+	sources["ModelParameters.cpp"] = parseTemplateFileAndReplace ( templateFile=templateFolder+"/template_ModelParameters.cpp" , replacementList=replacementList )
+
+	## construct RHS and its jacobian : unrolled statements, or CSR arrays read by a generic kernel
+	if rhsMode == "unrolled" :
+		toInsertRhs , toInsertJacobian = giveUnrolledRhsCode ( model , speciesIndexes , rateDerivatives )
+		toInsertArrays = ""
+	else :
+		toInsertRhs , toInsertJacobian = SPARSE_RHS_KERNEL , SPARSE_JACOBIAN_KERNEL
+		toInsertArrays = giveSparseRhsArrays ( model , speciesIndexes , rateDerivatives )
+
+	## construct event functions, crossing zero at the events
+	lines = []
+	for idxEvent,event in enumerate(model.events) :
+		lines.append ( "\tg[" + str(idxEvent) + "] = y[" + str(speciesIndexes[event.species]) + "] - mf_ModelParameters->mf_EventThresholds[" + str(idxEvent) + "]" )
+		if len(event.relativeTo) > 0 :
+			lines.append ( " * ( " + " + ".join ( [ "y[" + str(speciesIndexes[prot]) + "]" for prot in event.relativeTo ] ) + " )" )
+		lines.append ( " ; //" + event.name + "\n" )
+	toInsertEvents = "".join (lines)
+
+	## construct HybridRhs.cpp
+	replacementList = [ ( "placeholder_hybrid_arrays" , toInsertArrays ) , ( "placeholder_hybrid_rhs" , toInsertRhs ) ,
+						( "placeholder_hybrid_jacobian" , toInsertJacobian ) , ( "placeholder_hybrid_events" , toInsertEvents ) ]
+	sources["HybridRhs.cpp"] = parseTemplateFileAndReplace ( templateFile=templateFolder+"/template_HybridRhs.cpp" , replacementList=replacementList )
+
+	## construct CellState.hpp
+	lines = []
+	for idxProt,nativeProt in enumerate(model.nativeProteins) :
+		lines.append ( "\tinline Doub get_" + nativeProt.name + "_MrnaLevel () { return mf_GeneMrnas[" + str(3*idxProt+2) + "] ; }\n" )
+		lines.append ( "\tinline Doub get_" + nativeProt.name + "_Level () { return mf_AllProts[" + str(idxProt) + "] ; }\n" )
+	lines.append ( "\n" )
+	for idxmProt,modProt in enumerate(model.modifiedProteins) :
+		idxProt = idxmProt + numNatives
+		lines.append ( "\tinline Doub get_" + modProt.name + "_Level () { return mf_AllProts[" + str(idxProt) + "] ; }\n" )
+		lines.append ( "\tinline void set_" + modProt.name + "_Level ( Doub value ) { mf_AllProts[" + str(idxProt) + "] = value ; }\n" )
+	if len(model.eliminatedSpecies) > 0 : lines.append ( "\n\t// species eliminated at quasi-steady-state by FluctuProtSTModel.giveReducedModel, reconstructed from the others\n" )
+	for elim in model.eliminatedSpecies :
+		terms = [ " * ".join ( [ str(kreac/elim.lossRate) ] + [ "get_" + prot + "_Level ()" for prot in reactants ] ) for kreac,reactants in elim.productions ]
+		lines.append ( "\tinline Doub get_" + elim.name + "_Level () { return " + " + ".join(terms) + " ; }\n" )
+	replacementList = [ ( "placeholder_name_access" , "".join(lines) ) ]
+	sources["CellState.hpp"] = parseTemplateFileAndReplace ( templateFile=templateFolder+"/template_CellState.hpp" , replacementList=replacementList )
+
+	return sources
+
+
+
+#### python extension module of a model : the compiled simulator (HybridSimulator, CellState and population runs),
+#### called in-process from a model script, see template_PythonModule.cpp
+def givePythonModuleName ( model ) :
+	return "fpst_" + "".join ( [ c if c.isalnum () else "_" for c in model.name ] )
+
+
+def givePythonModuleSource ( model , moduleName , parameterFile ) :
+	functions , methods = [] , []
+	accessors = []
+	for prot in model.nativeProteins :
+		accessors += [ ( "get_" + prot.name + "_MrnaLevel" , "getter" ) , ( "get_" + prot.name + "_Level" , "getter" ) ]
+	for prot in model.modifiedProteins :
+		accessors += [ ( "get_" + prot.name + "_Level" , "getter" ) , ( "set_" + prot.name + "_Level" , "setter" ) ]
+	for elim in model.eliminatedSpecies :
+		accessors.append ( ( "get_" + elim.name + "_Level" , "getter" ) )
+	for name,kind in accessors :
+		if kind == "getter" :
+			functions.append ( "static PyObject* CellState_" + name + " ( CellStateObject* self , PyObject* ) { return PyFloat_FromDouble ( self->cell->" + name + " () ) ; }\n" )
+			methods.append ( "    { \"" + name + "\" , (PyCFunction) CellState_" + name + " , METH_NOARGS , NULL } ,\n" )
+		else :
+			functions.append ( "static PyObject* CellState_" + name + " ( CellStateObject* self , PyObject* arg ) { Doub value ; if ( ! readLevel ( arg , value ) ) return NULL ; self->cell->" + name + " (value) ; Py_RETURN_NONE ; }\n" )
+			methods.append ( "    { \"" + name + "\" , (PyCFunction) CellState_" + name + " , METH_O , NULL } ,\n" )
+	replacementList = [ ( "placeholder_module_name" , moduleName ) , ( "placeholder_parameter_file" , parameterFile.replace("\\","\\\\").replace("\"","\\\"") ) ,
+						( "placeholder_species_names" , "".join ( [ "\"" + prot.name + "\" , " for prot in model.nativeProteins + model.modifiedProteins ] ) ) ,
+						( "placeholder_event_names" , "".join ( [ "\"" + event.name + "\" , " for event in model.events ] ) ) ,
+						( "placeholder_num_genes" , str(len(model.nativeProteins)) ) ,
+						( "placeholder_cell_functions" , "".join(functions) ) , ( "placeholder_cell_methods" , "".join(methods) ) ]
+	return parseTemplateFileAndReplace ( templateFile="template_cpp_code/template_PythonModule.cpp" , replacementList=replacementList )
+
+
+# The module source is written into targetFolderPath/python, next to the code written by buildCppFromModel (the NR headers
+# must be in its libs folder, as to compile main.cpp), compiled with $CXX (g++ by default) against the Python and NumPy
+# headers when a source, a header or the flags changed, then imported and returned. Parameters that are not baked are
+# read from the parameters.txt of targetFolderPath (or another file, with the loadParameterFile of the module).
+# A module already imported in the process is not reloaded after a rebuild.
+def buildPythonModule ( model , targetFolderPath , compilerFlags=["-O2"] ) :
+	import importlib.util
+	import subprocess
+	import sys
+	import sysconfig
+	import numpy
 
+	if not os.path.exists ( targetFolderPath + "/CellState.hpp" ) : raise Exception ("No generated code in the target folder, run buildCppFromModel first.")
+	moduleName = givePythonModuleName (model)
+	moduleFolder = targetFolderPath + "/python"
+	if not os.path.exists (moduleFolder) : os.mkdir (moduleFolder)
+	with open ( targetFolderPath + "/ModelParameters.cpp" , 'r' ) as readFile :
+		parameterFile = os.path.abspath ( targetFolderPath + "/parameters.txt" ) if "loadParameterFile (parameterFile)" in readFile.read () else ""
+	writeFileIfChanged ( moduleFolder + "/PythonModule.cpp" , givePythonModuleSource ( model , moduleName , parameterFile ) )
 
+	compiler = os.environ.get ( "CXX" , "g++" )
+	command = [ compiler , "-shared" , "-fPIC" ] + list(compilerFlags) + [ "-I" + sysconfig.get_paths () ["include"] , "-I" + numpy.get_include () ]
+	if sys.platform == "darwin" : command += [ "-undefined" , "dynamic_lookup" ]
+	writeFileIfChanged ( moduleFolder + "/compile_command.txt" , " ".join(command) + "\n" )
+	sources = [ "PythonModule.cpp" ] + [ "../" + f for f in sorted ( os.listdir (targetFolderPath) ) if f.endswith (".cpp") and f != "main.cpp" ]
+	sources += [ "../libs/" + f for f in sorted ( os.listdir ( targetFolderPath + "/libs" ) ) if f.endswith (".cpp") ]
+	dependencies = sources + [ "compile_command.txt" ] + [ "../" + f for f in os.listdir (targetFolderPath) if f.endswith (".hpp") ]
+	dependencies += [ "../libs/" + f for f in os.listdir ( targetFolderPath + "/libs" ) if f.endswith (".h") ]
+	moduleFile = moduleName + sysconfig.get_config_var ("EXT_SUFFIX")
+	modulePath = moduleFolder + "/" + moduleFile
+	if not os.path.exists (modulePath) or max ( [ os.path.getmtime ( moduleFolder + "/" + f ) for f in dependencies ] ) > os.path.getmtime (modulePath) :
+		subprocess.check_call ( command + [ "-o" , moduleFile ] + sources , cwd=moduleFolder )
 
+	spec = importlib.util.spec_from_file_location ( moduleName , modulePath )
+	module = importlib.util.module_from_spec (spec)
+	spec.loader.exec_module (module)
+	return module
@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Multi-process ensemble runs of a FluctuProtST model.
+#
+# A population is split into shards of consecutive cells, each shard is simulated by a
+# PopulationSimulator in a worker (process or thread), and the shards are gathered back
+# in cell order. The random stream of a cell only depends on the master seed and on the
+# cell index, and its step sizes are chosen from its own state, so the results are
+# bit-identical whatever the number of workers or the shard size.
+#
+# Typical use :
+#	protocol = fpste.SimulationProtocol ()
+#	protocol.addSimulation (7.*24.)
+#	protocol.addStimulus ("DeathLigand",1000.)
+#	protocol.addSimulation (12.)
+#	runner = fpste.EnsembleRunner (params,randomSeed=1,numWorkers=8)
+#	population = runner.run (protocol,numCells=10000)
+#
+# Pre-equilibrated cells can be built once per model and reused across experiments :
+#	library = fpste.SteadyStateLibrary (params,10000,cacheDirectory="steadystates",numWorkers=8)
+#	population = runner.run (stimulusProtocol,population=library.givePopulation())
+##########################################################################################
+
+
+#### imports
+import hashlib
+import multiprocessing
+import multiprocessing.pool
+import os
+
+import numpy as np
+
+import FluctuProtSTPy as fpstpy
+
+
+#### a picklable list of simulation steps, applied to each shard
+class SimulationProtocol (object) :
+	def __init__ ( self ) :
+		self.steps = []
+	def addSimulation ( self , duration , checkEvents = True ) :
+		# with checkEvents=False the events of the model are ignored (e.g. during an equilibration)
+		self.steps.append ( ("simulate",duration,checkEvents) )
+	def addStimulus ( self , name , value ) :
+		self.steps.append ( ("setLevels",name,value) )
+	def addNativeRelaxation ( self , duration ) :
+		self.steps.append ( ("relaxNativeProteins",duration) )
+	def __call__ ( self , simulator , population ) :
+		for step in self.steps :
+			if step[0] == "simulate" :
+				simulator.CheckEvents = step[2]
+				simulator.simulate ( population , step[1] )
+			elif step[0] == "relaxNativeProteins" : simulator.relaxNativeProteins ( population , step[1] )
+			elif step[0] == "setLevels" : population.setLevels ( step[1] , step[2] )
+			else : raise Exception ("Unknown protocol step.")
+
+
+#### what a worker does with one shard (top-level so that it can be pickled)
+# A shard is either a CellPopulation or a (checkpoint path,first cell,end cell) triplet, read by the worker itself.
+def simulateShard ( args ) :
+	modelParameters , randomSeed , useStiffSolver , leapEpsilon , protocol , shard = args
+	if isinstance ( shard , tuple ) :
+		path , start , stop = shard
+		shard = fpstpy.CellPopulation.loadCheckpoint ( modelParameters , path , mmapMode="r" )[0].getSubPopulation ( slice(start,stop) )
+	simulator = fpstpy.PopulationSimulator ( modelParameters , randomSeed , useStiffSolver , leapEpsilon )
+	protocol ( simulator , shard )
+	statistics = dict ( (name,getattr(simulator,name)) for name in ["NumSteps","NumRejectedSteps","NumRhsEvals","NumJacobianEvals","NumMrnaEvents","NumMrnaLeaps"] )
+	events = dict ( (name,getattr(simulator,name,None)) for name in ["EventTimes","StoppingEvents","StopTimes"] )
+	return shard , statistics , events
+
+
+#### the ensemble driver
+class EnsembleRunner (object) :
+	def __init__ ( self , modelParameters , randomSeed = 1 , numWorkers = 1 , cellsPerShard = 1000 , useThreads = False , useStiffSolver = False , leapEpsilon = 0. ) :
+		if cellsPerShard < 1 : raise Exception ("Shards need at least one cell.")
+		self.mf_ModelParameters = modelParameters
+		self.RandomSeed = randomSeed
+		self.NumWorkers = numWorkers
+		self.CellsPerShard = cellsPerShard
+		self.UseThreads = useThreads
+		self.UseStiffSolver = useStiffSolver
+		self.LeapEpsilon = leapEpsilon
+		self.statistics = {}
+		self.EventTimes , self.StoppingEvents , self.StopTimes = None , None , None
+
+	def makeShards ( self , population ) :
+		return [ population.getSubPopulation ( slice(start,start+self.CellsPerShard) ) for start in range(0,population.NumCells,self.CellsPerShard) ]
+
+	def run ( self , protocol , numCells = None , population = None ) :
+		if population is None :
+			if numCells is None : raise Exception ("Give either numCells or population.")
+			population = fpstpy.CellPopulation ( self.mf_ModelParameters , numCells )
+		return self.runShards ( protocol , self.makeShards(population) )
+
+	def runFromCheckpoint ( self , protocol , path , numCells = None ) :
+		# each worker maps the checkpoint and copies its own cells : no population is pickled, nothing is re-simulated
+		numCellsInFile = int ( fpstpy.readCheckpointHeader(path)["numCells"] )
+		if numCells is None : numCells = numCellsInFile
+		if numCells > numCellsInFile : raise Exception ("The checkpoint does not have that many cells.")
+		return self.runShards ( protocol , [ (path,start,min(start+self.CellsPerShard,numCells)) for start in range(0,numCells,self.CellsPerShard) ] )
+
+	def runShards ( self , protocol , shards ) :
+		tasks = [ ( self.mf_ModelParameters , self.RandomSeed , self.UseStiffSolver , self.LeapEpsilon , protocol , shard ) for shard in shards ]
+		if self.NumWorkers <= 1 :
+			results = [ simulateShard(task) for task in tasks ]
+		else :
+			pool = multiprocessing.pool.ThreadPool (self.NumWorkers) if self.UseThreads else multiprocessing.Pool (self.NumWorkers)
+			try :
+				results = pool.map ( simulateShard , tasks , chunksize=1 )
+			finally :
+				pool.close ()
+				pool.join ()
+		self.statistics = {}
+		for shard,statistics,events in results :
+			for name,value in statistics.items () : self.statistics[name] = self.statistics.get(name,0) + value
+		# events of the last simulation step of the protocol, in cell order
+		for name in ["EventTimes","StoppingEvents","StopTimes"] :
+			values = [ events[name] for shard,statistics,events in results ]
+			setattr ( self , name , None if any ( [ v is None for v in values ] ) else np.concatenate (values) )
+		return fpstpy.CellPopulation.concatenate ( [ shard for shard,statistics,events in results ] )
+
+
+#### a library of pre-equilibrated cells of a model, built once and cached on disk
+# Cells are drawn from the native steady-state (exact telegraph law for genes and mrnas),
+# their native proteins are relaxed for relaxationDuration, then the full model is simulated
+# for equilibrationDuration to equilibrate the signaling species. The cells only depend on
+# the model and on these settings, so they are saved as a checkpoint in cacheDirectory under
+# a name made from them, and later libraries with the same model and settings just map the file.
+# EnsembleRunner.runFromCheckpoint(protocol,library.giveCachePath()) lets each worker read its
+# own cells from the file.
+class SteadyStateLibrary (object) :
+	def __init__ ( self , modelParameters , numCells , randomSeed = 1 , relaxationDuration = 24. , equilibrationDuration = 7.*24. ,
+					cacheDirectory = None , numWorkers = 1 , useStiffSolver = False ) :
+		self.mf_ModelParameters = modelParameters
+		self.NumCells = numCells
+		self.RandomSeed = randomSeed
+		self.RelaxationDuration = relaxationDuration
+		self.EquilibrationDuration = equilibrationDuration
+		self.CacheDirectory = cacheDirectory
+		self.NumWorkers = numWorkers
+		self.UseStiffSolver = useStiffSolver
+		self.LoadedFromCache = False
+		self.population = self.load ()
+		if self.population is None :
+			self.population = self.build ()
+			self.save ()
+
+	def giveCacheKey ( self ) :
+		# the tag changes with the way cells are drawn, so that libraries of an older draw are not reused
+		settings = repr ( ("cellNativeUniforms",self.NumCells,self.RandomSeed,self.RelaxationDuration,self.EquilibrationDuration,self.UseStiffSolver) )
+		return hashlib.sha1 ( ( self.mf_ModelParameters.giveModelHash () + settings ).encode () ).hexdigest ()
+
+	def giveCachePath ( self ) :
+		if self.CacheDirectory is None : return None
+		return os.path.join ( self.CacheDirectory , "steadystate_%s_%s.fpst" % ( self.mf_ModelParameters.name , self.giveCacheKey() ) )
+
+	def build ( self ) :
+		population = fpstpy.CellPopulation.fromNativeSteadyState ( self.mf_ModelParameters , self.NumCells , self.RandomSeed )
+		protocol = SimulationProtocol ()
+		if self.RelaxationDuration > 0. : protocol.addNativeRelaxation (self.RelaxationDuration)
+		if self.EquilibrationDuration > 0. : protocol.addSimulation (self.EquilibrationDuration)
+		runner = EnsembleRunner ( self.mf_ModelParameters , self.RandomSeed , self.NumWorkers , useStiffSolver=self.UseStiffSolver )
+		return runner.run ( protocol , population=population )
+
+	def save ( self ) :
+		path = self.giveCachePath ()
+		if path is None : return
+		if not os.path.isdir (self.CacheDirectory) : os.makedirs (self.CacheDirectory)
+		tmpPath = path + ".%d.tmp" % os.getpid ()
+		self.population.saveCheckpoint ( tmpPath , self.RandomSeed )
+		os.replace ( tmpPath , path ) # concurrent builders of the same library never leave a partial file
+
+	def load ( self ) :
+		# the cached cells stay memory-mapped, givePopulation copies what is asked
+		path = self.giveCachePath ()
+		if path is None or not os.path.isfile (path) : return None
+		population , randomSeed = fpstpy.CellPopulation.loadCheckpoint ( self.mf_ModelParameters , path , mmapMode="r" )
+		self.LoadedFromCache = True
+		return population
+
+	def givePopulation ( self , numCells = None ) :
+		# a copy of the first numCells cells, so that experiments never modify the library
+		if numCells is None : numCells = self.NumCells
+		if numCells > self.NumCells : raise Exception ("The library does not have that many cells.")
+		return self.population.getSubPopulation ( slice(0,numCells) )
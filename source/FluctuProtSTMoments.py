@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Means and covariances of a FluctuProtST model, without sampling cells.
+#
+# The state of a cell is z = ( gene states , mrnas , proteins ). Genes and mrnas jump (telegraph
+# gene, mrna births and deaths), proteins follow the ODE of the model. The mean m and covariance
+# C of z follow
+#	dm/dt = F(m) ( + closure correction )
+#	dC/dt = A C + C A^T + D
+# where F is the drift of z, A its jacobian at m, and D the (diagonal) jump noise of genes and
+# mrnas at m. The native part (gene, mrna, native protein) is linear, so its moments are exact
+# (they are those of NativeSteadyStateMoments at steady-state). Through the signaling reactions,
+# "lna" (linear noise approximation) takes the mean as the solution of the rate equations, and
+# "normal" adds the covariance terms of the mass-action rates under a normal closure
+# ( E[ya yb] = ma mb + Cab ). Means and covariances are integrated as one ODE system, with the
+# jacobian of the model.
+#
+# Both closures linearise the signaling reactions around the mean : they are only reliable while
+# the distribution stays unimodal and narrow compared with the curvature of the rates. In bimodal
+# or switching regimes (all-or-none responses, a species depleted in some cells and not in others)
+# lna and normal can be wrong by orders of magnitude. On ToyExample, 6 h after DeathLigand 1000 on
+# an equilibrated population, Caspase has an lna mean of 3.7 against 36 for the cells and a standard
+# deviation of 2 against 554. Even without switching, nearly depleted species drift away : 12 h
+# after the stimulus on 500 cells drawn from the native steady-state, the lna Caspase mean is 3.3
+# standard errors from the sample mean and its standard deviation is 14 % low. Check a model with
+# validateMoments before relying on its moments.
+#
+# Typical use :
+#	moments = fpstm.MomentState.fromNativeSteadyState (params)
+#	simulator = fpstm.MomentSimulator (params)
+#	simulator.simulate (moments,7.*24.)
+#	moments.setLevel ("DeathLigand",1000.)
+#	means , variances = simulator.simulate (moments,12.,times,["CleavedCaspase"])
+#
+# validateMoments compares the moments with those of a population simulated by PopulationSimulator,
+# and running this file does so for a model script :
+#	python FluctuProtSTMoments.py model_ToyExample.py [numCells] [stimulated species] [level]
+##########################################################################################
+
+
+#### imports
+import sys
+
+import numpy as np
+import scipy.linalg
+import scipy.linalg.lapack
+
+import FluctuProtSTPy as fpstpy
+
+
+#### means and covariance of ( gene states , mrnas , proteins ) of a cell
+class MomentState (object) :
+	def __init__ ( self , modelParameters ) :
+		self.mf_ModelParameters = modelParameters
+		p = modelParameters
+		self.NumGenes = p.NumGenes
+		self.Size = 2 * p.NumGenes + p.NumAllProteinSpecies
+		self.Mean = np.zeros (self.Size)
+		self.Covariance = np.zeros ( (self.Size,self.Size) )
+
+	@classmethod
+	def fromNativeSteadyState ( cls , modelParameters ) :
+		# exact stationary moments of the native part, modified proteins at 0
+		state = cls (modelParameters)
+		G = modelParameters.NumGenes
+		moments = fpstpy.NativeSteadyStateMoments (modelParameters)
+		genes , mrnas , prots = np.arange(G) , G + np.arange(G) , 2*G + np.arange(G)
+		state.Mean[genes] , state.Mean[mrnas] , state.Mean[prots] = moments.GeneOn , moments.Mrna , moments.Prot
+		for a,b,values in [ (genes,genes,moments.VarGene) , (mrnas,mrnas,moments.VarMrna) , (prots,prots,moments.VarProt) ,
+							(genes,mrnas,moments.CovGeneMrna) , (genes,prots,moments.CovGeneProt) , (mrnas,prots,moments.CovMrnaProt) ] :
+			state.Covariance[a,b] = values
+			state.Covariance[b,a] = values
+		return state
+
+	@classmethod
+	def fromPopulation ( cls , population ) :
+		# sample moments of the cells of a population
+		state = cls (population.mf_ModelParameters)
+		z = np.hstack ( [ population.GeneMrnas[:,0::3] , population.GeneMrnas[:,2::3] , population.AllProts ] )
+		state.Mean = z.mean (axis=0)
+		state.Covariance = np.atleast_2d ( np.cov ( z , rowvar=False , bias=True ) )
+		return state
+
+	def copy ( self ) :
+		state = MomentState (self.mf_ModelParameters)
+		state.Mean = self.Mean.copy ()
+		state.Covariance = self.Covariance.copy ()
+		return state
+
+	def giveIndex ( self , name ) :
+		return 2 * self.NumGenes + self.mf_ModelParameters.giveProteinIndexFromName (name)
+
+	def giveMrnaIndex ( self , name ) :
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt >= self.NumGenes : raise Exception ("Not a nativeProt.")
+		return self.NumGenes + idxProt
+
+	def getMean ( self , name ) :
+		return self.Mean[self.giveIndex(name)]
+
+	def getVariance ( self , name ) :
+		idx = self.giveIndex (name)
+		return self.Covariance[idx,idx]
+
+	def getCovariance ( self , name1 , name2 ) :
+		return self.Covariance[self.giveIndex(name1),self.giveIndex(name2)]
+
+	def getMrnaMean ( self , name ) :
+		return self.Mean[self.giveMrnaIndex(name)]
+
+	def getMrnaVariance ( self , name ) :
+		idx = self.giveMrnaIndex (name)
+		return self.Covariance[idx,idx]
+
+	def setLevel ( self , name , value ) :
+		# the same level in every cell : no variance left for this species
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt < self.NumGenes : raise Exception ("Cannot set the level of a nativeProt.")
+		idx = 2 * self.NumGenes + idxProt
+		self.Mean[idx] = value
+		self.Covariance[idx,:] = 0.
+		self.Covariance[:,idx] = 0.
+
+
+#### integrator of the moment equations
+# Linearly implicit steps (the ROS3 Rosenbrock method of PopulationSimulator) : each stage solves
+#	( I/(gamma h) - J ) k = r
+# where J is block lower-triangular, A for the means and the Kronecker sum of A for the covariance,
+# with the coupling of the covariance to the means. The covariance block is a Sylvester equation
+#	B X + X B^T = R , B = I/(2 gamma h) - A
+# solved with one Schur decomposition of B per step, instead of factorizing a (n^2,n^2) system.
+# With the normal closure, the dependence of the means on the covariance is left out of J.
+class MomentSimulator (object) :
+	def __init__ ( self , modelParameters , closure = "lna" ) :
+		if closure not in ["lna","normal"] : raise Exception ("closure must be lna or normal.")
+		p = modelParameters
+		self.mf_ModelParameters = p
+		self.Closure = closure
+		self.AbsTolNumErr = 1e-6
+		self.RelTolNumErr = 1e-6
+		self.InitialStep = 0.1
+		self.MinScale , self.MaxScale , self.Safe = 0.2 , 10. , 0.9
+		G , S = p.NumGenes , p.NumAllProteinSpecies
+		self.Size = 2 * G + S
+		# constant part of the jacobian A of the drift : genes, mrnas, and mrna -> native protein
+		genes , mrnas , prots = np.arange(G) , G + np.arange(G) , 2*G + np.arange(G)
+		rows = np.concatenate ( [ genes , mrnas , mrnas , prots ] )
+		cols = np.concatenate ( [ genes , genes , mrnas , mrnas ] )
+		vals = np.concatenate ( [ - (p.kons+p.koffs) , p.ksms , - p.rms , p.ksps ] )
+		self.GeneMrnaJacobian = np.zeros ( (self.Size,self.Size) )
+		self.GeneMrnaJacobian[rows,cols] = vals
+		# normal closure : covariance terms of the rates, one per pair of reactants of each reaction
+		# E[ prod y ] = prod m + sum over pairs (a,b) of C[a,b] * prod ( m of the other reactants )
+		# (grouped by number of other reactants, as arrays of reactions, a, b and others)
+		self.closurePairs = []
+		if closure == "normal" :
+			reactants = [ [ p.firstReactantIndexes[idxReac] ] for idxReac in range(p.NumReacs) ]
+			for reacs,species in p.higherOrderReactants :
+				for idxReac,idxProt in zip ( reacs , species ) : reactants[idxReac].append (idxProt)
+			pairs = {}
+			for idxReac,reac in enumerate(reactants) :
+				for i in range(len(reac)) :
+					for j in range(i+1,len(reac)) :
+						others = [ reac[k] for k in range(len(reac)) if k not in [i,j] ]
+						pairs.setdefault ( len(others) , [] ).append ( ( idxReac , reac[i] , reac[j] , others ) )
+			for numOthers,group in sorted ( pairs.items () ) :
+				self.closurePairs.append ( tuple ( [ np.array ( [ pair[k] for pair in group ] , dtype=int ).reshape ( (len(group),-1) if k == 3 else (len(group),) )
+														for k in range(4) ] ) )
+		self.resetStatistics ()
+
+	def resetStatistics ( self ) :
+		self.NumSteps = 0
+		self.NumRejectedSteps = 0
+		self.NumRhsEvals = 0
+		self.NumJacobianEvals = 0
+
+	def giveDriftJacobian ( self , mean ) :
+		G = self.mf_ModelParameters.NumGenes
+		A = self.GeneMrnaJacobian.copy ()
+		A[2*G:,2*G:] = self.mf_ModelParameters.computeDenseJacobians ( mean[None,2*G:] ) [0]
+		return A
+
+	def giveJumpNoise ( self , mean ) :
+		p = self.mf_ModelParameters
+		G = p.NumGenes
+		genes , mrnas = mean[:G] , mean[G:2*G]
+		noise = np.zeros (self.Size)
+		noise[:G] = p.kons * ( 1. - genes ) + p.koffs * genes
+		noise[G:2*G] = p.ksms * genes + p.rms * mrnas
+		return noise
+
+	def giveClosureCorrection ( self , mean , covariance ) :
+		p = self.mf_ModelParameters
+		G = p.NumGenes
+		rates = np.zeros (p.NumReacs)
+		for reacs,a,b,others in self.closurePairs :
+			np.add.at ( rates , reacs , covariance[2*G+a,2*G+b] * np.prod ( mean[2*G+others] , axis=1 ) )
+		return p.applyStoichiometry ( p.kreacs * rates )
+
+	def rhs ( self , mean , covariance ) :
+		self.NumRhsEvals += 1
+		p = self.mf_ModelParameters
+		G = p.NumGenes
+		dmean = np.empty (self.Size)
+		dmean[:G] = p.kons - ( p.kons + p.koffs ) * mean[:G]
+		dmean[G:2*G] = p.ksms * mean[:G] - p.rms * mean[G:2*G]
+		dmean[2*G:] = p.computeDerivatives ( mean[2*G:] , mean[G:2*G] )
+		if self.Closure == "normal" : dmean[2*G:] += self.giveClosureCorrection ( mean , covariance )
+		AC = self.giveDriftJacobian(mean) @ covariance
+		dcovariance = AC + AC.T
+		dcovariance[np.diag_indices(self.Size)] += self.giveJumpNoise (mean)
+		return dmean , dcovariance
+
+	def doRosenbrockStep ( self , mean , covariance , h , dmean , dcovariance ) :
+		n , G = self.Size , self.mf_ModelParameters.NumGenes
+		A = self.giveDriftJacobian (mean)
+		self.NumJacobianEvals += 1
+		luMean = scipy.linalg.lu_factor ( np.eye(n) / ( fpstpy.ROS3_GAMMA * h ) - A )
+		T , U = scipy.linalg.schur ( np.eye(n) / ( 2. * fpstpy.ROS3_GAMMA * h ) - A , output="real" )
+		def solve ( rmean , rcovariance ) :
+			kmean = scipy.linalg.lu_solve ( luMean , rmean )
+			# coupling : derivative of A C + C A^T + D along kmean (the entries of A are at most quadratic in the means)
+			dA = 0.5 * ( self.giveDriftJacobian ( mean + kmean ) - self.giveDriftJacobian ( mean - kmean ) )
+			dAC = dA @ covariance
+			r = rcovariance + dAC + dAC.T
+			r[np.diag_indices(n)] += self.giveJumpNoise (kmean) - self.giveJumpNoise (np.zeros(n))
+			Y , scale , info = scipy.linalg.lapack.dtrsyl ( T , T , U.T @ r @ U , trana="N" , tranb="T" )
+			if info < 0 : raise Exception ("Sylvester solve failed.")
+			return kmean , U @ ( Y / scale ) @ U.T
+		K1 = solve ( dmean , dcovariance )
+		f1 = self.rhs ( mean + K1[0] , covariance + K1[1] )
+		K2 = solve ( f1[0] + ( fpstpy.ROS3_C21 / h ) * K1[0] , f1[1] + ( fpstpy.ROS3_C21 / h ) * K1[1] )
+		K3 = solve ( f1[0] + ( fpstpy.ROS3_C31 * K1[0] + fpstpy.ROS3_C32 * K2[0] ) / h , f1[1] + ( fpstpy.ROS3_C31 * K1[1] + fpstpy.ROS3_C32 * K2[1] ) / h )
+		out = [ x + fpstpy.ROS3_M[0] * K1[i] + fpstpy.ROS3_M[1] * K2[i] + fpstpy.ROS3_M[2] * K3[i] for i,x in enumerate([mean,covariance]) ]
+		err = [ fpstpy.ROS3_E[0] * K1[i] + fpstpy.ROS3_E[1] * K2[i] + fpstpy.ROS3_E[2] * K3[i] for i in range(2) ]
+		return out[0] , 0.5 * ( out[1] + out[1].T ) , err[0] , err[1]
+
+	def giveError ( self , mean , covariance , meanOut , covarianceOut , meanErr , covarianceErr ) :
+		# the tolerance on a covariance entry C[i,j] is the change that errors within tolerance on the
+		# deviations of i and j would make, rtol std_i std_j + atol ( std_i + std_j ), plus atol
+		sk = self.AbsTolNumErr + self.RelTolNumErr * np.maximum ( np.abs(mean) , np.abs(meanOut) )
+		std = np.sqrt ( np.maximum ( np.maximum ( np.diag(covariance) , np.diag(covarianceOut) ) , 0. ) )
+		skCovariance = self.RelTolNumErr * np.outer ( std , std ) + self.AbsTolNumErr * np.add.outer ( std , std ) + self.AbsTolNumErr
+		return np.sqrt ( ( np.sum ( (meanErr/sk)**2 ) + np.sum ( (covarianceErr/skCovariance)**2 ) ) / ( self.Size * (self.Size+1) ) )
+
+	def simulate ( self , state , duration , observationTimes = None , speciesNames = None ) :
+		# with observationTimes (sorted, in [0,duration]) and speciesNames, returns the means and the
+		# variances of these species as two (NumSpecies,NumTimes) arrays
+		if observationTimes is not None :
+			observationTimes = np.asarray ( observationTimes , dtype=float )
+			if np.any ( np.diff(observationTimes) < 0. ) or np.any ( observationTimes < 0. ) or np.any ( observationTimes > duration ) :
+				raise Exception ("Observation times must be sorted and within the simulated duration.")
+			indexes = np.array ( [ state.giveIndex(name) for name in speciesNames ] , dtype=int )
+			means = np.empty ( (len(indexes),len(observationTimes)) )
+			variances = np.empty ( (len(indexes),len(observationTimes)) )
+			nextObservation = np.searchsorted ( observationTimes , 0. , side="right" )
+			means[:,:nextObservation] = state.Mean[indexes,None]
+			variances[:,:nextObservation] = state.Covariance[indexes,indexes][:,None]
+		t , h , rejected = 0. , min ( self.InitialStep , duration ) , False
+		mean , covariance = state.Mean.copy () , state.Covariance.copy ()
+		dmean , dcovariance = self.rhs ( mean , covariance )
+		while t < duration :
+			hEff = min ( h , duration - t )
+			meanOut , covarianceOut , meanErr , covarianceErr = self.doRosenbrockStep ( mean , covariance , hEff , dmean , dcovariance )
+			err = self.giveError ( mean , covariance , meanOut , covarianceOut , meanErr , covarianceErr )
+			self.NumSteps += 1
+			accept = err <= 1.
+			with np.errstate (divide='ignore') :
+				scale = min ( max ( self.Safe * err**(-1./3.) , self.MinScale ) , self.MaxScale )
+			if accept and rejected : scale = min ( scale , 1. )
+			hNew = hEff * scale
+			if accept and hEff < h : hNew = max ( hNew , h ) # a step shortened to reach the end says nothing against h
+			h , rejected = hNew , not accept
+			if not accept :
+				self.NumRejectedSteps += 1
+				continue
+			dmeanOut , dcovarianceOut = self.rhs ( meanOut , covarianceOut )
+			tNew = duration if hEff == duration - t else t + hEff
+			if observationTimes is not None :
+				# cubic Hermite interpolation inside the step, from the end values and derivatives
+				while nextObservation < len(observationTimes) and observationTimes[nextObservation] <= tNew :
+					th = ( observationTimes[nextObservation] - t ) / hEff
+					for values,x0,x1,f0,f1 in [ ( means , mean[indexes] , meanOut[indexes] , dmean[indexes] , dmeanOut[indexes] ) ,
+												( variances , covariance[indexes,indexes] , covarianceOut[indexes,indexes] ,
+													dcovariance[indexes,indexes] , dcovarianceOut[indexes,indexes] ) ] :
+						values[:,nextObservation] = (1.-th) * x0 + th * x1 + th * (th-1.) * ( (1.-2.*th) * ( x1 - x0 ) + (th-1.) * hEff * f0 + th * hEff * f1 )
+					nextObservation += 1
+			t , mean , covariance , dmean , dcovariance = tNew , meanOut , covarianceOut , dmeanOut , dcovarianceOut
+		state.Mean , state.Covariance = mean , covariance
+		if observationTimes is None : return None
+		return means , variances
+
+
+#### validation : moments against the sample moments of a population simulated by PopulationSimulator
+# Both start from the same cells (the moments from their sample moments). Returns the moment and
+# sample means and variances, (NumSpecies,NumTimes) arrays, and the mean errors in numbers of standard
+# errors of the sample mean.
+def validateMoments ( population , duration , observationTimes , speciesNames , closure = "lna" , randomSeed = 1 , useStiffSolver = False ) :
+	p = population.mf_ModelParameters
+	state = MomentState.fromPopulation (population)
+	momentMeans , momentVariances = MomentSimulator ( p , closure ).simulate ( state , duration , observationTimes , speciesNames )
+	simulator = fpstpy.PopulationSimulator ( p , randomSeed , useStiffSolver )
+	simulator.CheckEvents = False
+	observations = simulator.simulate ( population.getSubPopulation(slice(0,population.NumCells)) , duration , observationTimes , speciesNames )
+	sampleMeans , sampleVariances = observations.mean (axis=1) , observations.var (axis=1)
+	standardErrors = np.sqrt ( sampleVariances / population.NumCells )
+	return { "momentMeans" : momentMeans , "momentVariances" : momentVariances , "sampleMeans" : sampleMeans , "sampleVariances" : sampleVariances ,
+				"meanErrors" : np.abs ( momentMeans - sampleMeans ) / np.maximum ( standardErrors , 1e-300 ) }
+
+
+#### MAIN : validation on a model script, from the native steady-state and an optional stimulus
+# mean errors are in standard errors of the sample mean, and grow with numCells for a biased approximation :
+# large errors or standard deviations far from the sample ones mean that the closure does not hold for this model
+if __name__ == "__main__" :
+	import benchmark_codegen
+	model = benchmark_codegen.loadModelScript ( sys.argv[1] )
+	numCells = int ( sys.argv[2] ) if len(sys.argv) > 2 else 2000
+	params = fpstpy.ModelParameters (model)
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( params , numCells )
+	fpstpy.PopulationSimulator (params).relaxNativeProteins ( population , 24. )
+	if len(sys.argv) > 4 : population.setLevels ( sys.argv[3] , float(sys.argv[4]) )
+	times = np.linspace ( 0. , 12. , 13 )
+	for closure in ["lna","normal"] :
+		results = validateMoments ( population , times[-1] , times , params.speciesNames , closure )
+		print ( "closure " + closure + " , time " + str(times[-1]) + " h" )
+		for idxProt,name in enumerate(params.speciesNames) :
+			print ( "  %-30s mean %12.5g (sample %12.5g , %5.1f s.e.)   std %12.5g (sample %12.5g)" % ( name ,
+					results["momentMeans"][idxProt,-1] , results["sampleMeans"][idxProt,-1] , results["meanErrors"][idxProt,-1] ,
+					np.sqrt(max(results["momentVariances"][idxProt,-1],0.)) , np.sqrt(results["sampleVariances"][idxProt,-1]) ) )
@@ -0,0 +1,1237 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Pure NumPy/SciPy simulation engine for FluctuProtST models.
+#
+# It runs the same hybrid scheme as the cpp code generated by buildCppFromModel
+# (telegraph gene/mRNA jump process + mass-action protein ODE), directly from a
+# FluctuProtSTModel object. No Numerical Recipes source is needed.
+#
+# Typical use :
+#	params = fpstpy.ModelParameters (model)
+#	simulator = fpstpy.HybridSimulator (params,randomSeed=1)
+#	cell = fpstpy.CellState (params)
+#	simulator.simulate (cell,7.*24.)
+#	cell.setLevel ("DeathLigand",1000.)
+#	simulator.simulate (cell,12.)
+#	print (cell.getLevel ("CleavedCaspase"))
+#
+# Populations of cells are simulated as one batch with CellPopulation and
+# PopulationSimulator, which hold all cells in (NumCells,species) arrays.
+##########################################################################################
+
+
+#### imports
+import numpy as np
+import scipy.sparse
+import scipy.special
+import scipy.stats
+from scipy.integrate import solve_ivp
+
+
+#### Dormand-Prince 5(4) coefficients (same scheme as StepperDopr5)
+DOPR5_A = [ [] ,
+			[ 1./5. ] ,
+			[ 3./40. , 9./40. ] ,
+			[ 44./45. , -56./15. , 32./9. ] ,
+			[ 19372./6561. , -25360./2187. , 64448./6561. , -212./729. ] ,
+			[ 9017./3168. , -355./33. , 46732./5247. , 49./176. , -5103./18656. ] ,
+			[ 35./384. , 0. , 500./1113. , 125./192. , -2187./6784. , 11./84. ] ]
+DOPR5_E = np.array ( [ 71./57600. , 0. , -71./16695. , 71./1920. , -17253./339200. , 22./525. , -1./40. ] )
+
+#### 3 stages L-stable Rosenbrock coefficients (ROS3 of Sandu et al., 1997), for stiff populations
+ROS3_GAMMA = 0.43586652150845899941601945119356
+ROS3_C21 = -1.0156171083877702091975600115545
+ROS3_C31 = 4.0759956452537699824805835358067
+ROS3_C32 = 9.2076794298330791242156818474003
+ROS3_M = [ 1.0 , 6.1697947043828245592553615689730 , -0.42772256543218573326238373806514 ]
+ROS3_E = [ 0.5 , -2.9079558716805469821718236208017 , 0.22354069897811569627360909276199 ]
+
+
+#### counter-based random streams : one stream per cell, derived from a master seed and the cell index
+GOLDEN_GAMMA = np.uint64 (0x9E3779B97F4A7C15)
+
+def splitMix64 ( x ) :
+	z = np.asarray ( x , dtype=np.uint64 ) + GOLDEN_GAMMA
+	z = ( z ^ ( z >> np.uint64(30) ) ) * np.uint64 (0xBF58476D1CE4E5B9)
+	z = ( z ^ ( z >> np.uint64(27) ) ) * np.uint64 (0x94D049BB133111EB)
+	return z ^ ( z >> np.uint64(31) )
+
+def cellStreamKeys ( masterSeed , cellIndexes ) :
+	seedKey = splitMix64 ( np.array([masterSeed],dtype=np.uint64) )
+	return splitMix64 ( seedKey + np.asarray(cellIndexes,dtype=np.uint64) * GOLDEN_GAMMA )
+
+def drawCellUniforms ( keys , counters ) :
+	# uniform in (0,1], the n-th draw of a cell only depends on its key and on n
+	bits = splitMix64 ( keys + np.asarray(counters,dtype=np.uint64) * GOLDEN_GAMMA )
+	return ( ( bits >> np.uint64(11) ) + np.uint64(1) ) * 2.**-53
+
+
+#### binary checkpoints of populations (same layout as Checkpoint.cpp) : a 256 bytes header, then
+#### contiguous little-endian arrays, each starting on a 64 bytes boundary so that they can be memory-mapped
+CHECKPOINT_MAGIC = b"FPSTCKP1"
+CHECKPOINT_HEADER = np.dtype ( [ ("magic","S8") , ("headerSize","<u8") , ("numCells","<i8") , ("numAllProteinSpecies","<i8") , ("numGenes","<i8") ,
+								("randomSeed","<u8") , ("generatorState","<u8",(3,)) , ("modelHash","S40") , ("flags","<u8") , ("unused1","V8") ,
+								("offsets","<u8",(4,)) , ("unused2","V96") ] )
+CHECKPOINT_FIELDS = [ ("AllProts","<f8") , ("GeneMrnas","<f8") , ("CellIndexes","<i8") , ("RandomCounters","<u8") ]
+CHECKPOINT_GLOBAL_GENERATOR = 1 # flag of the checkpoints of Checkpoint.cpp : one generator state, no cell streams
+
+def readCheckpointHeader ( path ) :
+	header = np.fromfile ( path , dtype=CHECKPOINT_HEADER , count=1 )
+	if len(header) == 0 or header[0]["magic"] != CHECKPOINT_MAGIC : raise Exception ("Not a checkpoint file.")
+	return header[0]
+
+
+#### numerical description of a model (python counterpart of ModelParameters.cpp)
+class ModelParameters (object) :
+	def __init__ ( self , model ) :
+		self.name = model.name
+		self.NumGenes = len(model.nativeProteins)
+		self.NumModifiedProteins = len(model.modifiedProteins)
+		self.NumAllProteinSpecies = self.NumGenes + self.NumModifiedProteins
+		self.NumReacs = len(model.signalingReactions)
+		self.speciesNames = [ nprot.name for nprot in model.nativeProteins ] + [ mprot.name for mprot in model.modifiedProteins ]
+		self.reactionNames = [ reac.name for reac in model.signalingReactions ]
+		self.speciesIndexes = dict ( (name,idx) for idx,name in enumerate(self.speciesNames) )
+		self.eliminatedSpecies = dict ( (elim.name,elim) for elim in model.eliminatedSpecies ) # see FluctuProtSTModel.giveReducedModel
+		self.ModelHash = model.giveModelHash ()
+
+		# gene expression parameters
+		self.kons = np.array ( [ nprot.kon for nprot in model.nativeProteins ] , dtype=float )
+		self.koffs = np.array ( [ nprot.koff for nprot in model.nativeProteins ] , dtype=float )
+		self.ksms = np.array ( [ nprot.ksm for nprot in model.nativeProteins ] , dtype=float )
+		self.rms = np.array ( [ nprot.rm for nprot in model.nativeProteins ] , dtype=float )
+		self.ksps = np.array ( [ nprot.ksp for nprot in model.nativeProteins ] , dtype=float )
+		self.rps = np.array ( [ nprot.rp for nprot in model.nativeProteins ] , dtype=float )
+
+		# signaling parameters
+		self.kreacs = np.array ( [ reac.rate[1] for reac in model.signalingReactions ] , dtype=float )
+		self.degrates = np.array ( [ mprot.degRate for mprot in model.modifiedProteins ] , dtype=float )
+		self.protDegRates = np.concatenate ( (self.rps,self.degrates) )
+
+		# reactant indexes : first reactant of each reaction, then (reactions,species) pairs for the next ones
+		maxOrder = max ( [ len(reac.reactants) for reac in model.signalingReactions ] + [1] )
+		self.firstReactantIndexes = np.array ( [ self.speciesIndexes[reac.reactants[0]] for reac in model.signalingReactions ] , dtype=int )
+		self.higherOrderReactants = []
+		for k in range(1,maxOrder) :
+			reacs = [ idxReac for idxReac,reac in enumerate(model.signalingReactions) if len(reac.reactants) > k ]
+			species = [ self.speciesIndexes[model.signalingReactions[idxReac].reactants[k]] for idxReac in reacs ]
+			self.higherOrderReactants.append ( ( np.array(reacs,dtype=int) , np.array(species,dtype=int) ) )
+
+		# net stoichiometry (species x reactions), sparse
+		rows , cols , vals = [] , [] , []
+		for idxReac,reac in enumerate(model.signalingReactions) :
+			for reactant in reac.reactants : rows.append (self.speciesIndexes[reactant]) ; cols.append (idxReac) ; vals.append (-1.)
+			for product in reac.products : rows.append (self.speciesIndexes[product]) ; cols.append (idxReac) ; vals.append (1.)
+		self.stoichiometry = scipy.sparse.csr_matrix ( (vals,(rows,cols)) , shape=(self.NumAllProteinSpecies,self.NumReacs) )
+		self.stoichiometry.sum_duplicates ()
+		self.stoichiometry.eliminate_zeros ()
+
+		# jacobian of the protein ODE, with the structure given by the symbolic rate derivatives of the model :
+		# d rate[j] / d y[i] = multiplicity * kreacs[j] * prod(y[others]), then spread by the stoichiometry of j
+		rateDerivatives = model.giveRateDerivatives ()
+		self.NumRateDerivatives = len(rateDerivatives)
+		self.derivativeReacs = np.array ( [ d[0] for d in rateDerivatives ] , dtype=int )
+		self.derivativeMultiplicities = np.array ( [ d[2] for d in rateDerivatives ] , dtype=float )
+		self.derivativeOtherReactants = []
+		for k in range(maxOrder-1) :
+			derivs = [ idxDeriv for idxDeriv,d in enumerate(rateDerivatives) if len(d[3]) > k ]
+			species = [ rateDerivatives[idxDeriv][3][k] for idxDeriv in derivs ]
+			self.derivativeOtherReactants.append ( ( np.array(derivs,dtype=int) , np.array(species,dtype=int) ) )
+		stoichCsc = self.stoichiometry.tocsc ()
+		entries = [ (i,i,-1,0.) for i in range(self.NumAllProteinSpecies) ] # diagonal, filled with degradation rates
+		for idxDeriv,(idxReac,idxProt,multiplicity,others) in enumerate(rateDerivatives) :
+			for k in range(stoichCsc.indptr[idxReac],stoichCsc.indptr[idxReac+1]) :
+				entries.append ( ( stoichCsc.indices[k] , idxProt , idxDeriv , stoichCsc.data[k] ) )
+		pattern = sorted ( set ( (row,col) for row,col,idxDeriv,coef in entries ) )
+		position = dict ( (rc,k) for k,rc in enumerate(pattern) )
+		self.jacobianIndices = np.array ( [ col for row,col in pattern ] , dtype=np.int32 )
+		self.jacobianIndptr = np.searchsorted ( [ row for row,col in pattern ] , np.arange(self.NumAllProteinSpecies+1) ).astype (np.int32)
+		self.jacobianFlatIndexes = np.array ( [ row*self.NumAllProteinSpecies+col for row,col in pattern ] , dtype=int )
+		self.jacobianDiagonal = np.array ( [ position[(i,i)] for i in range(self.NumAllProteinSpecies) ] , dtype=int )
+		assembly = [ (position[(row,col)],idxDeriv,coef) for row,col,idxDeriv,coef in entries if idxDeriv >= 0 ]
+		self.jacobianAssembly = scipy.sparse.csr_matrix ( ( [ a[2] for a in assembly ] , ( [ a[0] for a in assembly ] , [ a[1] for a in assembly ] ) ) ,
+															shape=(len(pattern),self.NumRateDerivatives) )
+
+		# threshold events : the event functions eventMatrix y - eventConstants cross zero at the events
+		self.NumEvents = len(model.events)
+		self.eventNames = [ event.name for event in model.events ]
+		self.eventMatrix = np.zeros ( (self.NumEvents,self.NumAllProteinSpecies) )
+		self.eventConstants = np.zeros (self.NumEvents)
+		for idxEvent,event in enumerate(model.events) :
+			coefficients , self.eventConstants[idxEvent] = model.giveEventCoefficients (event)
+			for idxProt,coefficient in coefficients.items () : self.eventMatrix[idxEvent,idxProt] = coefficient
+		self.eventSparseMatrix = scipy.sparse.csr_matrix (self.eventMatrix)
+		self.eventDirections = np.array ( [ event.direction for event in model.events ] , dtype=int )
+		self.eventTerminal = np.array ( [ event.terminal for event in model.events ] , dtype=bool )
+
+	def giveProteinIndexFromName ( self , name ) :
+		if name not in self.speciesIndexes : raise Exception ("Protein does not exist.")
+		return self.speciesIndexes[name]
+
+	def giveLevels ( self , name , allProts ) :
+		# levels of a species in allProts (species along the last axis), reconstructed for an eliminated species
+		if name not in self.eliminatedSpecies : return allProts[...,self.giveProteinIndexFromName(name)]
+		elim = self.eliminatedSpecies[name]
+		levels = 0.
+		for kreac,reactants in elim.productions :
+			term = kreac / elim.lossRate
+			for prot in reactants : term = term * self.giveLevels ( prot , allProts )
+			levels = levels + term
+		return levels
+
+	def giveModelHash ( self ) :
+		return self.ModelHash
+
+	def computeEventFunctions ( self , y ) :
+		return self.computeEventSlopes (y) - self.eventConstants
+
+	def computeEventSlopes ( self , dydx ) :
+		# eventMatrix times dydx, cell by cell : as in applyStoichiometry, the sparse product sums each row in
+		# a fixed order, so that the value of a cell does not depend on the other cells of the batch
+		return self.eventSparseMatrix.dot ( np.ascontiguousarray(dydx.T) ).T
+
+	def computeReactionRates ( self , y ) :
+		# y has shape (NumAllProteinSpecies,) or (NumCells,NumAllProteinSpecies)
+		rates = y.take ( self.firstReactantIndexes , axis=-1 )
+		rates *= self.kreacs
+		for reacs,species in self.higherOrderReactants :
+			rates[...,reacs] *= y.take ( species , axis=-1 )
+		return rates
+
+	def computeDerivatives ( self , y , mrnas ) :
+		# mrnas has shape (NumGenes,) or (NumCells,NumGenes)
+		dydx = y * ( - self.protDegRates )
+		dydx[...,:self.NumGenes] += self.ksps * mrnas
+		if self.NumReacs > 0 : dydx += self.applyStoichiometry ( self.computeReactionRates(y) )
+		return dydx
+
+	def computeRateDerivatives ( self , y ) :
+		derivatives = self.derivativeMultiplicities * self.kreacs[self.derivativeReacs] * np.ones ( y.shape[:-1]+(1,) )
+		for derivs,species in self.derivativeOtherReactants :
+			derivatives[...,derivs] *= y.take ( species , axis=-1 )
+		return derivatives
+
+	def computeJacobianData ( self , y ) :
+		# non-zero entries of the jacobian, in the order of jacobianIndices/jacobianIndptr
+		data = self.jacobianAssembly.dot ( np.ascontiguousarray(self.computeRateDerivatives(y).T) ).T
+		data[...,self.jacobianDiagonal] -= self.protDegRates
+		return data
+
+	def computeJacobian ( self , y ) :
+		n = self.NumAllProteinSpecies
+		return scipy.sparse.csr_matrix ( ( self.computeJacobianData(y) , self.jacobianIndices , self.jacobianIndptr ) , shape=(n,n) )
+
+	def computeDenseJacobians ( self , y ) :
+		# y has shape (NumCells,NumAllProteinSpecies), result has shape (NumCells,NumAllProteinSpecies,NumAllProteinSpecies)
+		n = self.NumAllProteinSpecies
+		jacobians = np.zeros ( (y.shape[0],n*n) )
+		jacobians[:,self.jacobianFlatIndexes] = self.computeJacobianData (y)
+		return jacobians.reshape ( (y.shape[0],n,n) )
+
+	def applyStoichiometry ( self , rates ) :
+		# the sparse product sums each row in a fixed order, so the result of a cell
+		# does not depend on the other cells of the batch (unlike blas)
+		return self.stoichiometry.dot ( np.ascontiguousarray(rates.T) ).T
+
+
+#### exact stationary moments of the native part of a model (telegraph gene, mrna, native protein)
+# For each gene with state s (1 if on), mrna m and native protein y, the first and second
+# moments of (s,m,y) close and are solved in closed form.
+class NativeSteadyStateMoments (object) :
+	def __init__ ( self , modelParameters ) :
+		p = modelParameters
+		if np.any ( p.rms <= 0. ) or np.any ( p.rps <= 0. ) : raise Exception ("Native steady-state needs positive mrna and protein degradation rates.")
+		kon , koff , ksm , rm , ksp , rp = p.kons , p.koffs , p.ksms , p.rms , p.ksps , p.rps
+		k = kon + koff
+		self.GeneOn = kon / k
+		self.Mrna = ksm * self.GeneOn / rm
+		self.Prot = ksp * self.Mrna / rp
+		Esm = ( kon * self.Mrna + ksm * self.GeneOn ) / ( k + rm )
+		Emm = ( ksm * ( 2. * Esm + self.GeneOn ) + rm * self.Mrna ) / ( 2. * rm )
+		Esy = ( kon * self.Prot + ksp * Esm ) / ( k + rp )
+		Emy = ( ksm * Esy + ksp * Emm ) / ( rm + rp )
+		Eyy = ksp * Emy / rp
+		self.VarGene = self.GeneOn * ( 1. - self.GeneOn )
+		self.VarMrna = Emm - self.Mrna**2
+		self.VarProt = Eyy - self.Prot**2
+		self.CovGeneMrna = Esm - self.GeneOn * self.Mrna
+		self.CovGeneProt = Esy - self.GeneOn * self.Prot
+		self.CovMrnaProt = Emy - self.Mrna * self.Prot
+
+	def giveProtRegression ( self ) :
+		# best linear prediction of y from (s,m) : y ~ Prot + betaGene (s-GeneOn) + betaMrna (m-Mrna),
+		# and the variance left unexplained
+		det = self.VarGene * self.VarMrna - self.CovGeneMrna**2
+		full = det > 1e-12 * np.maximum ( self.VarGene * self.VarMrna , 1e-300 )
+		safeDet = np.where ( full , det , 1. )
+		safeVarMrna = np.where ( self.VarMrna > 0. , self.VarMrna , 1. )
+		betaGene = np.where ( full , ( self.VarMrna * self.CovGeneProt - self.CovGeneMrna * self.CovMrnaProt ) / safeDet , 0. )
+		betaMrna = np.where ( full , ( self.VarGene * self.CovMrnaProt - self.CovGeneMrna * self.CovGeneProt ) / safeDet ,
+								np.where ( self.VarMrna > 0. , self.CovMrnaProt / safeVarMrna , 0. ) )
+		residualVar = self.VarProt - betaGene * self.CovGeneProt - betaMrna * self.CovMrnaProt
+		return betaGene , betaMrna , np.maximum ( residualVar , 0. )
+
+
+#### draw gene states, mrnas and native proteins of numCells cells from the native steady-state
+# Gene state and mrna follow the exact stationary law of the telegraph model : given the
+# gene state, m ~ Poisson(ksm/rm * q) with q ~ Beta(kon/rm+1,koff/rm) if on and
+# q ~ Beta(kon/rm,koff/rm+1) if off (the mixture is the usual beta-Poisson law).
+# Native proteins are drawn from a gamma law conditioned on (s,m) with the exact first
+# and second moments, which only leaves higher moments to be relaxed by simulation.
+# Each law is drawn by inversion of one uniform : uniforms[cell,k,gene] for the gene state (k=0),
+# q (1), the mrna (2) and the protein (3).
+def drawNativeSteadyStateFromUniforms ( modelParameters , uniforms ) :
+	p = modelParameters
+	u = np.clip ( uniforms , 2.**-53 , 1.-2.**-53 )
+	numCells , G = u.shape[0] , p.NumGenes
+	moments = NativeSteadyStateMoments (p)
+	on = u[:,0] < moments.GeneOn
+	a , b = p.kons / p.rms , p.koffs / p.rms
+	safeA , safeB = np.where ( a > 0. , a , 1. ) , np.where ( b > 0. , b , 1. )
+	q = np.where ( on , scipy.special.betaincinv ( safeA+1. , safeB , u[:,1] ) , scipy.special.betaincinv ( safeA , safeB+1. , u[:,1] ) )
+	q[ :, b == 0. ] = 1. # never switches off
+	q[ :, a == 0. ] = 0. # never switches on
+	geneMrnas = np.empty ( (numCells,3*G) )
+	geneMrnas[:,0::3] = on
+	geneMrnas[:,1::3] = ~on
+	geneMrnas[:,2::3] = scipy.stats.poisson.ppf ( u[:,2] , p.ksms / p.rms * q )
+	betaGene , betaMrna , residualVar = moments.giveProtRegression ()
+	means = moments.Prot + betaGene * ( geneMrnas[:,0::3] - moments.GeneOn ) + betaMrna * ( geneMrnas[:,2::3] - moments.Mrna )
+	means = np.maximum ( means , 0. )
+	random = ( residualVar > 0. ) & ( means > 0. )
+	shapes = np.where ( random , means**2 / np.where(random,residualVar,1.) , 1. )
+	prots = np.where ( random , scipy.special.gammaincinv ( shapes , u[:,3] ) * np.where(random,means/shapes,1.) , means )
+	return geneMrnas , prots
+
+def drawNativeSteadyState ( modelParameters , rng , numCells ) :
+	return drawNativeSteadyStateFromUniforms ( modelParameters , rng.random ( (numCells,4,modelParameters.NumGenes) ) )
+
+# the uniforms of the native draw of cells : a counter-based stream per cell, distinct from its simulation stream,
+# so that a cell only depends on the seed and on its index (not on the size of its population)
+NATIVE_DRAW_KEY = np.uint64 (0x6A09E667F3BCC909)
+
+def drawCellNativeUniforms ( masterSeed , cellIndexes , numGenes ) :
+	keys = splitMix64 ( cellStreamKeys ( masterSeed , cellIndexes ) ^ NATIVE_DRAW_KEY )
+	counters = np.arange ( 4*numGenes , dtype=np.uint64 )
+	return drawCellUniforms ( keys[:,None] , counters[None,:] ).reshape ( (len(keys),4,numGenes) )
+
+
+#### mean mrna level of each gene, at least one : the scale of the leaps of MrnaSimulator
+def giveMrnaScales ( modelParameters ) :
+	p = modelParameters
+	scales = np.ones ( p.NumGenes )
+	ok = ( p.rms > 0. ) & ( p.kons + p.koffs > 0. )
+	scales[ok] = np.maximum ( p.ksms[ok] * p.kons[ok] / ( ( p.kons[ok] + p.koffs[ok] ) * p.rms[ok] ) , 1. )
+	return scales
+
+
+#### state of a cell (python counterpart of CellState.cpp)
+class CellState (object) :
+	def __init__ ( self , modelParameters ) :
+		self.mf_ModelParameters = modelParameters
+		G = modelParameters.NumGenes
+		self.AllProts = np.zeros ( modelParameters.NumAllProteinSpecies )
+		self.GeneMrnas = np.zeros ( 3*G )
+		EG = modelParameters.kons / ( modelParameters.kons + modelParameters.koffs )
+		EM = EG * modelParameters.ksms / modelParameters.rms
+		self.GeneMrnas[0::3] = 1. # gene on
+		self.GeneMrnas[2::3] = np.floor (EM) # mrna ~ mean
+		self.AllProts[:G] = EM * modelParameters.ksps / modelParameters.rps
+
+	def getLevel ( self , name ) :
+		return self.mf_ModelParameters.giveLevels ( name , self.AllProts )
+
+	def setLevel ( self , name , value ) :
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt < self.mf_ModelParameters.NumGenes : raise Exception ("Cannot set the level of a nativeProt.")
+		self.AllProts[idxProt] = value
+
+	def getMrnaLevel ( self , name ) :
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt >= self.mf_ModelParameters.NumGenes : raise Exception ("Not a nativeProt.")
+		return self.GeneMrnas[3*idxProt+2]
+
+
+#### gene/mrna jump process (python counterpart of MrnaSimulator.cpp)
+# genes never interact, so each gene is sampled exactly with its own next event time
+# (next reaction method) : a step only touches the gene that fires.
+# With leapEpsilon > 0, the mrna reactions of a gene are grouped into leaps (see MrnaSimulator.hpp) : the gene
+# switches stay exact, the mrna level at the end of a leap is drawn from its exact law, and its change is
+# applied in the middle of the leap.
+class MrnaSimulator (object) :
+	def __init__ ( self , modelParameters , seed = 1 , leapEpsilon = 0. ) :
+		self.mf_ModelParameters = modelParameters
+		self.ran = np.random.default_rng (seed)
+		self.t = 0.
+		self.lastReaction = -1 # reaction fired by the last doStep, -1 if none
+		self.lastMrnaChange = 0. # change of the mrna level of gene lastReaction//4 by the last doStep
+		self.lastSwitchedGene = -1 # gene switched by the last doStep (possibly with an mrna change in leap mode), -1 if none
+		self.LeapEpsilon = leapEpsilon # 0 for the exact simulation
+		self.LeapMinEvents = 2.
+		self.NumLeaps = 0
+		# reaction m = 4*g+r, with r in (gene off, gene on, transcription, mrna decay)
+		G = modelParameters.NumGenes
+		self.outchg = np.zeros ( (4*G,3*G) )
+		for g in range(G) :
+			self.outchg[4*g+0,3*g+0] = -1. ; self.outchg[4*g+0,3*g+1] = 1.
+			self.outchg[4*g+1,3*g+0] = 1. ; self.outchg[4*g+1,3*g+1] = -1.
+			self.outchg[4*g+2,3*g+2] = 1.
+			self.outchg[4*g+3,3*g+2] = -1.
+
+	def prepareForSteps ( self , cellState ) :
+		G = self.mf_ModelParameters.NumGenes
+		self.t = 0.
+		self.NumLeaps = 0
+		self.a = np.empty ( (G,4) )
+		self.nextTimes = np.empty (G)
+		if self.LeapEpsilon > 0. :
+			self.mrnaScales = giveMrnaScales ( self.mf_ModelParameters )
+			self.switchTimes = np.empty (G)
+			self.mrnaTimes = np.empty (G)
+			self.leapStarts = np.full ( G , -1. )
+			self.leapEnds = np.zeros (G)
+			self.leapChanges = np.zeros (G)
+		for g in range(G) :
+			self.a[g] = self.computeGeneRates ( cellState.GeneMrnas , g )
+			if self.LeapEpsilon > 0. :
+				self.scheduleSwitch (g)
+				self.scheduleMrna ( cellState.GeneMrnas , g )
+				self.nextTimes[g] = min ( self.switchTimes[g] , self.mrnaTimes[g] )
+			else : self.scheduleGene (g)
+
+	def doStep ( self , cellState , targetTime ) :
+		self.lastReaction = -1
+		self.lastMrnaChange = 0.
+		self.lastSwitchedGene = -1
+		if len(self.nextTimes) == 0 :
+			self.t = targetTime
+			return self.t
+		g = np.argmin ( self.nextTimes )
+		if self.nextTimes[g] > targetTime :
+			if self.LeapEpsilon > 0. : self.endLeaps ( cellState.GeneMrnas , targetTime )
+			self.t = targetTime
+			return self.t
+		self.t = self.nextTimes[g]
+		if self.LeapEpsilon > 0. :
+			self.doLeapStep ( cellState.GeneMrnas , g )
+			return self.t
+		r = np.searchsorted ( np.cumsum(self.a[g]) , self.ran.random()*self.a[g].sum() , side='right' )
+		m = 4*g + min ( r , 3 )
+		self.lastReaction = m
+		self.lastMrnaChange = self.outchg[m,3*g+2]
+		if r < 2 : self.lastSwitchedGene = g
+		cellState.GeneMrnas += self.outchg[m]
+		self.a[g] = self.computeGeneRates ( cellState.GeneMrnas , g )
+		self.scheduleGene (g)
+		return self.t
+
+	def computeGeneRates ( self , geneMrnas , g ) :
+		p = self.mf_ModelParameters
+		on , off , mrna = geneMrnas[3*g] , geneMrnas[3*g+1] , geneMrnas[3*g+2]
+		return np.array ( [ p.koffs[g]*on , p.kons[g]*off , p.ksms[g]*on , p.rms[g]*mrna ] )
+
+	def scheduleGene ( self , g ) :
+		asum = self.a[g].sum ()
+		self.nextTimes[g] = self.t - np.log ( self.ran.random() ) / asum if asum > 0. else np.inf
+
+	# leap mode : gene g has the earliest next time, either its switch, its next mrna reaction, or the middle
+	# or the end of its current leap (a leap stopped by a switch ends at the switch time, both are then done)
+	def doLeapStep ( self , s , g ) :
+		switched = self.switchTimes[g] <= self.t
+		if self.mrnaTimes[g] <= self.switchTimes[g] :
+			if self.leapStarts[g] >= 0. and self.t < self.leapEnds[g] :
+				self.lastMrnaChange = self.leapChanges[g]
+				s[3*g+2] += self.lastMrnaChange
+				self.lastReaction = 4*g + ( 2 if self.lastMrnaChange >= 0. else 3 )
+				self.mrnaTimes[g] = self.leapEnds[g]
+				self.nextTimes[g] = min ( self.switchTimes[g] , self.mrnaTimes[g] )
+				return
+			if self.leapStarts[g] < 0. :
+				self.lastMrnaChange = 1. if self.ran.random()*(self.a[g,2]+self.a[g,3]) < self.a[g,2] else -1.
+				s[3*g+2] += self.lastMrnaChange
+				self.lastReaction = 4*g + ( 2 if self.lastMrnaChange >= 0. else 3 )
+		if switched :
+			if self.lastReaction < 0 : self.lastReaction = 4*g + ( 0 if s[3*g] == 1. else 1 )
+			self.lastSwitchedGene = g
+			s[3*g] = 1. - s[3*g]
+			s[3*g+1] = 1. - s[3*g+1]
+		self.a[g] = self.computeGeneRates ( s , g )
+		if switched : self.scheduleSwitch (g)
+		self.scheduleMrna ( s , g )
+		self.nextTimes[g] = min ( self.switchTimes[g] , self.mrnaTimes[g] )
+
+	def endLeaps ( self , s , targetTime ) :
+		# the leaps in progress are ended at targetTime, with the mrna levels drawn at targetTime
+		self.t = targetTime
+		for g in np.nonzero ( self.leapStarts >= 0. ) [0] :
+			if self.mrnaTimes[g] == self.leapEnds[g] : s[3*g+2] -= self.leapChanges[g] # back to the level at the leap start
+			s[3*g+2] += self.drawLeapChange ( s , g , self.t - self.leapStarts[g] )
+			self.a[g] = self.computeGeneRates ( s , g )
+			self.scheduleMrna ( s , g )
+			self.nextTimes[g] = min ( self.switchTimes[g] , self.mrnaTimes[g] )
+
+	def drawLeapChange ( self , s , g , duration ) :
+		# surviving mrnas ~ Binomial(mrna,exp(-rm*duration)), new ones ~ Poisson(ksm*on*(1-exp(-rm*duration))/rm)
+		rm = self.mf_ModelParameters.rms[g]
+		survival = np.exp ( - rm * duration )
+		change = self.ran.binomial ( int(s[3*g+2]) , survival ) - s[3*g+2]
+		if self.a[g,2] > 0. : change += self.ran.poisson ( self.a[g,2]*(1.-survival)/rm if rm > 0. else self.a[g,2]*duration )
+		return change
+
+	def scheduleSwitch ( self , g ) :
+		rate = self.a[g,0] + self.a[g,1]
+		self.switchTimes[g] = self.t - np.log ( self.ran.random() ) / rate if rate > 0. else np.inf
+
+	def scheduleMrna ( self , s , g ) :
+		# the leap length only depends on the gene state (see MrnaSimulator::scheduleMrna)
+		p = self.mf_ModelParameters
+		self.leapStarts[g] = -1.
+		rate = self.a[g,2] + self.a[g,3]
+		if rate == 0. :
+			self.mrnaTimes[g] = np.inf
+			return
+		birth = p.ksms[g] if self.a[g,2] > 0. else 0.
+		death = p.rms[g] * self.mrnaScales[g]
+		bound = self.LeapEpsilon * self.mrnaScales[g]
+		tau = bound**2 / ( birth + death )
+		if birth != death : tau = min ( tau , bound / abs(birth-death) )
+		tau = min ( tau * ( 1. - 0.5 * self.ran.random() ) , self.switchTimes[g] - self.t )
+		if ( birth + death ) * tau >= self.LeapMinEvents :
+			self.leapStarts[g] = self.t
+			self.leapEnds[g] = self.switchTimes[g] if tau == self.switchTimes[g] - self.t else self.t + tau
+			self.leapChanges[g] = self.drawLeapChange ( s , g , self.leapEnds[g] - self.t )
+			self.mrnaTimes[g] = self.t + 0.5 * ( self.leapEnds[g] - self.t )
+			self.NumLeaps += 1
+		else : self.mrnaTimes[g] = self.t - np.log ( self.ran.random() ) / rate
+
+	def sampleFromOnlyNativeSteadyState ( self , toReachSteadyStateDuration ) :
+		cell = CellState (self.mf_ModelParameters)
+		self.relaxNativeProteins ( cell , toReachSteadyStateDuration )
+		return cell
+
+	def sampleFromTelegraphSteadyState ( self , relaxationDuration ) :
+		# exact draw of genes and mrnas, moment-matched draw of native proteins, then a short relaxation
+		cell = CellState (self.mf_ModelParameters)
+		geneMrnas , prots = drawNativeSteadyState ( self.mf_ModelParameters , self.ran , 1 )
+		cell.GeneMrnas[:] = geneMrnas[0]
+		cell.AllProts[:self.mf_ModelParameters.NumGenes] = prots[0]
+		self.relaxNativeProteins ( cell , relaxationDuration )
+		return cell
+
+	def relaxNativeProteins ( self , cell , duration ) :
+		# native proteins follow the jump process exactly : between events, they relax exponentially
+		p = self.mf_ModelParameters
+		self.prepareForSteps (cell)
+		while self.t < duration :
+			# the proteins relax towards the levels set by the mrnas before the step
+			pss = p.ksps * cell.GeneMrnas[2::3] / p.rps
+			oldt = self.t
+			newt = self.doStep ( cell , duration )
+			dt = newt - oldt
+			cell.AllProts[:p.NumGenes] = pss + ( cell.AllProts[:p.NumGenes] - pss ) * np.exp ( - p.rps * dt )
+
+
+#### a bounded chunk of the mrna trajectory : mrna levels at chunk start, then one entry
+#### per event that changed a mrna level, and the gene switches (only used to set a cell back
+#### to its state at the time of a terminal event)
+class MrnaChunk (object) :
+	def __init__ ( self , numGenes , maxEvents ) :
+		self.startMrnas = np.zeros (numGenes)
+		self.times = np.zeros (maxEvents)
+		self.genes = np.zeros ( maxEvents , dtype=int )
+		self.newMrnas = np.zeros (maxEvents)
+		self.oldMrnas = np.zeros (maxEvents)
+		self.numEvents = 0
+		self.maxEvents = maxEvents
+		self.switchTimes = np.zeros (maxEvents)
+		self.switchGenes = np.zeros ( maxEvents , dtype=int )
+		self.numSwitches = 0
+
+
+#### ODE right-hand side of the hybrid model (python counterpart of HybridRhs.cpp)
+class HybridRhs (object) :
+	def __init__ ( self , modelParameters ) :
+		self.mf_ModelParameters = modelParameters
+		self.nevals = 0
+
+	def setMrnaChunk ( self , mrnaChunk ) :
+		self.mrnaChunk = mrnaChunk
+		self.tindex = 0 # number of chunk events applied to mrnas
+		self.mrnas = mrnaChunk.startMrnas.copy ()
+		self.constantMrnas = False # true when integrating between two mrna events : no lookup needed
+
+	def findGoodTindex ( self , x ) :
+		# walk forward/backward over the events of the chunk, updating only the changed mrnas
+		c = self.mrnaChunk
+		while self.tindex < c.numEvents and c.times[self.tindex] <= x :
+			self.mrnas[c.genes[self.tindex]] = c.newMrnas[self.tindex]
+			self.tindex += 1
+		while self.tindex > 0 and c.times[self.tindex-1] > x :
+			self.tindex -= 1
+			self.mrnas[c.genes[self.tindex]] = c.oldMrnas[self.tindex]
+
+	def applyNextMrnaEvent ( self ) :
+		c = self.mrnaChunk
+		self.mrnas[c.genes[self.tindex]] = c.newMrnas[self.tindex]
+		self.tindex += 1
+
+	def __call__ ( self , x , y ) :
+		self.nevals += 1
+		if not self.constantMrnas : self.findGoodTindex (x)
+		return self.mf_ModelParameters.computeDerivatives ( y , self.mrnas )
+
+
+#### hybrid simulator (python counterpart of HybridSimulator.cpp)
+# The mrna trajectory is generated lazily, one bounded chunk ahead of the ODE integration,
+# so that memory does not grow with the simulated duration.
+class HybridSimulator (object) :
+	def __init__ ( self , modelParameters , randomSeed = 1 , breakAtMrnaEvents = False , odeMethod = "RK45" , leapEpsilon = 0. ) :
+		self.mf_ModelParameters = modelParameters
+		self.mf_MrnaSimulator = MrnaSimulator ( modelParameters , randomSeed , leapEpsilon )
+		self.mf_HybridRhs = HybridRhs ( modelParameters )
+		self.BreakAtMrnaEvents = breakAtMrnaEvents # integrate piecewise between mrna events instead of stepping across them
+		self.ChunkMaxEvents = 10000
+		self.mf_MrnaChunk = MrnaChunk ( modelParameters.NumGenes , self.ChunkMaxEvents )
+		self.AbsTolNumErr = 1e-6
+		self.RelTolNumErr = 1e-6
+		self.OdeMethod = odeMethod # any solve_ivp method; stiff ones (Radau, BDF, LSODA) get the analytic sparse jacobian
+		self.CheckEvents = True # set to False to ignore the events of the model, e.g. during equilibration
+
+	def resetStatistics ( self ) :
+		self.NumSteps = 0
+		self.NumRhsEvals = 0
+		self.NumJacobianEvals = 0
+		self.NumLuDecompositions = 0
+
+	def jacobian ( self , x , y ) :
+		if self.OdeMethod == "LSODA" : return self.mf_ModelParameters.computeJacobian(y).toarray ()
+		return self.mf_ModelParameters.computeJacobian (y)
+
+	def simulate ( self , cellState , duration , observationTimes = None , speciesNames = None ) :
+		# with observationTimes (sorted, in [0,duration]) and speciesNames, the levels of these species are
+		# returned as a (NumSpecies,NumTimes) array, filled by dense output during the integration.
+		# EventTimes holds the first crossing time of each event of the model (nan if none); a terminal event
+		# stops the simulation at its crossing, StoppingEvent is then its index and StopTime its time.
+		self.mf_MrnaSimulator.prepareForSteps ( cellState )
+		self.EventObtained = 0
+		self.resetStatistics ()
+		self.prepareObservations ( cellState , duration , observationTimes , speciesNames )
+		self.EventTimes = np.full ( self.mf_ModelParameters.NumEvents , np.nan )
+		self.StoppingEvent = -1
+		tStart = 0.
+		while tStart < duration and self.StoppingEvent < 0 :
+			tEnd = self.computeNextMrnaChunk ( cellState , duration )
+			self.mf_HybridRhs.setMrnaChunk ( self.mf_MrnaChunk )
+			if self.BreakAtMrnaEvents : self.integrateBetweenMrnaEvents ( cellState , tStart , tEnd )
+			else : self.integrate ( cellState , tStart , tEnd )
+			tStart = tEnd
+		self.StopTime = duration if self.StoppingEvent < 0 else self.EventTimes[self.StoppingEvent]
+		if self.StoppingEvent >= 0 :
+			# the genes and mrnas are set back to their states at the stop : the switches after it are undone
+			self.mf_HybridRhs.findGoodTindex ( self.StopTime )
+			cellState.GeneMrnas[2::3] = self.mf_HybridRhs.mrnas
+			chunk = self.mf_MrnaChunk
+			for k in range(chunk.numSwitches-1,-1,-1) :
+				if chunk.switchTimes[k] <= self.StopTime : break
+				g = chunk.switchGenes[k]
+				cellState.GeneMrnas[3*g:3*g+2] = 1. - cellState.GeneMrnas[3*g:3*g+2]
+			if self.Observations is not None : self.Observations[:,self.NextObservation:] = np.nan
+		return self.Observations
+
+	def prepareObservations ( self , cellState , duration , observationTimes , speciesNames ) :
+		self.Observations = None
+		if observationTimes is None : return
+		self.ObservationTimes = np.asarray ( observationTimes , dtype=float )
+		if np.any ( np.diff(self.ObservationTimes) < 0. ) or np.any ( self.ObservationTimes < 0. ) or np.any ( self.ObservationTimes > duration ) :
+			raise Exception ("Observation times must be sorted and within the simulated duration.")
+		self.ObservedSpecies = [ self.mf_ModelParameters.giveProteinIndexFromName(name) for name in speciesNames ]
+		self.Observations = np.empty ( ( len(self.ObservedSpecies) , len(self.ObservationTimes) ) )
+		self.NextObservation = np.searchsorted ( self.ObservationTimes , 0. , side="right" )
+		self.Observations[:,:self.NextObservation] = cellState.AllProts[self.ObservedSpecies,None]
+
+	def giveEventFunctions ( self ) :
+		# solve_ivp events for the events of the model not crossed yet in this simulate
+		p = self.mf_ModelParameters
+		functions = []
+		if not self.CheckEvents : return functions
+		for k in np.nonzero ( np.isnan(self.EventTimes) ) [0] :
+			function = lambda t , y , k=k : np.dot ( p.eventMatrix[k] , y ) - p.eventConstants[k]
+			function.terminal = bool ( p.eventTerminal[k] )
+			function.direction = p.eventDirections[k]
+			function.index = k
+			functions.append (function)
+		return functions
+
+	def integrate ( self , cellState , tStart , tEnd ) :
+		if tEnd <= tStart or self.StoppingEvent >= 0 : return
+		options = {}
+		if self.OdeMethod in ["Radau","BDF","LSODA"] : options["jac"] = self.jacobian
+		observe = self.Observations is not None
+		events = self.giveEventFunctions ()
+		if len(events) > 0 : options["events"] = events
+		sol = solve_ivp ( self.mf_HybridRhs , (tStart,tEnd) , cellState.AllProts , method=self.OdeMethod ,
+							atol=self.AbsTolNumErr , rtol=self.RelTolNumErr , first_step=min(0.1,tEnd-tStart) , dense_output=observe , **options )
+		if not sol.success : raise Exception ("ODE integration failed: " + sol.message)
+		cellState.AllProts = sol.y[:,-1].copy ()
+		# solve_ivp locates the crossings on its dense output, and ends at the first terminal one
+		for function,times in zip ( events , sol.t_events or [] ) :
+			if len(times) == 0 : continue
+			self.EventTimes[function.index] = times[0]
+			if function.terminal and sol.status == 1 and times[0] == sol.t[-1] : self.StoppingEvent = function.index
+		if observe :
+			last = np.searchsorted ( self.ObservationTimes , sol.t[-1] , side="right" )
+			if last > self.NextObservation :
+				self.Observations[:,self.NextObservation:last] = sol.sol ( self.ObservationTimes[self.NextObservation:last] )[self.ObservedSpecies]
+				self.NextObservation = last
+		self.NumSteps += len(sol.t) - 1
+		self.NumRhsEvals += sol.nfev
+		self.NumJacobianEvals += sol.njev
+		self.NumLuDecompositions += sol.nlu
+
+	def integrateBetweenMrnaEvents ( self , cellState , tStart , tEnd ) :
+		# mrnas are constant between two events : each event is a hard breakpoint,
+		# so the stepper never steps across a discontinuity and the rhs needs no lookup
+		chunk = self.mf_MrnaChunk
+		self.mf_HybridRhs.constantMrnas = True
+		t = tStart
+		for k in range(chunk.numEvents+1) :
+			tEvent = chunk.times[k] if k < chunk.numEvents else tEnd
+			self.integrate ( cellState , t , tEvent )
+			if self.StoppingEvent >= 0 : break
+			t = max ( t , tEvent )
+			if k < chunk.numEvents : self.mf_HybridRhs.applyNextMrnaEvent ()
+		self.mf_HybridRhs.constantMrnas = False
+
+	def computeNextMrnaChunk ( self , cellState , duration ) :
+		chunk = self.mf_MrnaChunk
+		chunk.startMrnas[:] = cellState.GeneMrnas[2::3]
+		chunk.numEvents = 0
+		chunk.numSwitches = 0
+		t = self.mf_MrnaSimulator.t
+		while t < duration and chunk.numEvents < self.ChunkMaxEvents and chunk.numSwitches < self.ChunkMaxEvents :
+			t = self.mf_MrnaSimulator.doStep ( cellState , duration )
+			if self.mf_MrnaSimulator.lastSwitchedGene >= 0 :
+				chunk.switchTimes[chunk.numSwitches] = t
+				chunk.switchGenes[chunk.numSwitches] = self.mf_MrnaSimulator.lastSwitchedGene
+				chunk.numSwitches += 1
+			m = self.mf_MrnaSimulator.lastReaction
+			if m < 0 or self.mf_MrnaSimulator.lastMrnaChange == 0. : continue # no event, gene switch or empty leap : no mrna change
+			g = m // 4
+			k = chunk.numEvents
+			chunk.times[k] = t
+			chunk.genes[k] = g
+			chunk.newMrnas[k] = cellState.GeneMrnas[3*g+2]
+			chunk.oldMrnas[k] = cellState.GeneMrnas[3*g+2] - self.mf_MrnaSimulator.lastMrnaChange
+			chunk.numEvents += 1
+			self.EventObtained += 1
+		return t
+
+
+#### state of a population of cells, stored as contiguous (NumCells,species) arrays
+# Each cell also carries its global index and the number of random draws it consumed,
+# which define its own random stream (see drawCellUniforms).
+class CellPopulation (object) :
+	def __init__ ( self , modelParameters , numCells , firstCellIndex = 0 ) :
+		self.mf_ModelParameters = modelParameters
+		self.NumCells = numCells
+		cell = CellState (modelParameters)
+		self.AllProts = np.ascontiguousarray ( np.tile ( cell.AllProts , (numCells,1) ) )
+		self.GeneMrnas = np.ascontiguousarray ( np.tile ( cell.GeneMrnas , (numCells,1) ) )
+		self.CellIndexes = np.arange ( firstCellIndex , firstCellIndex+numCells , dtype=np.int64 )
+		self.RandomCounters = np.zeros ( numCells , dtype=np.uint64 )
+
+	@classmethod
+	def concatenate ( cls , populations ) :
+		population = cls ( populations[0].mf_ModelParameters , 0 )
+		population.NumCells = sum ( [ pop.NumCells for pop in populations ] )
+		for field in ["AllProts","GeneMrnas","CellIndexes","RandomCounters"] :
+			setattr ( population , field , np.concatenate ( [ getattr(pop,field) for pop in populations ] ) )
+		return population
+
+	def getSubPopulation ( self , cells ) :
+		population = CellPopulation ( self.mf_ModelParameters , 0 )
+		cells = np.arange(self.NumCells)[cells]
+		population.NumCells = len(cells)
+		for field in ["AllProts","GeneMrnas","CellIndexes","RandomCounters"] :
+			setattr ( population , field , np.ascontiguousarray ( getattr(self,field)[cells] ) )
+		return population
+
+	@classmethod
+	def fromNativeSteadyState ( cls , modelParameters , numCells , randomSeed = 1 , firstCellIndex = 0 ) :
+		# cells drawn from the native steady-state (see drawNativeSteadyStateFromUniforms), to be relaxed
+		# with PopulationSimulator.relaxNativeProteins ; cell i only depends on randomSeed and firstCellIndex+i
+		population = cls ( modelParameters , numCells , firstCellIndex )
+		uniforms = drawCellNativeUniforms ( randomSeed , population.CellIndexes , modelParameters.NumGenes )
+		geneMrnas , prots = drawNativeSteadyStateFromUniforms ( modelParameters , uniforms )
+		population.GeneMrnas[:] = geneMrnas
+		population.AllProts[:,:modelParameters.NumGenes] = prots
+		return population
+
+	@classmethod
+	def fromCells ( cls , cells ) :
+		population = cls ( cells[0].mf_ModelParameters , len(cells) )
+		for i,cell in enumerate(cells) :
+			population.AllProts[i] = cell.AllProts
+			population.GeneMrnas[i] = cell.GeneMrnas
+		return population
+
+	def saveCheckpoint ( self , path , randomSeed = 0 ) :
+		# randomSeed is the master seed of the cell streams, saved with their counters
+		p = self.mf_ModelParameters
+		header = np.zeros ( 1 , dtype=CHECKPOINT_HEADER )
+		header["magic"] = CHECKPOINT_MAGIC
+		header["headerSize"] = CHECKPOINT_HEADER.itemsize
+		header["numCells"] , header["numAllProteinSpecies"] , header["numGenes"] = self.NumCells , p.NumAllProteinSpecies , p.NumGenes
+		header["randomSeed"] = randomSeed
+		header["modelHash"] = p.giveModelHash().encode ()
+		offset = CHECKPOINT_HEADER.itemsize
+		arrays = []
+		for k,(field,dtype) in enumerate(CHECKPOINT_FIELDS) :
+			offset = (offset+63) // 64 * 64
+			arrays.append ( ( offset , np.ascontiguousarray ( getattr(self,field) , dtype=dtype ) ) )
+			header["offsets"][0,k] = offset
+			offset += arrays[-1][1].nbytes
+		with open ( path , "wb" ) as f :
+			f.write ( header.tobytes () )
+			for arrayOffset,array in arrays :
+				f.seek (arrayOffset)
+				f.write ( array.tobytes () )
+			f.truncate (offset)
+
+	@classmethod
+	def loadCheckpoint ( cls , modelParameters , path , mmapMode = "c" , newStreams = False ) :
+		# the arrays are memory-mapped : with mmapMode "c" (copy-on-write) the population can be modified
+		# without touching the file, "r" is read-only, None reads everything into memory.
+		# A checkpoint of the compiled simulator holds the state of its single generator, not the streams of the
+		# cells : it is only loaded with newStreams=True, which starts the streams of cells 0..NumCells-1 afresh.
+		header = readCheckpointHeader (path)
+		p = modelParameters
+		if header["modelHash"].decode () != p.giveModelHash () : raise Exception ("Checkpoint of another model.")
+		if header["numAllProteinSpecies"] != p.NumAllProteinSpecies or header["numGenes"] != p.NumGenes : raise Exception ("Checkpoint of another model.")
+		globalGenerator = ( int(header["flags"]) & CHECKPOINT_GLOBAL_GENERATOR ) != 0 or any ( header["generatorState"] != 0 )
+		if globalGenerator and not newStreams :
+			raise Exception ("Checkpoint of the compiled simulator, without cell streams to continue : load it with newStreams=True.")
+		N = int ( header["numCells"] )
+		population = cls ( p , 0 )
+		population.NumCells = N
+		shapes = [ (N,p.NumAllProteinSpecies) , (N,3*p.NumGenes) , (N,) , (N,) ]
+		for k,(field,dtype) in enumerate(CHECKPOINT_FIELDS) :
+			shape = shapes[k]
+			offset = int ( header["offsets"][k] )
+			if mmapMode is None or N == 0 :
+				array = np.fromfile ( path , dtype=dtype , count=int(np.prod(shape)) , offset=offset ).reshape (shape)
+			else :
+				array = np.memmap ( path , dtype=dtype , mode=mmapMode , offset=offset , shape=shape )
+			setattr ( population , field , array )
+		if globalGenerator :
+			population.CellIndexes = np.arange ( N , dtype=np.int64 )
+			population.RandomCounters = np.zeros ( N , dtype=np.uint64 )
+		return population , int ( header["randomSeed"] )
+
+	def getCellState ( self , i ) :
+		cell = CellState (self.mf_ModelParameters)
+		cell.AllProts = self.AllProts[i].copy ()
+		cell.GeneMrnas = self.GeneMrnas[i].copy ()
+		return cell
+
+	def getLevels ( self , name ) :
+		return self.mf_ModelParameters.giveLevels ( name , self.AllProts )
+
+	def setLevels ( self , name , values ) :
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt < self.mf_ModelParameters.NumGenes : raise Exception ("Cannot set the level of a nativeProt.")
+		self.AllProts[:,idxProt] = values
+
+	def getMrnaLevels ( self , name ) :
+		idxProt = self.mf_ModelParameters.giveProteinIndexFromName (name)
+		if idxProt >= self.mf_ModelParameters.NumGenes : raise Exception ("Not a nativeProt.")
+		return self.GeneMrnas[:,3*idxProt+2]
+
+
+#### hybrid simulator for a whole population at once
+# The gene/mrna jump processes of all cells are advanced together, and the protein ODE
+# of all cells is integrated with one vectorized RHS call per stage. Each cell keeps its
+# own time and Dormand-Prince step size, and its steps end exactly at its next mrna
+# event, so that no step straddles a discontinuity of the RHS.
+# Since random streams and step sizes are per cell, the trajectory of a cell does not
+# depend on which other cells are simulated in the same batch.
+# With useStiffSolver, the Dormand-Prince stepper is replaced by a 3 stages Rosenbrock
+# stepper using the analytic jacobian of the model.
+# With leapEpsilon > 0, the mrna reactions are grouped into leaps as in MrnaSimulator, so that
+# the steps of a cell are only cut by its gene switches and by the middles and ends of its leaps.
+class PopulationSimulator (object) :
+	def __init__ ( self , modelParameters , randomSeed = 1 , useStiffSolver = False , leapEpsilon = 0. ) :
+		self.mf_ModelParameters = modelParameters
+		self.RandomSeed = randomSeed
+		self.AbsTolNumErr = 1e-6
+		self.RelTolNumErr = 1e-6
+		self.InitialStep = 0.1
+		self.MinScale , self.MaxScale , self.Safe = 0.2 , 10. , 0.9
+		self.UseStiffSolver = useStiffSolver
+		self.ErrorExponent = 1./3. if useStiffSolver else 0.2
+		self.CheckEvents = True # set to False to ignore the events of the model, e.g. during equilibration
+		self.LeapEpsilon = leapEpsilon # 0 for the exact simulation of the mrnas
+		self.LeapMinEvents = 2.
+		self.mf_MrnaSimulator = MrnaSimulator ( modelParameters )
+		self.resetStatistics ()
+
+	def resetStatistics ( self ) :
+		self.NumSteps = 0
+		self.NumRejectedSteps = 0
+		self.NumRhsEvals = 0
+		self.NumJacobianEvals = 0
+		self.NumMrnaEvents = 0
+		self.NumMrnaLeaps = 0
+
+	def computeMrnaRates ( self , geneMrnas ) :
+		p = self.mf_ModelParameters
+		a = np.empty ( (geneMrnas.shape[0],p.NumGenes,4) )
+		a[:,:,0] = p.koffs * geneMrnas[:,0::3]
+		a[:,:,1] = p.kons * geneMrnas[:,1::3]
+		a[:,:,2] = p.ksms * geneMrnas[:,0::3]
+		a[:,:,3] = p.rms * geneMrnas[:,2::3]
+		return a.reshape ( (geneMrnas.shape[0],4*p.NumGenes) )
+
+	def drawUniforms ( self , population , cells ) :
+		population.RandomCounters[cells] += np.uint64(1)
+		keys = cellStreamKeys ( self.RandomSeed , population.CellIndexes[cells] )
+		return drawCellUniforms ( keys , population.RandomCounters[cells] )
+
+	# each (cell,gene) has its own next event time, the next event of a cell is the earliest one
+	def sampleGeneEvents ( self , population , cells , t , geneRates ) :
+		u = self.drawUniforms ( population , cells )
+		with np.errstate (divide='ignore') :
+			return np.where ( geneRates > 0. , t - np.log(u) / geneRates , np.inf )
+
+	def initGeneEvents ( self , population , t , mrnaRates ) :
+		if self.LeapEpsilon > 0. : return self.initLeapEvents ( population , t , mrnaRates )
+		G = self.mf_ModelParameters.NumGenes
+		allCells = np.arange ( population.NumCells )
+		geneRates = mrnaRates.reshape ( (-1,G,4) ).sum (axis=2)
+		nextGeneEvents = np.empty ( (population.NumCells,G) )
+		for g in range(G) :
+			nextGeneEvents[:,g] = self.sampleGeneEvents ( population , allCells , t , geneRates[:,g] )
+		return nextGeneEvents
+
+	def fireMrnaEvents ( self , population , cells , t , mrnaRates , nextGeneEvents ) :
+		if self.LeapEpsilon > 0. : return self.fireLeapEvents ( population , cells , t , mrnaRates , nextGeneEvents )
+		G = self.mf_ModelParameters.NumGenes
+		genes = np.argmin ( nextGeneEvents[cells] , axis=1 )
+		a = mrnaRates.reshape ( (-1,G,4) )[cells,genes]
+		target = self.drawUniforms(population,cells) * a.sum(axis=1)
+		r = np.minimum ( ( np.cumsum(a,axis=1) <= target[:,None] ).sum (axis=1) , 3 )
+		population.GeneMrnas[cells] += self.mf_MrnaSimulator.outchg[4*genes+r]
+		mrnaRates[cells] = self.computeMrnaRates ( population.GeneMrnas[cells] )
+		geneRates = mrnaRates.reshape ( (-1,G,4) )[cells,genes].sum (axis=1)
+		nextGeneEvents[cells,genes] = self.sampleGeneEvents ( population , cells , t[cells] , geneRates )
+		self.NumMrnaEvents += len(cells)
+
+	# leap mode (see MrnaSimulator::doLeapStep) : each (cell,gene) has its next switch time and its next mrna
+	# time, which is the time of an exact mrna reaction or the middle or the end of a leap
+	def initLeapEvents ( self , population , t , mrnaRates ) :
+		G = self.mf_ModelParameters.NumGenes
+		N = population.NumCells
+		allCells = np.arange (N)
+		a = mrnaRates.reshape ( (-1,G,4) )
+		self.MrnaScales = giveMrnaScales ( self.mf_ModelParameters )
+		self.SwitchTimes = np.empty ( (N,G) )
+		self.MrnaTimes = np.empty ( (N,G) )
+		self.LeapStarts = np.full ( (N,G) , -1. )
+		self.LeapEnds = np.zeros ( (N,G) )
+		self.LeapChanges = np.zeros ( (N,G) )
+		for g in range(G) :
+			self.SwitchTimes[:,g] = self.sampleGeneEvents ( population , allCells , t , a[:,g,0] + a[:,g,1] )
+			self.scheduleMrnas ( population , allCells , np.full(N,g) , t , mrnaRates )
+		return np.minimum ( self.SwitchTimes , self.MrnaTimes )
+
+	def scheduleMrnas ( self , population , cells , genes , t , mrnaRates ) :
+		# next mrna reaction or leap of the gene genes[i] of the cell cells[i], from t[i] (see MrnaSimulator::scheduleMrna)
+		p = self.mf_ModelParameters
+		a = mrnaRates.reshape ( (-1,p.NumGenes,4) )[cells,genes]
+		rate = a[:,2] + a[:,3]
+		birth = np.where ( a[:,2] > 0. , p.ksms[genes] , 0. )
+		death = p.rms[genes] * self.MrnaScales[genes]
+		bound = self.LeapEpsilon * self.MrnaScales[genes]
+		switchTimes = self.SwitchTimes[cells,genes]
+		with np.errstate ( divide='ignore' , invalid='ignore' ) :
+			tau = np.minimum ( bound**2 / (birth+death) , bound / np.abs(birth-death) )
+			tau = np.minimum ( tau * ( 1. - 0.5 * self.drawUniforms(population,cells) ) , switchTimes - t )
+			leap = ( rate > 0. ) & ( (birth+death) * tau >= self.LeapMinEvents )
+		ends = np.where ( tau == switchTimes - t , switchTimes , t + tau )
+		mrnaTimes = self.sampleGeneEvents ( population , cells , t , rate )
+		mrnaTimes[leap] = t[leap] + 0.5 * ( ends[leap] - t[leap] )
+		self.MrnaTimes[cells,genes] = mrnaTimes
+		self.LeapStarts[cells,genes] = np.where ( leap , t , -1. )
+		self.LeapEnds[cells,genes] = ends
+		self.LeapChanges[cells[leap],genes[leap]] = self.drawLeapChanges ( population , cells[leap] , genes[leap] , ends[leap] - t[leap] , a[leap,2] )
+		self.NumMrnaLeaps += int ( leap.sum() )
+
+	def drawLeapChanges ( self , population , cells , genes , durations , transcriptionRates ) :
+		# surviving mrnas ~ Binomial(mrna,exp(-rm*duration)), new ones ~ Poisson(ksm*on*(1-exp(-rm*duration))/rm),
+		# drawn by inversion of the uniforms of the cells
+		rms = self.mf_ModelParameters.rms[genes]
+		survival = np.exp ( - rms * durations )
+		mrnas = population.GeneMrnas[cells,3*genes+2]
+		births = np.where ( rms > 0. , transcriptionRates * ( 1. - survival ) / np.where(rms>0.,rms,1.) , transcriptionRates * durations )
+		u = np.minimum ( self.drawUniforms ( population , cells ) , 1. - 2.**-53 )
+		changes = scipy.stats.binom.ppf ( u , mrnas , survival ) - mrnas
+		u = np.minimum ( self.drawUniforms ( population , cells ) , 1. - 2.**-53 )
+		return changes + np.where ( births > 0. , scipy.stats.poisson.ppf ( u , np.where(births>0.,births,1.) ) , 0. )
+
+	def fireLeapEvents ( self , population , cells , t , mrnaRates , nextGeneEvents ) :
+		G = self.mf_ModelParameters.NumGenes
+		s = population.GeneMrnas
+		genes = np.argmin ( nextGeneEvents[cells] , axis=1 )
+		tc = t[cells]
+		switched = self.SwitchTimes[cells,genes] <= tc
+		mrnaAction = self.MrnaTimes[cells,genes] <= self.SwitchTimes[cells,genes]
+		middle = mrnaAction & ( self.LeapStarts[cells,genes] >= 0. ) & ( tc < self.LeapEnds[cells,genes] )
+		exact = mrnaAction & ( self.LeapStarts[cells,genes] < 0. )
+		# middle of a leap : its change is applied, and it goes on to its end
+		c , g = cells[middle] , genes[middle]
+		s[c,3*g+2] += self.LeapChanges[c,g]
+		self.MrnaTimes[c,g] = self.LeapEnds[c,g]
+		# exact mrna reactions
+		c , g = cells[exact] , genes[exact]
+		a = mrnaRates.reshape ( (-1,G,4) )[c,g]
+		s[c,3*g+2] += np.where ( self.drawUniforms(population,c) * ( a[:,2] + a[:,3] ) < a[:,2] , 1. , -1. )
+		# gene switches, possibly at the end of a leap
+		c , g = cells[switched] , genes[switched]
+		s[c,3*g] = 1. - s[c,3*g]
+		s[c,3*g+1] = 1. - s[c,3*g+1]
+		# new schedules of the genes that did not only apply a leap change
+		c , g = cells[~middle] , genes[~middle]
+		mrnaRates[c] = self.computeMrnaRates ( s[c] )
+		a = mrnaRates.reshape ( (-1,G,4) )
+		cs , gs = cells[switched] , genes[switched]
+		self.SwitchTimes[cs,gs] = self.sampleGeneEvents ( population , cs , t[cs] , a[cs,gs,0] + a[cs,gs,1] )
+		self.scheduleMrnas ( population , c , g , t[c] , mrnaRates )
+		nextGeneEvents[cells,genes] = np.minimum ( self.SwitchTimes[cells,genes] , self.MrnaTimes[cells,genes] )
+		self.NumMrnaEvents += len(cells)
+
+	def endLeaps ( self , population , t ) :
+		# the leaps in progress are ended at the times t of the cells, with the mrna levels drawn at these times
+		s = population.GeneMrnas
+		for g in range(self.mf_ModelParameters.NumGenes) :
+			c = np.nonzero ( self.LeapStarts[:,g] >= 0. ) [0]
+			applied = self.MrnaTimes[c,g] == self.LeapEnds[c,g]
+			s[c[applied],3*g+2] -= self.LeapChanges[c[applied],g] # back to the levels at the leap starts
+			transcriptionRates = self.mf_ModelParameters.ksms[g] * s[c,3*g]
+			s[c,3*g+2] += self.drawLeapChanges ( population , c , np.full(len(c),g) , t[c] - self.LeapStarts[c,g] , transcriptionRates )
+			self.LeapStarts[c,g] = -1.
+
+	def relaxNativeProteins ( self , population , duration ) :
+		# native part only (no signaling) : exact exponential relaxation of native proteins
+		# between the mrna events of each cell
+		p = self.mf_ModelParameters
+		G = p.NumGenes
+		t = np.zeros ( population.NumCells )
+		mrnaRates = self.computeMrnaRates ( population.GeneMrnas )
+		nextGeneEvents = self.initGeneEvents ( population , t , mrnaRates )
+		active = np.arange ( population.NumCells )
+		while active.size > 0 :
+			tNew = np.minimum ( np.min ( nextGeneEvents[active] , axis=1 , initial=np.inf ) , duration )
+			pss = p.ksps * population.GeneMrnas[active,2::3] / p.rps
+			population.AllProts[active,:G] = pss + ( population.AllProts[active,:G] - pss ) * np.exp ( - p.rps * ( tNew - t[active] )[:,None] )
+			t[active] = tNew
+			active = active[ tNew < duration ]
+			if active.size > 0 : self.fireMrnaEvents ( population , active , t , mrnaRates , nextGeneEvents )
+		if self.LeapEpsilon > 0. : self.endLeaps ( population , t )
+
+	def rhs ( self , y , mrnas ) :
+		self.NumRhsEvals += 1
+		return self.mf_ModelParameters.computeDerivatives ( y , mrnas )
+
+	def doDopr5Step ( self , ya , mrnas , h , f0 ) :
+		k = [ f0 ]
+		for s in range(1,7) :
+			ytmp = ya + h[:,None] * sum ( DOPR5_A[s][j] * k[j] for j in range(s) if DOPR5_A[s][j] != 0. )
+			k.append ( self.rhs ( ytmp , mrnas ) )
+		yerr = h[:,None] * sum ( DOPR5_E[j] * k[j] for j in range(7) if DOPR5_E[j] != 0. )
+		return ytmp , yerr , k[6] # last stage is evaluated at the 5th order solution
+
+	def doRosenbrockStep ( self , ya , mrnas , h , f0 ) :
+		n = ya.shape[1]
+		M = - self.mf_ModelParameters.computeDenseJacobians (ya)
+		self.NumJacobianEvals += 1
+		M[:,np.arange(n),np.arange(n)] += 1. / ( ROS3_GAMMA * h[:,None] )
+		Minv = np.linalg.inv (M)
+		solve = lambda v : np.matmul ( Minv , v[:,:,None] )[:,:,0]
+		K1 = solve (f0)
+		f1 = self.rhs ( ya + K1 , mrnas )
+		K2 = solve ( f1 + ( ROS3_C21 / h[:,None] ) * K1 )
+		K3 = solve ( f1 + ( ROS3_C31 * K1 + ROS3_C32 * K2 ) / h[:,None] )
+		yout = ya + ROS3_M[0] * K1 + ROS3_M[1] * K2 + ROS3_M[2] * K3
+		yerr = ROS3_E[0] * K1 + ROS3_E[1] * K2 + ROS3_E[2] * K3
+		return yout , yerr , None
+
+	def recordObservations ( self , observations , nextObservation , observationTimes , speciesIndexes , cells , t0 , t1 , y0 , y1 , f0 , f1 , tKept ) :
+		# cubic Hermite interpolation inside the accepted steps [t0,t1] of cells, up to tKept : both end
+		# derivatives are already known, so observations cost no rhs evaluation
+		h = t1 - t0
+		y0 , y1 , f0 , f1 = y0[:,speciesIndexes] , y1[:,speciesIndexes] , f0[:,speciesIndexes] , f1[:,speciesIndexes]
+		while True :
+			k = nextObservation[cells]
+			inStep = k < len(observationTimes)
+			inStep[inStep] = observationTimes[k[inStep]] <= tKept[inStep]
+			rows = np.nonzero (inStep) [0]
+			if rows.size == 0 : return
+			k = k[rows]
+			theta = np.ones ( rows.size )
+			positive = h[rows] > 0.
+			theta[positive] = ( observationTimes[k[positive]] - t0[rows[positive]] ) / h[rows[positive]]
+			th , hr = theta[:,None] , h[rows,None]
+			values = (1.-th) * y0[rows] + th * y1[rows] + th * (th-1.) * ( (1.-2.*th) * ( y1[rows] - y0[rows] ) + (th-1.) * hr * f0[rows] + th * hr * f1[rows] )
+			observations[:,cells[rows],k] = values.T
+			nextObservation[cells[rows]] += 1
+
+	def findHermiteRoots ( self , g0 , g1 , hdg0 , hdg1 ) :
+		# for each cubic Hermite polynomial on [0,1] (end values g0,g1, end slopes hdg0,hdg1) with a sign change,
+		# the first theta found past its root, by Illinois regula falsi
+		hermite = lambda th : (1.-th) * g0 + th * g1 + th * (th-1.) * ( (1.-2.*th) * ( g1 - g0 ) + (th-1.) * hdg0 + th * hdg1 )
+		a , b = np.zeros ( g0.size ) , np.ones ( g0.size )
+		ga , gb = g0.copy () , g1.copy ()
+		side = np.zeros ( g0.size , dtype=int )
+		for iteration in range(100) :
+			running = ( gb != 0. ) & ( b - a > 1e-12 )
+			if not running.any () : break
+			with np.errstate ( divide='ignore' , invalid='ignore' ) :
+				xr = ( a * gb - b * ga ) / ( gb - ga )
+			outside = ~ ( ( xr > a ) & ( xr < b ) )
+			xr[outside] = 0.5 * ( a[outside] + b[outside] )
+			gr = hermite (xr)
+			left = running & ( gr != 0. ) & ( ( gr > 0. ) == ( ga > 0. ) )
+			right = running & ~left
+			gb[ left & ( side == 1 ) ] *= 0.5
+			ga[ right & ( side == -1 ) ] *= 0.5
+			a[left] , ga[left] , side[left] = xr[left] , gr[left] , 1
+			b[right] , gb[right] , side[right] = xr[right] , gr[right] , -1
+		return b
+
+	def locateEvents ( self , population , cells , t0 , t1 , y0 , f0 , f1 , eventValues ) :
+		# events crossed by the accepted steps [t0,t1] of cells (only the first crossing of each event counts) :
+		# the event functions are linear in the levels, so along the cubic Hermite interpolant of a step they
+		# are cubic polynomials, whose roots need no rhs evaluation. Cells reaching a terminal event are moved
+		# back to it. Returns the end of the kept part of each step, and which cells stopped.
+		p = self.mf_ModelParameters
+		h = t1 - t0
+		y1 = population.AllProts[cells]
+		g0 , g1 = eventValues[cells] , p.computeEventFunctions (y1)
+		eventValues[cells] = g1
+		d = p.eventDirections
+		crossed = np.isnan ( self.EventTimes[cells] ) & ( ( (g0 < 0.) & (g1 >= 0.) & (d >= 0) ) | ( (g0 > 0.) & (g1 <= 0.) & (d <= 0) ) )
+		rows , events = np.nonzero (crossed)
+		tKept , stopped = t1.copy () , np.zeros ( cells.size , dtype=bool )
+		if rows.size == 0 : return tKept , stopped
+		hdg0 = h[rows] * p.computeEventSlopes ( f0[rows] ) [np.arange(rows.size),events]
+		hdg1 = h[rows] * p.computeEventSlopes ( f1[rows] ) [np.arange(rows.size),events]
+		tEvents = t0[rows] + h[rows] * self.findHermiteRoots ( g0[rows,events] , g1[rows,events] , hdg0 , hdg1 )
+		terminal = p.eventTerminal[events]
+		tStop = np.full ( cells.size , np.inf )
+		np.minimum.at ( tStop , rows[terminal] , tEvents[terminal] )
+		kept = tEvents <= tStop[rows]
+		self.EventTimes[cells[rows[kept]],events[kept]] = tEvents[kept]
+		first = terminal & ( tEvents == tStop[rows] )
+		self.StoppingEvents[cells[rows[first]]] = events[first]
+		stopped = np.isfinite (tStop)
+		if stopped.any () :
+			th = ( ( tStop[stopped] - t0[stopped] ) / h[stopped] ) [:,None]
+			hs , ys0 , ys1 = h[stopped,None] , y0[stopped] , y1[stopped]
+			population.AllProts[cells[stopped]] = (1.-th) * ys0 + th * ys1 + th * (th-1.) * ( (1.-2.*th) * ( ys1 - ys0 ) + (th-1.) * hs * f0[stopped] + th * hs * f1[stopped] )
+			tKept[stopped] = tStop[stopped]
+		return tKept , stopped
+
+	def simulate ( self , population , duration , observationTimes = None , speciesNames = None ) :
+		# with observationTimes (sorted, in [0,duration]) and speciesNames, the levels of these species are
+		# returned as a (NumSpecies,NumCells,NumTimes) array, filled during the integration.
+		# EventTimes (NumCells,NumEvents) holds the first crossing time of each event of the model (nan if none).
+		# A cell reaching a terminal event stops there and leaves the batch : StoppingEvents gives the event
+		# (-1 for cells simulated for the full duration), StopTimes the time, and its later observations are nan.
+		p = self.mf_ModelParameters
+		N = population.NumCells
+		allCells = np.arange (N)
+		t = np.zeros (N)
+		observations = None
+		if observationTimes is not None :
+			observationTimes = np.asarray ( observationTimes , dtype=float )
+			if np.any ( np.diff(observationTimes) < 0. ) or np.any ( observationTimes < 0. ) or np.any ( observationTimes > duration ) :
+				raise Exception ("Observation times must be sorted and within the simulated duration.")
+			speciesIndexes = [ p.giveProteinIndexFromName(name) for name in speciesNames ]
+			observations = np.full ( ( len(speciesIndexes) , N , len(observationTimes) ) , np.nan )
+			first = np.searchsorted ( observationTimes , 0. , side="right" )
+			observations[:,:,:first] = population.AllProts[:,speciesIndexes].T[:,:,None]
+			nextObservation = np.full ( N , first )
+		self.EventTimes = np.full ( (N,p.NumEvents) , np.nan )
+		self.StoppingEvents = np.full ( N , -1 )
+		checkEvents = self.CheckEvents and p.NumEvents > 0
+		if checkEvents : eventValues = p.computeEventFunctions ( population.AllProts )
+		h = np.full ( N , min(self.InitialStep,duration) )
+		rejected = np.zeros ( N , dtype=bool )
+		mrnaRates = self.computeMrnaRates ( population.GeneMrnas )
+		nextGeneEvents = self.initGeneEvents ( population , t , mrnaRates )
+		nextEvent = np.min ( nextGeneEvents , axis=1 , initial=np.inf )
+		dydx = self.rhs ( population.AllProts , population.GeneMrnas[:,2::3] )
+		active = allCells[ t < duration ]
+		while active.size > 0 :
+			ta , ya , ha , fa = t[active] , population.AllProts[active] , h[active] , dydx[active]
+			mrnas = population.GeneMrnas[active,2::3]
+			toEvent , toEnd = nextEvent[active] - ta , duration - ta
+			hEff = np.minimum ( ha , np.minimum(toEvent,toEnd) )
+
+			# one step for all active cells
+			if self.UseStiffSolver : yout , yerr , fout = self.doRosenbrockStep ( ya , mrnas , hEff , fa )
+			else : yout , yerr , fout = self.doDopr5Step ( ya , mrnas , hEff , fa )
+			sk = self.AbsTolNumErr + self.RelTolNumErr * np.maximum ( np.abs(ya) , np.abs(yout) )
+			err = np.sqrt ( np.mean ( (yerr/sk)**2 , axis=1 ) )
+			self.NumSteps += active.size
+
+			# step size control, per cell
+			accept = err <= 1.
+			with np.errstate (divide='ignore') :
+				scale = np.clip ( self.Safe * err**(-self.ErrorExponent) , self.MinScale , self.MaxScale )
+			scale[ accept & rejected[active] ] = np.minimum ( scale[ accept & rejected[active] ] , 1. )
+			scale[ ~accept ] = np.maximum ( self.Safe * err[~accept]**(-self.ErrorExponent) , self.MinScale )
+			hNew = hEff * scale
+			clipped = accept & ( hEff < ha )
+			hNew[clipped] = np.maximum ( hNew[clipped] , ha[clipped] ) # a step shortened to reach an event says nothing against ha
+			h[active] = hNew
+			rejected[active] = ~accept
+			self.NumRejectedSteps += int ( (~accept).sum() )
+
+			# update accepted cells
+			acc = active[accept]
+			population.AllProts[acc] = yout[accept]
+			if fout is not None : dydx[acc] = fout[accept]
+			elif acc.size > 0 : dydx[acc] = self.rhs ( yout[accept] , mrnas[accept] )
+			tNew = ta[accept] + hEff[accept]
+			atEnd = hEff[accept] == toEnd[accept]
+			atEvent = ( hEff[accept] == toEvent[accept] ) & ~atEnd
+			tNew[atEnd] = duration
+			tNew[atEvent] = nextEvent[acc[atEvent]]
+			tKept , stopped = tNew , np.zeros ( acc.size , dtype=bool )
+			if checkEvents and acc.size > 0 :
+				tKept , stopped = self.locateEvents ( population , acc , ta[accept] , tNew , ya[accept] , fa[accept] , dydx[acc] , eventValues )
+			t[acc] = tKept
+			if observations is not None :
+				self.recordObservations ( observations , nextObservation , observationTimes , speciesIndexes , acc ,
+											ta[accept] , tNew , ya[accept] , yout[accept] , fa[accept] , dydx[acc] , tKept )
+
+			# mrna events reached by accepted steps
+			fired = acc[ atEvent & ~stopped ]
+			if fired.size > 0 :
+				self.fireMrnaEvents ( population , fired , t , mrnaRates , nextGeneEvents )
+				nextEvent[fired] = np.min ( nextGeneEvents[fired] , axis=1 , initial=np.inf )
+				dydx[fired] = self.rhs ( population.AllProts[fired] , population.GeneMrnas[fired,2::3] )
+			active = active[ ( t[active] < duration ) & ( self.StoppingEvents[active] < 0 ) ]
+		if self.LeapEpsilon > 0. : self.endLeaps ( population , t )
+		self.StopTimes = t.copy ()
+		return observations
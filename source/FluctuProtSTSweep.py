@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Parameter sweeps and dose-responses of a FluctuProtST model.
+#
+# A sweep has named dimensions : factors or values of reaction rates, values of NativeProtein
+# fields, and stimulus levels. A design is a list of points (dicts from dimension names to
+# values), made as a grid or as a Latin hypercube. For each point, a population is drawn from
+# the native steady-state, its native proteins are relaxed, the full model is equilibrated, the
+# stimuli are set, and a SimulationProtocol is run ; summary statistics of the final levels and
+# of the events are then given for the point.
+#
+# Work is shared between points :
+#	- points with the same native parameters start from the same relaxed native population,
+#	- points that only differ by their stimuli (a group) also share the equilibrated population.
+# The relaxations, the equilibration of each group and then each point of the group are split
+# into shards of cells (cellsPerShard), run as separate tasks by the workers. Cells draw from
+# the same random streams at every point (common random numbers), so that differences between
+# points are not blurred by sampling noise, and the results do not depend on the number of
+# workers or on the shard size. The cells of a point are copied when its shards are submitted, and
+# only a few points (maxPointsInFlight) are held at once, so that long dose-responses stream
+# through a bounded memory.
+#
+# Typical use (hEARM) :
+#	sweep = fpsts.ParameterSweep ( model , numCells=1000 , numWorkers=8 )
+#	sweep.addRateFactor ( "ref_kb" , rateName="kb" )
+#	sweep.addStimulus ( "TRAIL" , species="TRAIL" )
+#	design = fpsts.giveGridDesign ( { "ref_kb" : [0.5,1.,2.] , "TRAIL" : [10.,100.,1000.] } )
+#	protocol = fpste.SimulationProtocol ()
+#	protocol.addSimulation (12.)
+#	sweep.run ( design , protocol , speciesNames=["cPARP"] , outputPath="sweep.jsonl" )
+#
+# Each point is written as one JSON line as soon as its cells are done. writeParameterFiles
+# writes the parameter file of each point instead, for a compiled model built with
+# buildCppFromModel(...,bakeParameters=False).
+##########################################################################################
+
+
+#### imports
+import collections
+import copy
+import itertools
+import json
+import multiprocessing
+import multiprocessing.pool
+import os
+
+import numpy as np
+
+import FluctuProtST as fpst
+import FluctuProtSTPy as fpstpy
+import FluctuProtSTEnsemble as fpste
+
+
+NATIVE_FIELDS = [ "kon" , "koff" , "ksm" , "rm" , "ksp" , "rp" ]
+
+
+#### designs : lists of points, each point a dict from dimension names to values
+def giveGridDesign ( values ) :
+	# all combinations of the given values, the last dimension varying fastest
+	names = list ( values.keys () )
+	return [ dict ( zip ( names , combination ) ) for combination in itertools.product ( *[ values[name] for name in names ] ) ]
+
+def giveLatinHypercubeDesign ( ranges , numPoints , randomSeed = 1 , logScale = False ) :
+	# numPoints points, each dimension range (low,high) being cut into numPoints strata that hold one point each ;
+	# with logScale, the strata are taken on the logarithms of the ranges
+	rng = np.random.default_rng (randomSeed)
+	names = list ( ranges.keys () )
+	points = [ {} for i in range(numPoints) ]
+	for name in names :
+		low , high = ranges[name]
+		if logScale and ( low <= 0. or high <= 0. ) : raise Exception ("Log-scaled ranges must be positive.")
+		u = ( rng.permutation (numPoints) + rng.random (numPoints) ) / numPoints
+		if logScale : values = np.exp ( np.log(low) + u * ( np.log(high) - np.log(low) ) )
+		else : values = low + u * ( high - low )
+		for point,value in zip ( points , values ) : point[name] = float (value)
+	return points
+
+
+#### a dimension of a sweep
+class SweepDimension (object) :
+	def __init__ ( self , name , kind , targets , field = None ) :
+		self.name = name
+		self.kind = kind # "rateFactor", "rate", "native" or "stimulus"
+		self.targets = targets # reaction indexes, native protein indexes or stimulated species
+		self.field = field # NativeProtein field of native dimensions
+
+
+#### summary statistics of a population after a protocol : final levels, and events of its last simulation
+QUANTILES = [ 0.05 , 0.25 , 0.5 , 0.75 , 0.95 ]
+
+def summarizePopulation ( population , eventTimes , speciesNames ) :
+	# eventTimes (NumCells,NumEvents) : first crossing times of the events in the last simulation (None if not checked)
+	p = population.mf_ModelParameters
+	summary = { "numCells" : population.NumCells , "species" : {} , "events" : {} }
+	for name in speciesNames :
+		levels = population.getLevels (name)
+		summary["species"][name] = { "mean" : float(np.mean(levels)) , "std" : float(np.std(levels)) ,
+										"quantiles" : [ float(q) for q in np.quantile ( levels , QUANTILES ) ] }
+	if eventTimes is not None :
+		for idxEvent,name in enumerate(p.eventNames) :
+			times = eventTimes[:,idxEvent]
+			times = times[ ~np.isnan(times) ]
+			summary["events"][name] = { "fraction" : float ( len(times) ) / max ( population.NumCells , 1 ) ,
+										"meanTime" : float(np.mean(times)) if len(times) > 0 else None ,
+										"medianTime" : float(np.median(times)) if len(times) > 0 else None }
+	return summary
+
+
+#### the sweep driver
+class ParameterSweep (object) :
+	def __init__ ( self , model , numCells , randomSeed = 1 , numWorkers = 1 , relaxationDuration = 24. , equilibrationDuration = 7.*24. ,
+					useStiffSolver = False , useThreads = False , cellsPerShard = None , maxPointsInFlight = None ) :
+		self.mf_Model = model
+		self.NumCells = numCells
+		self.RandomSeed = randomSeed
+		self.NumWorkers = numWorkers
+		# cells of a point simulated by one task, by default enough tasks for a point to keep all workers busy
+		self.CellsPerShard = cellsPerShard if cellsPerShard is not None else max ( 1 , -(-numCells//max(numWorkers,1)) )
+		if self.CellsPerShard < 1 : raise Exception ("Shards need at least one cell.")
+		# points whose cells are held at once (submitted and not yet yielded), by default see giveMaxPointsInFlight
+		self.MaxPointsInFlight = maxPointsInFlight
+		if maxPointsInFlight is not None and maxPointsInFlight < 1 : raise Exception ("At least one point must be in flight.")
+		self.RelaxationDuration = relaxationDuration
+		self.EquilibrationDuration = equilibrationDuration
+		self.UseStiffSolver = useStiffSolver
+		self.UseThreads = useThreads
+		self.dimensions = []
+
+	def addDimension ( self , dimension ) :
+		if dimension.name in [ d.name for d in self.dimensions ] : raise Exception ("Name already taken by a sweep dimension.")
+		self.dimensions.append (dimension)
+
+	def giveReactionIndexes ( self , rateName , reactions ) :
+		# reactions selected by name, and/or by the name of their rate (e.g. "kb" for all binding rates)
+		if rateName is None and reactions is None : raise Exception ("Give rateName or reactions.")
+		indexes = []
+		for idxReac,reac in enumerate(self.mf_Model.signalingReactions) :
+			if rateName is not None and reac.rate[0] != rateName : continue
+			if reactions is not None and reac.name not in reactions : continue
+			indexes.append (idxReac)
+		if reactions is not None and len(indexes) < len(set(reactions)) : raise Exception ("Reaction does not exist.")
+		if len(indexes) == 0 : raise Exception ("No reaction selected.")
+		return indexes
+
+	def addRateFactor ( self , name , rateName = None , reactions = None ) :
+		# the point value multiplies the rates of the selected reactions
+		self.addDimension ( SweepDimension ( name , "rateFactor" , self.giveReactionIndexes ( rateName , reactions ) ) )
+
+	def addRate ( self , name , rateName = None , reactions = None ) :
+		# the point value is the rate of the selected reactions
+		self.addDimension ( SweepDimension ( name , "rate" , self.giveReactionIndexes ( rateName , reactions ) ) )
+
+	def addNativeProteinField ( self , name , proteins , field ) :
+		# the point value is the field (kon, koff, ksm, rm, ksp or rp) of the given native proteins
+		if field not in NATIVE_FIELDS : raise Exception ("Not a NativeProtein field.")
+		for prot in proteins :
+			if prot not in self.mf_Model.nativeIndexes : raise Exception ("Not a nativeProt.")
+		self.addDimension ( SweepDimension ( name , "native" , [ self.mf_Model.nativeIndexes[prot] for prot in proteins ] , field ) )
+
+	def addStimulus ( self , name , species ) :
+		# the point value is the level of species, set after the equilibration
+		if species not in self.mf_Model.modifiedIndexes : raise Exception ("Only modifiedProt levels can be set.")
+		self.addDimension ( SweepDimension ( name , "stimulus" , [species] ) )
+
+	def giveModel ( self , point ) :
+		# a copy of the model with the parameters of the point (stimuli are not part of the model)
+		model = copy.deepcopy (self.mf_Model)
+		for d in self.dimensions :
+			if d.name not in point : raise Exception ("Point without value for " + d.name + ".")
+			value = point[d.name]
+			if d.kind == "rateFactor" :
+				for idxReac in d.targets :
+					reac = model.signalingReactions[idxReac]
+					reac.rate = ( reac.rate[0] , value * reac.rate[1] )
+			elif d.kind == "rate" :
+				for idxReac in d.targets :
+					reac = model.signalingReactions[idxReac]
+					reac.rate = ( reac.rate[0] , value )
+			elif d.kind == "native" :
+				for idxProt in d.targets : setattr ( model.nativeProteins[idxProt] , d.field , value )
+		return model
+
+	def giveGroups ( self , design ) :
+		# points grouped by equilibration (native values and rates), the groups themselves by native values
+		nativeGroups = {}
+		for idxPoint,point in enumerate(design) :
+			nativeKey = tuple ( [ point[d.name] for d in self.dimensions if d.kind == "native" ] )
+			signalingKey = tuple ( [ point[d.name] for d in self.dimensions if d.kind in ["rateFactor","rate"] ] )
+			stimuli = [ ( d.targets[0] , point[d.name] ) for d in self.dimensions if d.kind == "stimulus" ]
+			nativeGroups.setdefault ( nativeKey , {} ).setdefault ( signalingKey , [] ).append ( ( idxPoint , point , stimuli ) )
+		return nativeGroups
+
+	def makeShardTasks ( self , modelParameters , protocol , population , stimuli = [] ) :
+		# one task per shard of consecutive cells (see FluctuProtSTEnsemble.simulateShard), each shard a copy of
+		# its cells with the stimuli set
+		tasks = []
+		for start in range(0,population.NumCells,self.CellsPerShard) :
+			shard = population.getSubPopulation ( slice(start,start+self.CellsPerShard) )
+			for species,value in stimuli : shard.setLevels ( species , value )
+			tasks.append ( ( modelParameters , self.RandomSeed , self.UseStiffSolver , 0. , protocol , shard ) )
+		return tasks
+
+	def giveMaxPointsInFlight ( self ) :
+		# enough points for their shards to keep all the workers busy, and one more point queued
+		if self.MaxPointsInFlight is not None : return self.MaxPointsInFlight
+		if self.NumWorkers <= 1 : return 1
+		shardsPerPoint = -(-self.NumCells//self.CellsPerShard)
+		return 1 + -(-self.NumWorkers//shardsPerPoint)
+
+	def iterateResults ( self , design , protocol , speciesNames = [] ) :
+		# yields (point index,point,summary) for every point as soon as its cells are done, group after group.
+		# The relaxation of a native group, the equilibration of a signaling group and the points of a group are run
+		# by the workers as tasks on shards of cells, so that a dose-response of a single group uses all the workers.
+		# The cells of a point are only copied when its shards are submitted, and at most giveMaxPointsInFlight()
+		# points are submitted and not yet yielded, so that memory does not grow with the number of points.
+		pool = None
+		if self.NumWorkers > 1 :
+			pool = multiprocessing.pool.ThreadPool (self.NumWorkers) if self.UseThreads else multiprocessing.Pool (self.NumWorkers)
+		# a submitted task is a function giving its result : run when called without a pool
+		if pool is None : submitTasks = lambda tasks : [ ( lambda task=task : fpste.simulateShard (task) ) for task in tasks ]
+		else : submitTasks = lambda tasks : [ pool.apply_async ( fpste.simulateShard , (task,) ).get for task in tasks ]
+		runTasks = lambda tasks : [ result () for result in submitTasks (tasks) ]
+		gatherShards = lambda results : fpstpy.CellPopulation.concatenate ( [ shard for shard,statistics,events in results ] )
+		maxPointsInFlight = self.giveMaxPointsInFlight ()
+		try :
+			for nativeKey,groups in self.giveGroups(design).items () :
+				nativePopulation = None
+				for signalingKey,points in groups.items () :
+					modelParameters = fpstpy.ModelParameters ( self.giveModel ( points[0][1] ) )
+					if nativePopulation is None :
+						# relaxed once for all the groups with these native parameters
+						nativePopulation = fpstpy.CellPopulation.fromNativeSteadyState ( modelParameters , self.NumCells , self.RandomSeed )
+						if self.RelaxationDuration > 0. :
+							relaxation = fpste.SimulationProtocol ()
+							relaxation.addNativeRelaxation (self.RelaxationDuration)
+							nativePopulation = gatherShards ( runTasks ( self.makeShardTasks ( modelParameters , relaxation , nativePopulation ) ) )
+					population = nativePopulation.getSubPopulation ( slice(0,self.NumCells) )
+					population.mf_ModelParameters = modelParameters
+					if self.EquilibrationDuration > 0. :
+						equilibration = fpste.SimulationProtocol ()
+						equilibration.addSimulation ( self.EquilibrationDuration , checkEvents=False )
+						population = gatherShards ( runTasks ( self.makeShardTasks ( modelParameters , equilibration , population ) ) )
+					inFlight = collections.deque ()
+					for idxPoint,point,stimuli in points :
+						inFlight.append ( ( idxPoint , point , submitTasks ( self.makeShardTasks ( modelParameters , protocol , population , stimuli ) ) ) )
+						if len(inFlight) >= maxPointsInFlight : yield self.finishPoint ( inFlight.popleft () , speciesNames , gatherShards )
+					while len(inFlight) > 0 : yield self.finishPoint ( inFlight.popleft () , speciesNames , gatherShards )
+		finally :
+			if pool is not None :
+				pool.close ()
+				pool.join ()
+
+	def finishPoint ( self , submittedPoint , speciesNames , gatherShards ) :
+		idxPoint , point , results = submittedPoint
+		pointResults = [ result () for result in results ]
+		eventTimes = [ events["EventTimes"] for shard,statistics,events in pointResults ]
+		eventTimes = None if any ( [ e is None for e in eventTimes ] ) else np.concatenate (eventTimes)
+		return ( idxPoint , point , summarizePopulation ( gatherShards(pointResults) , eventTimes , speciesNames ) )
+
+	def run ( self , design , protocol , speciesNames = [] , outputPath = None ) :
+		# streams the summary of each point to outputPath as a JSON line, or returns the summaries if no path is given
+		if outputPath is None :
+			return [ result for result in self.iterateResults ( design , protocol , speciesNames ) ]
+		with open ( outputPath , 'w' ) as f :
+			for idxPoint,point,summary in self.iterateResults ( design , protocol , speciesNames ) :
+				f.write ( json.dumps ( { "index" : idxPoint , "point" : point , "summary" : summary } ) + "\n" )
+				f.flush ()
+		return outputPath
+
+	def writeParameterFiles ( self , design , folderPath ) :
+		# one parameter file per point (see ModelParameters::loadParameterFile), stimuli left to the program
+		if not os.path.exists (folderPath) : os.makedirs (folderPath)
+		paths = []
+		for idxPoint,point in enumerate(design) :
+			paths.append ( os.path.join ( folderPath , "parameters_%d.txt" % idxPoint ) )
+			fpst.writeParameterFile ( self.giveModel(point) , paths[-1] )
+		return paths
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Chunked binary files of per-species time series (same format as libs/trajectory.cpp).
+#
+# One series per cell and species, all sampled at the same observation times. A file is
+# a header (species names and observation times), then chunks of cells. Inside a chunk,
+# the values of one species are contiguous, so that uncompressed files are read without
+# any copy through a memory map. Chunks can be zlib-compressed, and new chunks can be
+# appended to an existing file with the same species and times.
+#
+# Typical use :
+#	writer = fptraj.TrajectoryWriter ("out.fpsttraj",["Caspase","CleavedCaspase"],times)
+#	fptraj.recordTimeCourses (populationSimulator,population,times,writer)
+#	writer.close ()
+#	trajectories = fptraj.TrajectoryFile ("out.fpsttraj")
+#	cleaved = trajectories.giveSpecies ("CleavedCaspase") # (NumCells,NumTimes)
+##########################################################################################
+
+
+#### imports
+import os
+import zlib
+
+import numpy as np
+
+
+#### format
+FILE_MAGIC = b"FPSTTRJ1"
+CHUNK_MAGIC = b"FPSTCHNK"
+CHUNK_HEADER = np.dtype ( [ ("magic","S8") , ("numCells","<u8") , ("rawBytes","<u8") , ("storedBytes","<u8") , ("compression","<u8") , ("unused","<u8",(3,)) ] )
+
+def paddingTo64 ( numBytes ) :
+	return (64-numBytes%64) % 64
+
+def makeFileHeader ( speciesNames , observationTimes ) :
+	names = "".join ( [ name+"\n" for name in speciesNames ] ).encode ()
+	times = np.ascontiguousarray ( observationTimes , dtype="<f8" )
+	headerBytes = 32 + times.nbytes + len(names)
+	headerBytes += paddingTo64 (headerBytes)
+	sizes = np.array ( [ headerBytes , len(speciesNames) , len(times) ] , dtype="<u8" )
+	header = FILE_MAGIC + sizes.tobytes () + times.tobytes () + names
+	return header + b"\0" * paddingTo64 ( len(header) )
+
+
+#### writer
+class TrajectoryWriter (object) :
+	def __init__ ( self , path , speciesNames , observationTimes , compress = False , append = False , chunkCells = 1000 ) :
+		self.SpeciesNames = list (speciesNames)
+		self.ObservationTimes = np.array ( observationTimes , dtype=float )
+		self.Compress = compress
+		self.ChunkCells = chunkCells
+		self.cellIndexes = []
+		self.values = []
+		header = makeFileHeader ( self.SpeciesNames , self.ObservationTimes )
+		if append and os.path.isfile (path) :
+			with open ( path , "rb" ) as f :
+				if f.read ( len(header) ) != header : raise Exception ("Cannot append, the file has other species or times.")
+			self.file = open ( path , "ab" )
+		else :
+			self.file = open ( path , "wb" )
+			self.file.write (header)
+
+	def addCells ( self , cellIndexes , values ) :
+		# values has shape (NumSpecies,numCells,NumTimes)
+		values = np.asarray ( values , dtype=float )
+		if values.shape != ( len(self.SpeciesNames) , len(cellIndexes) , len(self.ObservationTimes) ) : raise Exception ("Wrong trajectory size.")
+		self.cellIndexes.append ( np.asarray ( cellIndexes , dtype="<i8" ) )
+		self.values.append ( values )
+		if sum ( [ len(c) for c in self.cellIndexes ] ) >= self.ChunkCells : self.flush ()
+
+	def flush ( self ) :
+		if len(self.cellIndexes) == 0 : return
+		cellIndexes = np.concatenate ( self.cellIndexes )
+		values = np.ascontiguousarray ( np.concatenate ( self.values , axis=1 ) , dtype="<f8" )
+		raw = cellIndexes.tobytes () + values.tobytes ()
+		stored = zlib.compress (raw) if self.Compress else raw
+		chunkHeader = np.zeros ( 1 , dtype=CHUNK_HEADER )
+		chunkHeader["magic"] , chunkHeader["numCells"] = CHUNK_MAGIC , len(cellIndexes)
+		chunkHeader["rawBytes"] , chunkHeader["storedBytes"] , chunkHeader["compression"] = len(raw) , len(stored) , int(self.Compress)
+		self.file.write ( chunkHeader.tobytes () + stored + b"\0" * paddingTo64 ( len(stored) ) )
+		self.file.flush ()
+		self.cellIndexes , self.values = [] , []
+
+	def close ( self ) :
+		self.flush ()
+		self.file.close ()
+
+
+#### reader : uncompressed chunks are views into a memory map of the file
+class TrajectoryFile (object) :
+	def __init__ ( self , path ) :
+		data = np.memmap ( path , dtype=np.uint8 , mode="r" )
+		if bytes ( data[:8] ) != FILE_MAGIC : raise Exception ("Not a trajectory file.")
+		headerBytes , numSpecies , numTimes = [ int(x) for x in data[8:32].view("<u8") ]
+		self.ObservationTimes = data[32:32+8*numTimes].view ("<f8")
+		names = bytes ( data[32+8*numTimes:headerBytes] ).rstrip (b"\0").decode ()
+		self.SpeciesNames = names.split ("\n") [:numSpecies]
+		self.speciesIndexes = dict ( (name,idx) for idx,name in enumerate(self.SpeciesNames) )
+		self.chunks = [] # (cellIndexes,values) with values of shape (NumSpecies,numCells,NumTimes)
+		position = headerBytes
+		while position + CHUNK_HEADER.itemsize <= len(data) :
+			chunkHeader = data[position:position+CHUNK_HEADER.itemsize].view (CHUNK_HEADER)[0]
+			if chunkHeader["magic"] != CHUNK_MAGIC : raise Exception ("Corrupted trajectory file.")
+			numCells , storedBytes = int(chunkHeader["numCells"]) , int(chunkHeader["storedBytes"])
+			stored = data[position+CHUNK_HEADER.itemsize:position+CHUNK_HEADER.itemsize+storedBytes]
+			if chunkHeader["compression"] == 1 : raw = np.frombuffer ( zlib.decompress (stored) , dtype=np.uint8 )
+			else : raw = stored
+			cellIndexes = raw[:8*numCells].view ("<i8")
+			values = raw[8*numCells:].view ("<f8").reshape ( (numSpecies,numCells,numTimes) )
+			self.chunks.append ( (cellIndexes,values) )
+			position += CHUNK_HEADER.itemsize + storedBytes + paddingTo64 (storedBytes)
+		self.NumCells = sum ( [ len(c[0]) for c in self.chunks ] )
+
+	def giveCellIndexes ( self ) :
+		return np.concatenate ( [ c[0] for c in self.chunks ] ) if len(self.chunks) != 1 else self.chunks[0][0]
+
+	def giveSpecies ( self , name ) :
+		# (NumCells,NumTimes), a view of the file when there is one uncompressed chunk
+		if name not in self.speciesIndexes : raise Exception ("Species not in the file.")
+		idx = self.speciesIndexes[name]
+		if len(self.chunks) == 1 : return self.chunks[0][1][idx]
+		return np.concatenate ( [ c[1][idx] for c in self.chunks ] ) if len(self.chunks) > 0 else np.zeros ( (0,len(self.ObservationTimes)) )
+
+
+#### time courses of a population at observation times, counted from the current state
+def recordTimeCourses ( simulator , population , observationTimes , writer = None , speciesNames = None ) :
+	# one simulate up to the last observation time, values filled by dense output ;
+	# returns the values, of shape (NumSpecies,NumCells,NumTimes), and adds them to the writer if any
+	if speciesNames is None : speciesNames = writer.SpeciesNames
+	values = simulator.simulate ( population , observationTimes[-1] , observationTimes , speciesNames )
+	if writer is not None : writer.addCells ( population.CellIndexes , values )
+	return values
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Benchmark of model construction and code generation, for both rhs modes of
+# buildCppFromModel (unrolled and sparse).
+#
+# Models are synthetic large models, which mimic a rule-expanded network : native proteins,
+# then repeated reversible bindings of two existing species into a new complex, some of them
+# followed by a catalysis releasing a new modified form, and model scripts given with
+# --models (run without their own code generation).
+# With --nr, a folder holding the Numerical Recipes headers (nr3.h), HybridRhs.cpp and
+# ModelParameters.cpp are also compiled (with $CXX, g++ by default, and -O2), and the rhs
+# throughput is measured by a small driver.
+#
+# Usage (from the source folder) :
+#	python benchmark_codegen.py [--rules 100 1000 5000] [--models model_hEARM.py] [--nr NR_FOLDER]
+##########################################################################################
+
+
+#### imports
+import argparse
+import contextlib
+import io
+import os
+import random
+import runpy
+import shutil
+import subprocess
+import tempfile
+import time
+
+import FluctuProtST as fpst
+
+
+#### a synthetic model with numNatives natives and numRules binding rules (about 3 reactions and 1.3 species per rule),
+#### or as many rules as needed for maxReactions reactions
+def makeSyntheticModel ( numNatives , numRules , seed = 1 , maxReactions = None ) :
+	rng = random.Random (seed)
+	model = fpst.FluctuProtSTModel ( "Synthetic%d" % numRules if maxReactions is None else "Synthetic%dx%d" % (numNatives,maxReactions) )
+	for i in range(numNatives) :
+		model.addNativeProteinStdFluct ( name="N%d" % i , EP=rng.uniform(1000.,100000.) , dilutionHalfLife=27. )
+	species = [ "N%d" % i for i in range(numNatives) ]
+	for r in range(numRules) :
+		if maxReactions is not None and len(model.signalingReactions) >= maxReactions : break
+		a , b = rng.sample ( species , 2 )
+		complexName = "C%d" % r
+		model.addReversibleReaction ( name="Binding%d" % r , reactants=[a,b] , products=[complexName] , rates=[ ("kb",rng.uniform(1e-5,1e-3)) , ("ku",rng.uniform(1e-3,1.)) ] )
+		if rng.random () < 0.3 :
+			model.addReaction ( name="Catalysis%d" % r , reactants=[complexName] , products=[b,"P%d" % r] , rate=("kc",rng.uniform(0.1,10.)) )
+			species.append ( "P%d" % r )
+		species.append (complexName)
+	model.setAllModifiedProteinDegradation ( halfLife=27. )
+	return model
+
+
+#### the model of a model script, run without its code generation and its prints
+def loadModelScript ( path ) :
+	buildCppFromModel = fpst.buildCppFromModel
+	fpst.buildCppFromModel = lambda **kwargs : None
+	try :
+		with contextlib.redirect_stdout ( io.StringIO () ) :
+			return runpy.run_path (path) ["model"]
+	finally :
+		fpst.buildCppFromModel = buildCppFromModel
+
+
+#### rhs throughput driver, compiled against the generated HybridRhs
+RHS_DRIVER = """
+#include "HybridRhs.hpp"
+#include <ctime>
+
+int main ( int argc , char** argv )
+{
+    ModelParameters* modelParameters = new ModelParameters () ;
+    HybridRhs rhs (modelParameters) ;
+    MrnaChunk chunk ( modelParameters->mf_NumGenes , 1 ) ;
+    for (Int g=0;g<modelParameters->mf_NumGenes;g++) chunk.startMrnas[g] = 10. ;
+    rhs.setMrnaChunk (&chunk) ;
+    rhs.mf_ConstantMrnas = true ;
+    Int n = modelParameters->mf_NumAllProteinSpecies , numEvals = atoi (argv[1]) ;
+    VecDoub y (n) , dydx (n) ;
+    for (Int i=0;i<n;i++) y[i] = 100. + i%7 ;
+    Doub checksum = 0. ;
+    clock_t start = clock () ;
+    for (Int k=0;k<numEvals;k++) { y[k%n] += 1e-3 ; rhs ( 0. , y , dydx ) ; checksum += dydx[k%n] ; }
+    Doub seconds = Doub ( clock () - start ) / CLOCKS_PER_SEC ;
+    cout << numEvals / seconds << " " << checksum << endl ;
+    return 0 ;
+}
+"""
+
+
+def compileAndMeasure ( folder , nrFolder , numTerms ) :
+	compiler = os.environ.get ( "CXX" , "g++" )
+	for f in os.listdir (nrFolder) :
+		if f.endswith (".h") : shutil.copy ( os.path.join(nrFolder,f) , folder + "/libs" )
+	with open ( folder + "/benchmark_rhs.cpp" , "w" ) as f : f.write (RHS_DRIVER)
+	compileTimes = []
+	for source in ["HybridRhs.cpp","ModelParameters.cpp"] :
+		t0 = time.time ()
+		subprocess.check_call ( [ compiler , "-O2" , "-c" , source ] , cwd=folder )
+		compileTimes.append ( time.time () - t0 )
+	subprocess.check_call ( [ compiler , "-O2" , "-o" , "benchmark_rhs" , "benchmark_rhs.cpp" , "HybridRhs.o" , "ModelParameters.o" ] , cwd=folder )
+	numEvals = max ( 100 , int ( 2e8 / numTerms ) )
+	output = subprocess.check_output ( [ "./benchmark_rhs" , str(numEvals) ] , cwd=folder ).decode ()
+	return compileTimes , float ( output.split()[0] )
+
+
+def benchmarkModel ( model , nrFolder , buildTime ) :
+	numSpecies = len(model.nativeProteins) + len(model.modifiedProteins)
+	numTerms = numSpecies + sum ( [ len(reac.reactants) + len(reac.products) for reac in model.signalingReactions ] )
+	for rhsMode in ["unrolled","sparse"] :
+		targetFolder = tempfile.mkdtemp ()
+		try :
+			t0 = time.time ()
+			fpst.buildCppFromModel ( model=model , targetFolderPath=targetFolder+"/generated" , rhsMode=rhsMode )
+			generationTime = time.time () - t0
+			rhsSize = os.path.getsize ( targetFolder + "/generated/HybridRhs.cpp" ) / 1024.
+			line = "%-14s %-8s __ %6d species __ %6d reactions __ model %.2f s __ code generation %.2f s __ HybridRhs.cpp %8.0f kB" % (
+						model.name , rhsMode , numSpecies , len(model.signalingReactions) , buildTime , generationTime , rhsSize )
+			if nrFolder is not None :
+				compileTimes , throughput = compileAndMeasure ( targetFolder+"/generated" , nrFolder , numTerms )
+				line += " __ compile HybridRhs %.1f s , ModelParameters %.1f s __ %.3g rhs evals/s" % ( compileTimes[0] , compileTimes[1] , throughput )
+			print (line)
+		finally :
+			shutil.rmtree (targetFolder)
+
+
+#### MAIN
+if __name__ == "__main__" :
+	parser = argparse.ArgumentParser ()
+	parser.add_argument ( "--rules" , type=int , nargs="*" , default=[100,1000,5000] )
+	parser.add_argument ( "--models" , nargs="*" , default=[] )
+	parser.add_argument ( "--nr" , default=None , help="folder with the Numerical Recipes headers, to compile and run the rhs" )
+	args = parser.parse_args ()
+	for path in args.models :
+		t0 = time.time ()
+		model = loadModelScript (path)
+		benchmarkModel ( model , args.nr , time.time () - t0 )
+	for numRules in args.rules :
+		t0 = time.time ()
+		model = makeSyntheticModel ( numNatives=max(10,numRules//20) , numRules=numRules )
+		benchmarkModel ( model , args.nr , time.time () - t0 )
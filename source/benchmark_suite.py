@@ -0,0 +1,363 @@
+#!/usr/bin/python
+
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Benchmark suite of the simulators, on the shipped models (ToyExample, SensingIP, hEARM)
+# and on synthetic networks of a given size (genes:reactions, see makeSyntheticModel).
+#
+# For each model, the suite measures separately :
+# - the model construction and code generation times, for each rhs mode,
+# - the python engine (FluctuProtSTPy) : mrna events per second of the mrna layer alone
+#   (native relaxation of the population), rhs evaluations per second (one cell each),
+#   ode steps, rejected steps, rhs and jacobian evaluations and cells per second of a
+#   population simulation, and the peak memory of the process,
+# - with --nr, a folder holding the Numerical Recipes headers : the compile time of each
+#   generated source, and the same measures for the compiled HybridSimulator (cells
+#   simulated one after the other from their telegraph steady-state).
+#   With --profile, the generated code is compiled with -DFPST_PROFILE, and the hot-path profile
+#   of the population (see SimulationProfile.hpp) and of each cell are added to the results
+#   (the timings then include the cost of the profiling clocks).
+# Each python engine benchmark runs in its own process, so that its peak memory is its own.
+# Results are written as JSON (--output), with the version, the git commit and the settings,
+# and --compare prints the ratios of all the measures against an earlier result file.
+#
+# Usage (from the source folder) :
+#	python benchmark_suite.py [--models model_ToyExample.py ...] [--synthetic 20:100 40:400]
+#		[--cells 100] [--duration 24] [--solver stiff|dopr5] [--leap-epsilon 0]
+#		[--nr NR_FOLDER [--profile]] [--output benchmark.json] [--compare old_benchmark.json]
+##########################################################################################
+
+
+#### imports
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import FluctuProtST as fpst
+import FluctuProtSTPy as fpstpy
+from benchmark_codegen import makeSyntheticModel , loadModelScript
+
+SOURCE_FOLDER = os.path.dirname ( os.path.abspath (__file__) )
+SHIPPED_MODELS = [ "model_ToyExample.py" , "model_SensingIP.py" , "model_hEARM.py" ]
+RHS_MODES = [ "unrolled" , "sparse" ]
+
+
+#### models are given as ("script",path) or ("synthetic",numGenes,numReactions), and built where they are used
+def giveModel ( spec ) :
+	if spec[0] == "script" :
+		path = spec[1] if os.path.exists (spec[1]) else os.path.join ( SOURCE_FOLDER , spec[1] )
+		return loadModelScript (path)
+	if spec[0] == "synthetic" :
+		return makeSyntheticModel ( numNatives=spec[1] , numRules=spec[2] , maxReactions=spec[2] )
+	raise Exception ("Unknown model specification.")
+
+
+def parseSyntheticSize ( text ) :
+	numGenes , numReactions = text.split (":")
+	return ( "synthetic" , int(numGenes) , int(numReactions) )
+
+
+def givePeakMemoryMB () :
+	# ru_maxrss is in kB on Linux
+	return resource.getrusage ( resource.RUSAGE_SELF ).ru_maxrss / 1024.
+
+
+#### python engine, run in its own process (top-level so that it can be pickled)
+def benchmarkPythonEngine ( args ) :
+	spec , numCells , duration , useStiffSolver , leapEpsilon , numRhsEvals = args
+	p = fpstpy.ModelParameters ( giveModel (spec) )
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( p , numCells , randomSeed=1 )
+	simulator = fpstpy.PopulationSimulator ( p , 1 , useStiffSolver , leapEpsilon )
+	result = {}
+
+	# mrna layer alone
+	t0 = time.perf_counter ()
+	simulator.relaxNativeProteins ( population , duration )
+	seconds = time.perf_counter () - t0
+	result["mrnaEvents"] = simulator.NumMrnaEvents
+	result["mrnaEventsPerSecond"] = simulator.NumMrnaEvents / seconds
+
+	# rhs alone, one evaluation per cell
+	numCalls = max ( 1 , numRhsEvals // numCells )
+	mrnas = population.GeneMrnas[:,2::3]
+	t0 = time.perf_counter ()
+	for k in range(numCalls) : p.computeDerivatives ( population.AllProts , mrnas )
+	result["rhsEvalsPerSecond"] = numCalls * numCells / ( time.perf_counter () - t0 )
+
+	# population simulation
+	simulator.resetStatistics ()
+	t0 = time.perf_counter ()
+	simulator.simulate ( population , duration )
+	seconds = time.perf_counter () - t0
+	result["odeSteps"] = simulator.NumSteps
+	result["odeRejectedSteps"] = simulator.NumRejectedSteps
+	result["rhsCalls"] = simulator.NumRhsEvals
+	result["jacobianCalls"] = simulator.NumJacobianEvals
+	result["simulationMrnaEvents"] = simulator.NumMrnaEvents
+	result["simulationSeconds"] = seconds
+	result["cellsPerSecond"] = numCells / seconds
+	result["peakMemoryMB"] = givePeakMemoryMB ()
+	return result
+
+
+#### compiled simulator : driver printing one "name value" line per measure
+SUITE_DRIVER = """
+#include "HybridSimulator.hpp"
+#include <ctime>
+#include <sys/resource.h>
+
+int main ( int argc , char** argv )
+{
+    ModelParameters* modelParameters = new ModelParameters () ;
+    Int numCells = atoi (argv[1]) , numEvals = atoi (argv[4]) ;
+    Doub duration = atof (argv[2]) , leapEpsilon = atof (argv[5]) ;
+    bool useStiffSolver = ( atoi (argv[3]) != 0 ) ;
+    HybridSimulator* simulator = new HybridSimulator ( modelParameters , 1 , false , useStiffSolver , leapEpsilon ) ;
+    MrnaSimulator* mrnaSimulator = simulator->mf_MrnaSimulator ;
+    Int n = modelParameters->mf_NumAllProteinSpecies ;
+    clock_t start ;
+    Doub seconds ;
+
+    // mrna layer alone : one cell for numCells*duration
+    CellState* cell = new CellState (modelParameters) ;
+    long mrnaEvents = 0 ;
+    start = clock () ;
+    mrnaSimulator->prepareForSteps (cell) ;
+    while ( mrnaSimulator->t < numCells*duration )
+    {
+        mrnaSimulator->doStep ( cell , numCells*duration ) ;
+        if ( mrnaSimulator->lastReaction >= 0 ) mrnaEvents++ ;
+    }
+    seconds = Doub ( clock () - start ) / CLOCKS_PER_SEC ;
+    cout << "mrnaEvents " << mrnaEvents << endl << "mrnaSeconds " << seconds << endl ;
+    delete cell ;
+
+    // rhs alone
+    HybridRhs rhs (modelParameters) ;
+    MrnaChunk chunk ( modelParameters->mf_NumGenes , 1 ) ;
+    for (Int g=0;g<modelParameters->mf_NumGenes;g++) chunk.startMrnas[g] = 10. ;
+    rhs.setMrnaChunk (&chunk) ;
+    rhs.mf_ConstantMrnas = true ;
+    VecDoub y (n) , dydx (n) ;
+    for (Int i=0;i<n;i++) y[i] = 100. + i%7 ;
+    Doub checksum = 0. ;
+    start = clock () ;
+    for (Int k=0;k<numEvals;k++) { y[k%n] += 1e-3 ; rhs ( 0. , y , dydx ) ; checksum += dydx[k%n] ; }
+    seconds = Doub ( clock () - start ) / CLOCKS_PER_SEC ;
+    cout << "rhsEvals " << numEvals << endl << "rhsSeconds " << seconds << endl << "rhsChecksum " << checksum << endl ;
+
+    // cells simulated one after the other, from their telegraph steady-state
+    long okSteps = 0 , badSteps = 0 , rhsEvals = 0 , jacobianEvals = 0 , events = 0 ;
+    seconds = 0. ;
+    simulator->PopulationProfile.reset () ;
+    ofstream cellProfiles ( "cell_profiles.tsv" ) ;
+    if ( FPST_PROFILE_ENABLED ) simulator->Profile.printTableHeader (cellProfiles) ;
+    for (Int i=0;i<numCells;i++)
+    {
+        cell = mrnaSimulator->sampleFromTelegraphSteadyState (0.) ;
+        start = clock () ;
+        simulator->simulate ( cell , duration ) ;
+        seconds += Doub ( clock () - start ) / CLOCKS_PER_SEC ;
+        okSteps += simulator->NumOkSteps ; badSteps += simulator->NumBadSteps ;
+        rhsEvals += simulator->NumRhsEvals ; jacobianEvals += simulator->NumJacobianEvals ;
+        events += simulator->EventObtained ;
+        if ( FPST_PROFILE_ENABLED ) simulator->Profile.printTableRow (cellProfiles) ;
+        delete cell ;
+    }
+    cout << "odeSteps " << okSteps+badSteps << endl << "odeRejectedSteps " << badSteps << endl ;
+    cout << "rhsCalls " << rhsEvals << endl << "jacobianCalls " << jacobianEvals << endl ;
+    cout << "simulationMrnaEvents " << events << endl << "simulationSeconds " << seconds << endl ;
+    if ( FPST_PROFILE_ENABLED ) simulator->PopulationProfile.print ( cout , "profile." ) ;
+
+    struct rusage usage ;
+    getrusage ( RUSAGE_SELF , &usage ) ;
+    cout << "peakMemoryKB " << usage.ru_maxrss << endl ;
+    return 0 ;
+}
+"""
+
+
+def compileGeneratedCode ( folder , nrFolder , profile = False ) :
+	# each source is compiled on its own, to time it, then linked with the driver
+	compiler = os.environ.get ( "CXX" , "g++" )
+	flags = [ "-O2" ] + ( [ "-DFPST_PROFILE" ] if profile else [] )
+	for f in os.listdir (nrFolder) :
+		if f.endswith (".h") : shutil.copy ( os.path.join(nrFolder,f) , folder + "/libs" )
+	with open ( folder + "/benchmark_suite.cpp" , "w" ) as f : f.write (SUITE_DRIVER)
+	sources = sorted ( [ f for f in os.listdir (folder) if f.endswith (".cpp") and f != "main.cpp" ] )
+	sources += sorted ( [ "libs/" + f for f in os.listdir (folder + "/libs") if f.endswith (".cpp") ] )
+	compileTimes = {}
+	for source in sources :
+		t0 = time.perf_counter ()
+		subprocess.check_call ( [ compiler ] + flags + [ "-c" , source , "-o" , source[:-4] + ".o" ] , cwd=folder )
+		compileTimes[source] = time.perf_counter () - t0
+	subprocess.check_call ( [ compiler ] + flags + [ "-o" , "benchmark_suite" ] + [ source[:-4] + ".o" for source in sources ] , cwd=folder )
+	compileTimes["total"] = sum ( compileTimes.values () )
+	return compileTimes
+
+
+def benchmarkCompiledSimulator ( folder , numCells , duration , useStiffSolver , leapEpsilon , numRhsEvals ) :
+	output = subprocess.check_output ( [ "./benchmark_suite" , str(numCells) , repr(duration) , str(int(useStiffSolver)) ,
+											str(numRhsEvals) , repr(leapEpsilon) ] , cwd=folder ).decode ()
+	values = dict ( ( line.split()[0] , float(line.split()[1]) ) for line in output.splitlines () if line.strip () )
+	result = { "mrnaEvents" : values["mrnaEvents"] ,
+			"mrnaEventsPerSecond" : values["mrnaEvents"] / max ( values["mrnaSeconds"] , 1e-9 ) ,
+			"rhsEvalsPerSecond" : values["rhsEvals"] / max ( values["rhsSeconds"] , 1e-9 ) ,
+			"odeSteps" : values["odeSteps"] ,
+			"odeRejectedSteps" : values["odeRejectedSteps"] ,
+			"rhsCalls" : values["rhsCalls"] ,
+			"jacobianCalls" : values["jacobianCalls"] ,
+			"simulationMrnaEvents" : values["simulationMrnaEvents"] ,
+			"simulationSeconds" : values["simulationSeconds"] ,
+			"cellsPerSecond" : numCells / max ( values["simulationSeconds"] , 1e-9 ) ,
+			"peakMemoryMB" : values["peakMemoryKB"] / 1024. }
+	profile = dict ( ( key[len("profile."):] , value ) for key,value in values.items () if key.startswith ("profile.") )
+	if len(profile) > 0 :
+		result["profile"] = profile
+		result["cellProfiles"] = readCellProfiles ( folder + "/cell_profiles.tsv" )
+	return result
+
+
+def readCellProfiles ( path ) :
+	# one column per profile field, one row per cell
+	with open (path) as f : rows = [ line.split ("\t") for line in f.read().splitlines () if line.strip () ]
+	return dict ( ( name , [ float(row[k]) for row in rows[1:] ] ) for k,name in enumerate(rows[0]) )
+
+
+def giveProfileSummary ( profile ) :
+	# shares of the simulation time, and the mean cost of the hot paths
+	total = max ( profile["TotalSeconds"] , 1e-12 )
+	return ( "profile : mrna %.0f%% , rhs %.0f%% , jacobian %.0f%% , ode %.0f%% of %.3g s __ %.3g us/mrna step , %.3g us/rhs __ "
+			"%d chunks (%d full , max %d of %d events) __ tindex walk %.2f/search (max %d) __ %d rejected trials" % (
+			100. * profile["MrnaSeconds"] / total , 100. * profile["RhsSeconds"] / total , 100. * profile["JacobianSeconds"] / total ,
+			100. * profile["OdeSeconds"] / total , profile["TotalSeconds"] ,
+			1e6 * profile["MrnaSeconds"] / max ( profile["NumMrnaSteps"] , 1. ) , 1e6 * profile["RhsSeconds"] / max ( profile["NumRhsBodies"] , 1. ) ,
+			profile["NumChunks"] , profile["NumFullChunks"] , profile["MaxChunkEvents"] , profile["ChunkCapacity"] ,
+			( profile["TindexForwardWalk"] + profile["TindexBackwardWalk"] ) / max ( profile["NumTindexSearches"] , 1. ) ,
+			profile["MaxTindexWalk"] , profile["NumRejectedTrials"] ) )
+
+
+#### one model : code generation (and compiled simulator) here, python engine in its own process
+def benchmarkCase ( spec , settings , nrFolder = None ) :
+	t0 = time.perf_counter ()
+	model = giveModel (spec)
+	case = { "name" : model.name , "spec" : list(spec) , "modelSeconds" : time.perf_counter () - t0 ,
+			"numGenes" : len(model.nativeProteins) , "numSpecies" : len(model.nativeProteins) + len(model.modifiedProteins) ,
+			"numReactions" : len(model.signalingReactions) , "codeGeneration" : {} }
+	numTerms = case["numSpecies"] + sum ( [ len(reac.reactants) + len(reac.products) for reac in model.signalingReactions ] )
+	numRhsEvals = max ( 100 , int ( 2e8 / numTerms ) )
+	if nrFolder is not None : case["compile"] , case["cpp"] = {} , {}
+	for rhsMode in RHS_MODES :
+		targetFolder = tempfile.mkdtemp ()
+		try :
+			t0 = time.perf_counter ()
+			fpst.buildCppFromModel ( model=model , targetFolderPath=targetFolder , rhsMode=rhsMode )
+			case["codeGeneration"][rhsMode] = { "seconds" : time.perf_counter () - t0 ,
+												"hybridRhsKB" : os.path.getsize ( targetFolder + "/HybridRhs.cpp" ) / 1024. }
+			if nrFolder is not None :
+				case["compile"][rhsMode] = compileGeneratedCode ( targetFolder , nrFolder , settings["profile"] )
+				case["cpp"][rhsMode] = benchmarkCompiledSimulator ( targetFolder , settings["cells"] , settings["duration"] ,
+																	settings["solver"] == "stiff" , settings["leapEpsilon"] , numRhsEvals )
+		finally :
+			shutil.rmtree (targetFolder)
+	task = ( spec , settings["cells"] , settings["duration"] , settings["solver"] == "stiff" , settings["leapEpsilon"] , numRhsEvals // 10 )
+	with multiprocessing.get_context ("spawn").Pool (1) as pool :
+		case["python"] = pool.apply ( benchmarkPythonEngine , (task,) )
+	return case
+
+
+def printCase ( case ) :
+	line = "%-18s %5d genes %6d species %6d reactions __ code generation %s" % ( case["name"] , case["numGenes"] , case["numSpecies"] , case["numReactions"] ,
+				" , ".join ( [ "%s %.2f s" % (mode,values["seconds"]) for mode,values in case["codeGeneration"].items () ] ) )
+	print (line)
+	engines = [ ("python",case["python"]) ] + [ ("cpp " + mode,values) for mode,values in case.get("cpp",{}).items () ]
+	for name,values in engines :
+		line = "    %-13s __ %.3g mrna events/s __ %.3g rhs evals/s __ %d steps (%d rejected) __ %.3g cells/s __ peak memory %.0f MB" % (
+					name , values["mrnaEventsPerSecond"] , values["rhsEvalsPerSecond"] , values["odeSteps"] , values["odeRejectedSteps"] ,
+					values["cellsPerSecond"] , values["peakMemoryMB"] )
+		if name != "python" : line += " __ compile %.1f s" % case["compile"][name.split()[1]]["total"]
+		print (line)
+		if "profile" in values : print ( "      " + giveProfileSummary ( values["profile"] ) )
+
+
+#### result files
+def giveGitCommit () :
+	try :
+		return subprocess.check_output ( [ "git" , "rev-parse" , "HEAD" ] , cwd=SOURCE_FOLDER , stderr=subprocess.DEVNULL ).decode ().strip ()
+	except Exception :
+		return None
+
+
+def giveCompilerVersion () :
+	try :
+		return subprocess.check_output ( [ os.environ.get("CXX","g++") , "--version" ] , stderr=subprocess.DEVNULL ).decode ().splitlines () [0]
+	except Exception :
+		return None
+
+
+def flattenMeasures ( values , prefix = "" ) :
+	measures = {}
+	for key,value in values.items () :
+		if isinstance ( value , dict ) : measures.update ( flattenMeasures ( value , prefix + key + "/" ) )
+		elif isinstance ( value , (int,float) ) and not isinstance ( value , bool ) : measures[prefix+key] = float (value)
+	return measures
+
+
+def compareResults ( oldResults , newResults ) :
+	# ratio new/old of every measure found in both result files, case by case (cases are matched by name)
+	oldCases = dict ( ( case["name"] , case ) for case in oldResults["cases"] )
+	lines = []
+	for case in newResults["cases"] :
+		if case["name"] not in oldCases : continue
+		oldMeasures = flattenMeasures ( oldCases[case["name"]] )
+		for key,value in sorted ( flattenMeasures (case).items () ) :
+			if key in oldMeasures and oldMeasures[key] != 0. :
+				lines.append ( "%-18s %-50s %12.4g -> %12.4g  x %.3f" % ( case["name"] , key , oldMeasures[key] , value , value / oldMeasures[key] ) )
+	return lines
+
+
+#### MAIN
+if __name__ == "__main__" :
+	parser = argparse.ArgumentParser ()
+	parser.add_argument ( "--models" , nargs="*" , default=SHIPPED_MODELS )
+	parser.add_argument ( "--synthetic" , nargs="*" , default=["20:100","40:400"] , help="synthetic networks, as genes:reactions" )
+	parser.add_argument ( "--cells" , type=int , default=100 )
+	parser.add_argument ( "--duration" , type=float , default=24. )
+	parser.add_argument ( "--solver" , choices=["stiff","dopr5"] , default="stiff" )
+	parser.add_argument ( "--leap-epsilon" , type=float , default=0. )
+	parser.add_argument ( "--nr" , default=None , help="folder with the Numerical Recipes headers, to compile and run the generated code" )
+	parser.add_argument ( "--profile" , action="store_true" , help="compile the generated code with -DFPST_PROFILE (with --nr)" )
+	parser.add_argument ( "--output" , default="benchmark.json" )
+	parser.add_argument ( "--compare" , default=None , help="earlier result file" )
+	args = parser.parse_args ()
+	settings = { "cells" : args.cells , "duration" : args.duration , "solver" : args.solver , "leapEpsilon" : args.leap_epsilon ,
+				"profile" : args.profile }
+	results = { "version" : "FluctuProtST 1.2" , "gitCommit" : giveGitCommit () , "date" : datetime.datetime.now().isoformat () ,
+				"platform" : platform.platform () , "python" : platform.python_version () , "numpy" : np.__version__ ,
+				"compiler" : giveCompilerVersion () if args.nr is not None else None , "settings" : settings , "cases" : [] }
+	specs = [ ("script",path) for path in args.models ] + [ parseSyntheticSize(text) for text in args.synthetic ]
+	for spec in specs :
+		case = benchmarkCase ( spec , settings , args.nr )
+		printCase (case)
+		results["cases"].append (case)
+		with open ( args.output , "w" ) as f : json.dump ( results , f , indent=1 )
+	if args.compare is not None :
+		with open (args.compare) as f : oldResults = json.load (f)
+		for line in compareResults ( oldResults , results ) : print (line)
@@ -53,7 +53,7 @@ params["T_off"] = 1.5
 
 # misc
 params["uGFP_mean_basal"] = params["GFP_degrad"] / params["folding_rate"]
-print "uGFP basal mean level = %s" % params["uGFP_mean_basal"]
+print ( "uGFP basal mean level = %s" % params["uGFP_mean_basal"] )
 
 # define native (i.e. fluctuating) proteins
 model.addNativeProtein ( name="R" , EP=1. , HLP=log(2.)/params["R_degrad"] , EM=params["mRNA_mean"] , HLM=params["mRNA_HL"] , Ton=params["T_on"] , Toff=params["T_off"] )
@@ -46,3 +46,11 @@ model.setModifiedProteinDegradation ( name="CleavedCaspase" , halfLife=0.5)
 
 # generate cpp code to simulate that model
 fpst.buildCppFromModel ( model=model , targetFolderPath = "ToyModel_cpp_code_generated" )
+
+# with the NR headers in the libs folder of the generated code, the simulator can also be compiled as a python module
+# and run in-process (see buildPythonModule)
+# compiledModel = fpst.buildPythonModule ( model=model , targetFolderPath = "ToyModel_cpp_code_generated" )
+# simulator = compiledModel.HybridSimulator ( randomSeed=1 )
+# cell = simulator.sampleFromTelegraphSteadyState (24.)
+# cell.set_ActiveDeathReceptor_Level (100.)
+# levels = simulator.simulate ( cell , 12. , observationTimes=[0.,6.,12.] , speciesIndexes=[compiledModel.speciesNames.index("CleavedCaspase")] )
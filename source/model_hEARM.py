@@ -139,9 +139,12 @@ defineDownstreamMompReactions (model=model,ref_kb=ref_kb,ref_ku=ref_ku,ref_kc=re
 ## degradation of modified forms
 setDegradationRates (model=model)
 
+## death : half of the PARP pool is cleaved (terminal event, the simulators stop the cell and report the time)
+model.addEvent ( name="Death" , species="cPARP" , threshold=0.5 , direction=1 , relativeTo=["PARP","PARP_C3","cPARP"] )
+
 ## display reactions (not bad to check they are OK !)
 for reac in model.signalingReactions :
-	print "%s -> %s  __ rate = %e (%s)" % (str(reac.reactants),str(reac.products),reac.rate[1]/3600.,reac.name)
+	print ( "%s -> %s  __ rate = %e (%s)" % (str(reac.reactants),str(reac.products),reac.rate[1]/3600.,reac.name) )
 
 ## generate cpp code to simulate that model
 fpst.buildCppFromModel ( model=model , targetFolderPath = "hEARM_cpp_code_generated" )
@@ -149,3 +152,7 @@ fpst.buildCppFromModel ( model=model , targetFolderPath = "hEARM_cpp_code_genera
 
 
 
+
+## or generate the code of the model reduced at quasi-steady-state of its fast complexes
+## (see FluctuProtSTModel.giveReducedModel, the eliminated complexes keep their CellState accessors)
+# fpst.buildCppFromModel ( model=model.giveReducedModel () , targetFolderPath = "hEARM_reduced_cpp_code_generated" )
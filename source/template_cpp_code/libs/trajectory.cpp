@@ -0,0 +1,107 @@
+// François Bertaux, Inria Paris-Rocquencourt, 2015 //
+
+
+#include <cstring>
+#ifdef FPST_USE_ZLIB
+#include <zlib.h>
+#endif
+
+#include "trajectory.h"
+
+
+static void appendBytes ( string &s , const void* data , size_t numBytes ) { s.append ( (const char*) data , numBytes ) ; }
+static void padTo64 ( string &s ) { s.append ( (64-s.size()%64)%64 , '\0' ) ; }
+
+
+TrajectoryWriter::TrajectoryWriter ( string filename , vector<string> speciesNames , VecDoub observationTimes , bool compress , bool append , Int chunkCells )
+    : NumSpecies(speciesNames.size()), NumTimes(observationTimes.size()), ChunkCells(chunkCells), Compress(compress)
+{
+#ifndef FPST_USE_ZLIB
+    if (Compress) { cout << " compression needs zlib, compile with -DFPST_USE_ZLIB -lz! " << endl; exit(1); }
+#endif
+    string header = makeHeader ( speciesNames , observationTimes ) ;
+    if (append)
+    {
+        // appending is only allowed to a file with the same species and observation times
+        ifstream input ( filename.c_str() , ios::in | ios::binary ) ;
+        if (input.is_open())
+        {
+            string existing ( header.size() , '\0' ) ;
+            input.read ( &existing[0] , header.size() ) ;
+            if ( !input || existing != header ) { cout << " cannot append, file has other species or times! " << endl; exit(1); }
+            input.close () ;
+            mf_Output.open ( filename.c_str() , ios::out | ios::binary | ios::app ) ;
+            if (!mf_Output.is_open()) { cout << " not open! " << endl; exit(1); }
+            return ;
+        }
+    }
+    mf_Output.open ( filename.c_str() , ios::out | ios::binary | ios::trunc ) ;
+    if (!mf_Output.is_open()) { cout << " not open! " << endl; exit(1); }
+    mf_Output.write ( header.data() , header.size() ) ;
+}
+
+TrajectoryWriter::~TrajectoryWriter ()
+{
+    flush () ;
+}
+
+string
+TrajectoryWriter::makeHeader ( vector<string> &speciesNames , VecDoub &observationTimes )
+{
+    string names , header ("FPSTTRJ1") ;
+    for (Int s=0;s<NumSpecies;s++) names += speciesNames[s] + "\n" ;
+    Ullong numSpecies = NumSpecies , numTimes = NumTimes ;
+    Ullong headerBytes = 32 + 8*numTimes + names.size() ;
+    headerBytes += (64-headerBytes%64)%64 ;
+    appendBytes ( header , &headerBytes , 8 ) ;
+    appendBytes ( header , &numSpecies , 8 ) ;
+    appendBytes ( header , &numTimes , 8 ) ;
+    for (Int k=0;k<NumTimes;k++) appendBytes ( header , &observationTimes[k] , 8 ) ;
+    header += names ;
+    padTo64 (header) ;
+    return header ;
+}
+
+void
+TrajectoryWriter::addCell ( Llong cellIndex , MatDoub &values )
+{
+    if ( values.nrows() != NumSpecies || values.ncols() != NumTimes ) { cout << " wrong trajectory size! " << endl; exit(1); }
+    mf_CellIndexes.push_back (cellIndex) ;
+    for (Int s=0;s<NumSpecies;s++) mf_Values.insert ( mf_Values.end() , &values[s][0] , &values[s][0]+NumTimes ) ;
+    if ( Int(mf_CellIndexes.size()) >= ChunkCells ) flush () ;
+}
+
+void
+TrajectoryWriter::flush ()
+{
+    Ullong numCells = mf_CellIndexes.size () ;
+    if (numCells == 0) return ;
+    // raw data : cell indexes, then the values transposed to [species][cell][time]
+    string raw ;
+    raw.reserve ( 8*numCells*(1+NumSpecies*NumTimes) ) ;
+    appendBytes ( raw , &mf_CellIndexes[0] , 8*numCells ) ;
+    for (Int s=0;s<NumSpecies;s++)
+        for (Ullong c=0;c<numCells;c++) appendBytes ( raw , &mf_Values[(c*NumSpecies+s)*NumTimes] , 8*NumTimes ) ;
+    Ullong chunkHeader[8] = { 0 , numCells , raw.size() , raw.size() , 0 , 0 , 0 , 0 } ;
+    memcpy ( chunkHeader , "FPSTCHNK" , 8 ) ;
+    string stored ;
+#ifdef FPST_USE_ZLIB
+    if (Compress)
+    {
+        uLongf storedBytes = compressBound ( raw.size() ) ;
+        stored.resize ( storedBytes ) ;
+        if ( compress2 ( (Bytef*) &stored[0] , &storedBytes , (const Bytef*) raw.data() , raw.size() , Z_DEFAULT_COMPRESSION ) != Z_OK ) { cout << " compression failed! " << endl; exit(1); }
+        stored.resize ( storedBytes ) ;
+        chunkHeader[3] = storedBytes ;
+        chunkHeader[4] = 1 ;
+    }
+#endif
+    const string &data = chunkHeader[4] ? stored : raw ;
+    mf_Output.write ( (const char*) chunkHeader , sizeof(chunkHeader) ) ;
+    mf_Output.write ( data.data() , data.size() ) ;
+    string padding ( (64-data.size()%64)%64 , '\0' ) ;
+    mf_Output.write ( padding.data() , padding.size() ) ;
+    mf_Output.flush () ;
+    mf_CellIndexes.clear () ;
+    mf_Values.clear () ;
+}
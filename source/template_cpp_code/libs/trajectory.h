@@ -0,0 +1,38 @@
+// François Bertaux, Inria Paris-Rocquencourt, 2015 //
+
+#include "nr3.h"
+
+#ifndef TRAJECTORY_H
+#define TRAJECTORY_H
+
+using namespace std;
+
+
+// Chunked binary file of per-species time series, one series per cell and species,
+// all sampled at the same observation times (read with FluctuProtSTTrajectories.py).
+//
+// file header : "FPSTTRJ1" , uint64 headerBytes , uint64 numSpecies , uint64 numTimes ,
+//               numTimes float64 observation times , species names ('\n' terminated) , zero padding to 64 bytes
+// then chunks : "FPSTCHNK" , uint64 numCells , uint64 rawBytes , uint64 storedBytes , uint64 compression (0 none, 1 zlib) ,
+//               uint64 unused[3] , stored data , zero padding to 64 bytes
+// raw chunk data : int64 cell indexes [numCells] , then float64 values [numSpecies][numCells][numTimes],
+//                  so that the values of one species are contiguous (columnar).
+// All numbers are little-endian. Compression needs zlib (compile with -DFPST_USE_ZLIB and link with -lz).
+struct TrajectoryWriter
+{
+	TrajectoryWriter ( string filename , vector<string> speciesNames , VecDoub observationTimes , bool compress = false , bool append = false , Int chunkCells = 1000 ) ;
+	~TrajectoryWriter () ;
+
+	void addCell ( Llong cellIndex , MatDoub &values ) ; // values[species][time]
+	void flush () ; // write the buffered cells as one chunk
+
+	ofstream mf_Output ;
+	Int NumSpecies , NumTimes , ChunkCells ;
+	bool Compress ;
+	vector<Llong> mf_CellIndexes ; // buffered cells
+	vector<Doub> mf_Values ; // buffered values, [cell][species][time]
+	string makeHeader ( vector<string> &speciesNames , VecDoub &observationTimes ) ;
+};
+
+
+#endif
@@ -6,6 +6,9 @@ __ March 2015
 */
 
 
+#ifndef CELL_STATE
+#define CELL_STATE
+
 #include "libs/nr3.h"
 
 #include "ModelParameters.hpp"
@@ -21,3 +24,4 @@ struct CellState
 	// methods for name access to species
 placeholder_name_access};
 
+#endif
@@ -0,0 +1,79 @@
+/*
+__ FluctuProtST, Version 1.2
+__ Francois Bertaux, Inria Paris-Rocquencourt
+__ francois.bertaux@inria.fr
+__ March 2015
+*/
+
+
+#include <cstring>
+
+#include "Checkpoint.hpp"
+
+
+static Ullong alignOffset ( Ullong offset ) { return (offset+63)/64*64 ; }
+
+
+void
+writePopulationCheckpoint ( string filename , vector<CellState*> &cells , ModelParameters* modelParameters , Ran &ran , Ullong randomSeed )
+{
+    Llong N = cells.size () , S = modelParameters->mf_NumAllProteinSpecies , G = modelParameters->mf_NumGenes ;
+    CheckpointHeader header ;
+    memset ( &header , 0 , sizeof(header) ) ;
+    memcpy ( header.magic , "FPSTCKP1" , 8 ) ;
+    header.headerSize = sizeof(header) ;
+    header.numCells = N ;
+    header.numAllProteinSpecies = S ;
+    header.numGenes = G ;
+    header.randomSeed = randomSeed ;
+    header.generatorState[0] = ran.u ; header.generatorState[1] = ran.v ; header.generatorState[2] = ran.w ;
+    header.flags = CHECKPOINT_GLOBAL_GENERATOR ;
+    memcpy ( header.modelHash , modelParameters->mf_ModelHash.c_str() , MIN ( Int(modelParameters->mf_ModelHash.size()) , 40 ) ) ;
+    header.offsets[0] = alignOffset ( sizeof(header) ) ;
+    header.offsets[1] = alignOffset ( header.offsets[0] + N*S*sizeof(Doub) ) ;
+    header.offsets[2] = alignOffset ( header.offsets[1] + N*3*G*sizeof(Doub) ) ;
+    header.offsets[3] = alignOffset ( header.offsets[2] + N*sizeof(Llong) ) ;
+
+    ofstream output ( filename.c_str() , ios::out | ios::binary ) ;
+    if (!output.is_open()) { cout << " not open! " << endl; exit(1); }
+    output.write ( (char*) &header , sizeof(header) ) ;
+    // each cell row is written as one block, rows are contiguous
+    output.seekp ( header.offsets[0] ) ;
+    for (Llong n=0;n<N;n++) output.write ( (char*) &(cells[n]->mf_AllProts[0]) , S*sizeof(Doub) ) ;
+    output.seekp ( header.offsets[1] ) ;
+    for (Llong n=0;n<N;n++) output.write ( (char*) &(cells[n]->mf_GeneMrnas[0]) , 3*G*sizeof(Doub) ) ;
+    output.seekp ( header.offsets[2] ) ;
+    for (Llong n=0;n<N;n++) output.write ( (char*) &n , sizeof(Llong) ) ;
+    output.seekp ( header.offsets[3] ) ;
+    Ullong zero = 0 ;
+    for (Llong n=0;n<N;n++) output.write ( (char*) &zero , sizeof(Ullong) ) ;
+}
+
+
+vector<CellState*>
+readPopulationCheckpoint ( string filename , ModelParameters* modelParameters , Ran &ran )
+{
+    ifstream input ( filename.c_str() , ios::in | ios::binary ) ;
+    if (!input.is_open()) { cout << " cannot open file! " << endl; exit(1); }
+    CheckpointHeader header ;
+    input.read ( (char*) &header , sizeof(header) ) ;
+    if ( !input || memcmp ( header.magic , "FPSTCKP1" , 8 ) != 0 ) { cout << " not a checkpoint file! " << endl; exit(1); }
+    if ( string ( header.modelHash , 40 ) != modelParameters->mf_ModelHash ) { cout << " checkpoint of another model! " << endl; exit(1); }
+
+    Llong N = header.numCells , S = header.numAllProteinSpecies , G = header.numGenes ;
+    // the cell vectors are sized by the model : a header of other sizes would overflow them
+    if ( S != modelParameters->mf_NumAllProteinSpecies || G != modelParameters->mf_NumGenes ) { cout << " checkpoint of another model! " << endl; exit(1); }
+    if ( N < 0 ) { cout << " not a checkpoint file! " << endl; exit(1); }
+    vector<CellState*> cells ( N ) ;
+    for (Llong n=0;n<N;n++) cells[n] = new CellState (modelParameters) ;
+    input.seekg ( header.offsets[0] ) ;
+    for (Llong n=0;n<N;n++) input.read ( (char*) &(cells[n]->mf_AllProts[0]) , S*sizeof(Doub) ) ;
+    input.seekg ( header.offsets[1] ) ;
+    for (Llong n=0;n<N;n++) input.read ( (char*) &(cells[n]->mf_GeneMrnas[0]) , 3*G*sizeof(Doub) ) ;
+    if (!input) { cout << " truncated checkpoint file! " << endl; exit(1); }
+    if ( header.generatorState[0] != 0 || header.generatorState[1] != 0 || header.generatorState[2] != 0 )
+    {
+        ran.u = header.generatorState[0] ; ran.v = header.generatorState[1] ; ran.w = header.generatorState[2] ;
+    }
+    return cells ;
+}
@@ -0,0 +1,46 @@
+/*
+__ FluctuProtST, Version 1.2
+__ Francois Bertaux, Inria Paris-Rocquencourt
+__ francois.bertaux@inria.fr
+__ March 2015
+*/
+
+
+#ifndef CHECKPOINT
+#define CHECKPOINT
+
+#include "MrnaSimulator.hpp"
+
+// Binary checkpoint of a population of cells, in the same format as CellPopulation.saveCheckpoint
+// (FluctuProtSTPy.py) : a 256 bytes header, then the contiguous little-endian arrays AllProts
+// (NumCells x NumAllProteinSpecies doubles), GeneMrnas (NumCells x 3*NumGenes doubles),
+// CellIndexes and RandomCounters (NumCells 64 bits integers), each starting on a 64 bytes
+// boundary so that the file can be memory-mapped.
+// The model hash is checked when reading, and the state of the random generator is saved
+// so that a restored population continues exactly as the saved one would have.
+// The compiled simulator draws all cells from one generator : its checkpoints are flagged
+// CHECKPOINT_GLOBAL_GENERATOR, and hold cell indexes 0..NumCells-1 and zero counters instead of
+// per cell streams, so that CellPopulation.loadCheckpoint refuses to continue the cell streams
+// from them (newStreams=True starts new ones).
+#define CHECKPOINT_GLOBAL_GENERATOR 1
+
+struct CheckpointHeader
+{
+	char magic[8] ; // "FPSTCKP1"
+	Ullong headerSize ;
+	Llong numCells ;
+	Llong numAllProteinSpecies ;
+	Llong numGenes ;
+	Ullong randomSeed ;
+	Ullong generatorState[3] ; // u,v,w of Ran, zero for python populations (per cell counters instead)
+	char modelHash[40] ;
+	Ullong flags ; // CHECKPOINT_GLOBAL_GENERATOR for checkpoints of the compiled simulator
+	char unused1[8] ;
+	Ullong offsets[4] ; // AllProts, GeneMrnas, CellIndexes, RandomCounters
+	char unused2[96] ;
+};
+
+void writePopulationCheckpoint ( string filename , vector<CellState*> &cells , ModelParameters* modelParameters , Ran &ran , Ullong randomSeed ) ;
+vector<CellState*> readPopulationCheckpoint ( string filename , ModelParameters* modelParameters , Ran &ran ) ;
+
+#endif
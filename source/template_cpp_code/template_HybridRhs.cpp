@@ -7,17 +7,24 @@ __ March 2015
 
 
 #include "HybridRhs.hpp"
+placeholder_hybrid_arrays
 
-HybridRhs::HybridRhs ( ModelParameters* modelParameters ) : mf_ModelParameters (modelParameters) {}
+MrnaChunk::MrnaChunk ( Int numGenes , Int maxEventss ) :
+    startMrnas (numGenes,0.) , times (maxEventss,0.) , genes (maxEventss,0) ,
+    newMrnas (maxEventss,0.) , oldMrnas (maxEventss,0.) , numEvents (0) , maxEvents (maxEventss) ,
+    switchTimes (maxEventss,0.) , switchGenes (maxEventss,0) , numSwitches (0) {}
+
+
+HybridRhs::HybridRhs ( ModelParameters* modelParameters ) : mf_ModelParameters (modelParameters) , mf_ConstantMrnas (false) ,
+    mf_computedRateDerivatives ( modelParameters->mf_NumRateDerivatives , 0. ) , mf_NumRhsEvals (0) , mf_NumJacobianEvals (0) {}
 
 
 void
-HybridRhs::setMrnaTables(MatDoub *mrtab, VecDoub *ttab, int neventss)
+HybridRhs::setMrnaChunk(MrnaChunk *chunk)
 {
-    mrnatable=mrtab;
-    timetable=ttab;
+    mrnachunk=chunk;
     tindex=0;
-    nevents=neventss;
+    mf_Mrnas = chunk->startMrnas;
     mf_computedReactionRates = VecDoub ( mf_ModelParameters->mf_NumReacs , 0. ) ;
 }
 
@@ -25,30 +32,69 @@ HybridRhs::setMrnaTables(MatDoub *mrtab, VecDoub *ttab, int neventss)
 void
 HybridRhs::findGoodTindex(const Doub x)
 {
-    if (tindex<0) { cout << "NEGATIVE TINDEX !!!" << endl; exit(234); }
-    if (tindex>nevents-1) { cout << "TOO BIG TINDEX !!!" << endl; exit(235); }
-    while ( ! ( ( x >= (*timetable)[tindex] ) && ( x <= (*timetable)[tindex+1] ) ) )
+    // walk forward/backward over the events of the chunk, updating only the changed mrnas
+#ifdef FPST_PROFILE
+    Int tindex0 = tindex ;
+#endif
+    while ( tindex < mrnachunk->numEvents && mrnachunk->times[tindex] <= x )
     {
-        if ( x > (*timetable)[tindex+1] )
-        {
-            if (tindex <= nevents - 2) { tindex++; }
-//            else { tindex = nevents - 1 ; return ; } // "unsafe" version
-            else { cout << "\t\t\t\tmrna time in the future asked? I quit." << endl; exit(236); }
-        }
-        else
-        {
-            if (tindex>0) { tindex--; }
-            else { cout << "\t\t\t\tmrna time in the past asked? I quit." << endl; exit(237); }
-        }
+        mf_Mrnas[mrnachunk->genes[tindex]] = mrnachunk->newMrnas[tindex] ;
+        tindex++ ;
     }
+    while ( tindex > 0 && mrnachunk->times[tindex-1] > x )
+    {
+        tindex-- ;
+        mf_Mrnas[mrnachunk->genes[tindex]] = mrnachunk->oldMrnas[tindex] ;
+    }
+    FPST_PROFILE_COUNT ( mf_Profile.NumTindexSearches , 1 )
+    FPST_PROFILE_COUNT ( mf_Profile.TindexForwardWalk , MAX ( tindex - tindex0 , 0 ) )
+    FPST_PROFILE_COUNT ( mf_Profile.TindexBackwardWalk , MAX ( tindex0 - tindex , 0 ) )
+    FPST_PROFILE_MAX ( mf_Profile.MaxTindexWalk , long ( abs ( tindex - tindex0 ) ) )
+}
+
+
+void
+HybridRhs::applyNextMrnaEvent()
+{
+    mf_Mrnas[mrnachunk->genes[tindex]] = mrnachunk->newMrnas[tindex] ;
+    tindex++ ;
 }
 
 
 void
 HybridRhs::operator () (const Doub x, VecDoub_I &y, VecDoub_O &dydx)
 {
-    findGoodTindex (x) ;
+    mf_NumRhsEvals++ ;
+    if ( ! mf_ConstantMrnas ) findGoodTindex (x) ;
+    FPST_PROFILE_START ( rhsClock )
+
+placeholder_hybrid_rhs
+    FPST_PROFILE_STOP ( rhsClock , mf_Profile.RhsSeconds )
+    FPST_PROFILE_COUNT ( mf_Profile.NumRhsBodies , 1 )
+}
+
+
+void
+HybridRhs::jacobian (const Doub x, VecDoub_I &y, VecDoub_O &dfdx, MatDoub_O &dfdy)
+{
+    // the rhs does not depend on x between two mrna events, and the jacobian does not depend on mrnas
+    mf_NumJacobianEvals++ ;
+    FPST_PROFILE_START ( jacobianClock )
+    Int n = y.size () ;
+    for ( Int i = 0 ; i < n ; i++ )
+    {
+        dfdx[i] = 0. ;
+        for ( Int j = 0 ; j < n ; j++ ) dfdy[i][j] = 0. ;
+    }
 
- placeholder_hybrid_rhs}
+placeholder_hybrid_jacobian
+    FPST_PROFILE_STOP ( jacobianClock , mf_Profile.JacobianSeconds )
+    FPST_PROFILE_COUNT ( mf_Profile.NumJacobianBodies , 1 )
+}
 
 
+void
+HybridRhs::events (VecDoub_I &y, VecDoub_O &g)
+{
+    // one function per event of the model, crossing zero when the event fires
+placeholder_hybrid_events}
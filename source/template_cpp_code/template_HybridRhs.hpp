@@ -7,6 +7,25 @@ __ March 2015
 
 
 #include "ModelParameters.hpp"
+#include "SimulationProfile.hpp"
+
+// a bounded chunk of the mrna trajectory : mrna levels at chunk start, then one entry
+// per event that changed a mrna level, and the gene switches (only used to set a cell back
+// to its state at the time of a terminal event)
+struct MrnaChunk
+{
+    MrnaChunk ( Int numGenes , Int maxEvents ) ;
+    VecDoub startMrnas ;
+    VecDoub times ;
+    VecInt genes ;
+    VecDoub newMrnas ;
+    VecDoub oldMrnas ;
+    Int numEvents ;
+    Int maxEvents ;
+    VecDoub switchTimes ;
+    VecInt switchGenes ;
+    Int numSwitches ;
+};
 
 struct HybridRhs
 {
@@ -15,16 +34,22 @@ struct HybridRhs
 
 
 	// fields 
-    int tindex;
-    MatDoub *mrnatable;
-    VecDoub *timetable;
-    int nevents;
+    int tindex; // number of chunk events applied to mf_Mrnas
+    MrnaChunk *mrnachunk;
+    VecDoub mf_Mrnas ; // mrna levels at the current time
+    bool mf_ConstantMrnas ; // true when integrating between two mrna events : no lookup needed
     VecDoub mf_computedReactionRates ;
+    VecDoub mf_computedRateDerivatives ;
+    long mf_NumRhsEvals ;
+    long mf_NumJacobianEvals ;
+    SimulationProfile mf_Profile ; // tindex lookup and rhs bodies, with -DFPST_PROFILE (reset by HybridSimulator at each simulate)
 
     // methods
-    void setMrnaTables (MatDoub *mrtab, VecDoub* ttab, int neventss);
+    void setMrnaChunk (MrnaChunk *chunk);
     void findGoodTindex (const Doub x);
+    void applyNextMrnaEvent ();
     void operator() (const Doub x, VecDoub_I &y, VecDoub_O &dydx);
+    void jacobian (const Doub x, VecDoub_I &y, VecDoub_O &dfdx, MatDoub_O &dfdy);
+    void events (VecDoub_I &y, VecDoub_O &g);
 
 };
-
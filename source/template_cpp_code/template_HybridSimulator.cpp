@@ -7,63 +7,301 @@ __ March 2015
 
 #include "HybridSimulator.hpp"
 
-HybridSimulator::HybridSimulator ( ModelParameters* modelParameters , Int randomSeed ) :
-    mf_ModelParameters (modelParameters) , mf_MrnaSimulator ( new MrnaSimulator (mf_ModelParameters,randomSeed) ) ,
-    MaxEvents (1e6) , AbsTolNumErr (1e-6) , RelTolNumErr (1e-6)
+HybridSimulator::HybridSimulator ( ModelParameters* modelParameters , Int randomSeed , bool breakAtMrnaEvents , bool useStiffSolver , Doub leapEpsilon ) :
+    mf_ModelParameters (modelParameters) , mf_MrnaSimulator ( new MrnaSimulator (mf_ModelParameters,randomSeed,leapEpsilon) ) ,
+    ChunkMaxEvents (10000) , AbsTolNumErr (1e-6) , RelTolNumErr (1e-6) , BreakAtMrnaEvents (breakAtMrnaEvents) ,
+    UseStiffSolver (useStiffSolver) , mf_ObservationTimes (NULL) , mf_ObservedSpecies (NULL) , mf_Observations (NULL) ,
+    CheckEvents (true) , EventTimes ( modelParameters->mf_NumEvents , -1. ) , StoppingEvent (-1) , StopTime (0.) ,
+    mf_EventState ( modelParameters->mf_NumAllProteinSpecies , 0. ) , mf_EventValues ( modelParameters->mf_NumEvents , 0. )
 {
     mf_HybridRhs = new HybridRhs (mf_ModelParameters) ;
 
-    // prepare fields for storing mrna/gene trajs
-    FutureGeneTable = MatDoub (mf_ModelParameters->mf_NumGenes,MaxEvents,0.);
-    FutureMrnaTable = MatDoub (mf_ModelParameters->mf_NumGenes,MaxEvents,0.);
-    FutureGeneMrnaEventsTable = VecDoub (MaxEvents,0.);
+    // prepare field for storing mrna trajs, chunk by chunk
+    mf_MrnaChunk = new MrnaChunk (mf_ModelParameters->mf_NumGenes,ChunkMaxEvents);
 
     // prepare ode integrator
     CellOutput = new Output () ;
     mf_HybridOdeInt = new Odeint<StepperDopr5<HybridRhs> > ( mf_ModelParameters->mf_NumAllProteinSpecies , 0. , 0. , AbsTolNumErr , RelTolNumErr ,
                                                         0.1 , 0. , *CellOutput , *mf_HybridRhs ) ;
+    mf_HybridStiffOdeInt = new Odeint<StepperSie<HybridRhs> > ( mf_ModelParameters->mf_NumAllProteinSpecies , 0. , 0. , AbsTolNumErr , RelTolNumErr ,
+                                                        0.1 , 0. , *CellOutput , *mf_HybridRhs ) ;
 }
 
 
 void
 HybridSimulator::simulate (CellState *cellState, Doub duration)
 {
-    computeGeneMrnaTrajs ( cellState , duration ) ;
-    mf_HybridRhs->setMrnaTables (&FutureMrnaTable,&FutureGeneMrnaEventsTable,EventObtained) ;
-    mf_HybridOdeInt->integrate ( cellState->mf_AllProts , 0 , duration ) ;
+    mf_Observations = NULL ;
+    simulateChunks ( cellState , duration ) ;
+}
+
+
+// same simulation, also recording the levels of the species speciesIndexes at the sorted observationTimes
+// (in [0,duration]) into observations[species][time], by dense output of the stepper inside the integration
+void
+HybridSimulator::simulate (CellState *cellState, Doub duration, VecDoub &observationTimes, VecInt &speciesIndexes, MatDoub &observations)
+{
+    Int numTimes = observationTimes.size () , numSpecies = speciesIndexes.size () ;
+    if ( observations.nrows() != numSpecies || observations.ncols() != numTimes ) { cout << "observations has not the size of the schedule" << endl; exit(3); }
+    for (Int k=0;k<numTimes;k++)
+        if ( observationTimes[k] < 0. || observationTimes[k] > duration || ( k > 0 && observationTimes[k] < observationTimes[k-1] ) )
+            { cout << "observation times must be sorted and within the simulated duration" << endl; exit(3); }
+    mf_ObservationTimes = &observationTimes ;
+    mf_ObservedSpecies = &speciesIndexes ;
+    mf_Observations = &observations ;
+    for (NextObservation=0;NextObservation<numTimes && observationTimes[NextObservation]<=0.;NextObservation++)
+        for (Int j=0;j<numSpecies;j++) observations[j][NextObservation] = cellState->mf_AllProts[speciesIndexes[j]] ;
+    simulateChunks ( cellState , duration ) ;
+    // a cell stopped by an event has no level after the stop
+    for (;NextObservation<numTimes;NextObservation++)
+        for (Int j=0;j<numSpecies;j++) observations[j][NextObservation] = NAN ;
+    mf_Observations = NULL ;
 }
 
 
 void
-HybridSimulator::computeGeneMrnaTrajs (CellState *cellState, Doub duration)
+HybridSimulator::simulateChunks (CellState *cellState, Doub duration)
 {
     mf_MrnaSimulator->prepareForSteps ( cellState ) ;
-    Doub dt,nt; Doub t = 0;
-    EventObtained = 1;
-    // store init state
-    for (int i=0;i<mf_ModelParameters->mf_NumGenes;i++)
+    EventObtained = 0 ;
+    NumOkSteps = 0 ; NumBadSteps = 0 ;
+    Profile.reset () ;
+    mf_HybridRhs->mf_Profile.reset () ;
+    FPST_PROFILE_START ( simulateClock )
+    FPST_PROFILE_COUNT ( Profile.NumSimulates , 1 )
+    FPST_PROFILE_MAX ( Profile.ChunkCapacity , long ( ChunkMaxEvents ) )
+    long rhsEvals0 = mf_HybridRhs->mf_NumRhsEvals , jacobianEvals0 = mf_HybridRhs->mf_NumJacobianEvals ;
+    for (Int k=0;k<EventTimes.size();k++) EventTimes[k] = -1. ;
+    StoppingEvent = -1 ;
+    DenseStep = 0.1 ;
+    Doub tStart = 0. , tEnd ;
+    // the mrna trajectory is generated lazily, one chunk ahead of the ode integration
+    while ( tStart < duration && StoppingEvent < 0 )
+    {
+        tEnd = computeNextMrnaChunk ( cellState , duration ) ;
+        mf_HybridRhs->setMrnaChunk (mf_MrnaChunk) ;
+        if ( BreakAtMrnaEvents ) integrateBetweenMrnaEvents ( cellState , tStart , tEnd ) ;
+        else integrateOde ( cellState , tStart , tEnd ) ;
+        tStart = tEnd ;
+    }
+    StopTime = ( StoppingEvent < 0 ) ? duration : EventTimes[StoppingEvent] ;
+    if ( StoppingEvent >= 0 )
+    {
+        // the genes and mrnas are set back to their states at the stop : the switches after it are undone
+        mf_HybridRhs->findGoodTindex ( StopTime ) ;
+        for (Int g=0;g<mf_ModelParameters->mf_NumGenes;g++) cellState->mf_GeneMrnas[3*g+2] = mf_HybridRhs->mf_Mrnas[g] ;
+        for (Int k=mf_MrnaChunk->numSwitches-1;k>=0 && mf_MrnaChunk->switchTimes[k]>StopTime;k--)
+        {
+            Int g = mf_MrnaChunk->switchGenes[k] ;
+            cellState->mf_GeneMrnas[3*g] = 1. - cellState->mf_GeneMrnas[3*g] ;
+            cellState->mf_GeneMrnas[3*g+1] = 1. - cellState->mf_GeneMrnas[3*g+1] ;
+        }
+    }
+    NumRhsEvals = mf_HybridRhs->mf_NumRhsEvals - rhsEvals0 ;
+    NumJacobianEvals = mf_HybridRhs->mf_NumJacobianEvals - jacobianEvals0 ;
+    FPST_PROFILE_STOP ( simulateClock , Profile.TotalSeconds )
+    FPST_PROFILE_COUNT ( Profile.NumOkSteps , NumOkSteps )
+    FPST_PROFILE_COUNT ( Profile.NumBadSteps , NumBadSteps )
+    Profile.add ( mf_HybridRhs->mf_Profile ) ;
+    PopulationProfile.add ( Profile ) ;
+}
+
+
+void
+HybridSimulator::integrateOde (CellState *cellState, Doub tStart, Doub tEnd)
+{
+    if ( tEnd <= tStart || StoppingEvent >= 0 ) return ;
+#ifdef FPST_PROFILE
+    Doub odeClock = giveProfileClock () ;
+    long rhsEvals0 = mf_HybridRhs->mf_NumRhsEvals , steps0 = NumOkSteps + NumBadSteps ;
+#endif
+    if ( mf_Observations != NULL || ( CheckEvents && mf_ModelParameters->mf_NumEvents > 0 ) )
+    {
+        if ( UseStiffSolver ) integrateDense<StepperSie<HybridRhs> > ( cellState , tStart , tEnd ) ;
+        else integrateDense<StepperDopr5<HybridRhs> > ( cellState , tStart , tEnd ) ;
+    }
+    else if ( UseStiffSolver )
+    {
+        Int nok0 = mf_HybridStiffOdeInt->nok , nbad0 = mf_HybridStiffOdeInt->nbad ;
+        mf_HybridStiffOdeInt->integrate ( cellState->mf_AllProts , tStart , tEnd ) ;
+        NumOkSteps += mf_HybridStiffOdeInt->nok - nok0 ; NumBadSteps += mf_HybridStiffOdeInt->nbad - nbad0 ;
+    }
+    else
+    {
+        Int nok0 = mf_HybridOdeInt->nok , nbad0 = mf_HybridOdeInt->nbad ;
+        mf_HybridOdeInt->integrate ( cellState->mf_AllProts , tStart , tEnd ) ;
+        NumOkSteps += mf_HybridOdeInt->nok - nok0 ; NumBadSteps += mf_HybridOdeInt->nbad - nbad0 ;
+    }
+#ifdef FPST_PROFILE
+    Profile.OdeSeconds += giveProfileClock () - odeClock ;
+    Profile.NumOdeSegments++ ;
+    // a StepperDopr5 segment evaluates the rhs once at its start, then 6 times per trial step
+    if ( ! UseStiffSolver )
+        Profile.NumRejectedTrials += MAX ( 0L , ( mf_HybridRhs->mf_NumRhsEvals - rhsEvals0 - 1 ) / 6 - ( NumOkSteps + NumBadSteps - steps0 ) ) ;
+#endif
+}
+
+
+// the stepping loop of Odeint, driving the stepper directly : after each step, the events crossed
+// are located and the observations falling in it are interpolated with the dense output of the stepper
+template <class Stepper>
+void
+HybridSimulator::integrateDense (CellState *cellState, Doub tStart, Doub tEnd)
+{
+    VecDoub &y = cellState->mf_AllProts ;
+    VecDoub dydx ( y.size() ) ;
+    Doub x = tStart , h = DenseStep , hWanted = h , xStop ;
+    bool clipped = false , checkEvents = CheckEvents && mf_ModelParameters->mf_NumEvents > 0 ;
+    VecDoub gOld ( mf_ModelParameters->mf_NumEvents ) , gNew ( mf_ModelParameters->mf_NumEvents ) ;
+    Stepper stepper ( y , dydx , x , AbsTolNumErr , RelTolNumErr , true ) ;
+    (*mf_HybridRhs) ( x , y , dydx ) ;
+    if ( checkEvents ) mf_HybridRhs->events ( y , gOld ) ;
+    while ( x < tEnd )
+    {
+        hWanted = h ;
+        clipped = ( x + h*1.0001 > tEnd ) ;
+        if ( clipped ) h = tEnd - x ;
+        stepper.step ( h , *mf_HybridRhs ) ;
+        if ( stepper.hdid == h ) NumOkSteps++ ; else NumBadSteps++ ;
+        xStop = checkEvents ? locateEvents ( stepper , gOld , gNew ) : x ;
+        while ( mf_Observations != NULL && NextObservation < mf_ObservationTimes->size() && (*mf_ObservationTimes)[NextObservation] <= xStop )
+        {
+            for (Int j=0;j<mf_ObservedSpecies->size();j++)
+                (*mf_Observations)[j][NextObservation] = stepper.dense_out ( (*mf_ObservedSpecies)[j] , (*mf_ObservationTimes)[NextObservation] , stepper.hdid ) ;
+            NextObservation++ ;
+        }
+        if ( StoppingEvent >= 0 )
+        {
+            // the cell ends at the terminal event
+            for (Int i=0;i<y.size();i++) mf_EventState[i] = stepper.dense_out ( i , xStop , stepper.hdid ) ;
+            y = mf_EventState ;
+            x = xStop ;
+            return ;
+        }
+        for (Int k=0;k<gOld.size();k++) gOld[k] = gNew[k] ;
+        h = stepper.hnext ;
+    }
+    // the next segment goes on with the step size of the controller, not with a step shortened to reach tEnd
+    DenseStep = clipped ? hWanted : h ;
+}
+
+
+// events crossed during the last step (only the first crossing of each event in a simulate counts) : their times
+// are located by Illinois regula falsi on the dense output, up to the earliest terminal event, which sets StoppingEvent.
+// Returns the time up to which the step is kept.
+template <class Stepper>
+Doub
+HybridSimulator::locateEvents (Stepper &stepper, VecDoub &gOld, VecDoub &gNew)
+{
+    Doub x0 = stepper.x - stepper.hdid , x1 = stepper.x , xStop = x1 ;
+    Doub a , b , ga , gb , xr , gr ;
+    Int side , numEvents = gOld.size () ;
+    VecDoub crossings ( numEvents , -1. ) ;
+    mf_HybridRhs->events ( stepper.y , gNew ) ;
+    for (Int k=0;k<numEvents;k++)
+    {
+        if ( EventTimes[k] >= 0. ) continue ;
+        Int direction = mf_ModelParameters->mf_EventDirections[k] ;
+        bool up = ( gOld[k] < 0. && gNew[k] >= 0. ) , down = ( gOld[k] > 0. && gNew[k] <= 0. ) ;
+        if ( ! ( ( up && direction >= 0 ) || ( down && direction <= 0 ) ) ) continue ;
+        // [a,b] brackets the crossing, the reported time b is the first one found past it
+        a = x0 ; b = x1 ; ga = gOld[k] ; gb = gNew[k] ; side = 0 ;
+        for (Int it=0;it<100 && gb!=0. && b-a>1e-12*MAX(1.,abs(b));it++)
+        {
+            xr = ( a*gb - b*ga ) / ( gb - ga ) ;
+            if ( xr <= a || xr >= b ) xr = 0.5 * ( a + b ) ;
+            gr = giveEventValue ( stepper , k , xr ) ;
+            if ( ( gr > 0. ) == ( ga > 0. ) && gr != 0. ) { a = xr ; ga = gr ; if ( side == 1 ) gb *= 0.5 ; side = 1 ; }
+            else { b = xr ; gb = gr ; if ( side == -1 ) ga *= 0.5 ; side = -1 ; }
+        }
+        crossings[k] = b ;
+        if ( mf_ModelParameters->mf_EventTerminal[k] && b < xStop ) { xStop = b ; StoppingEvent = k ; }
+    }
+    for (Int k=0;k<numEvents;k++)
+        if ( crossings[k] >= 0. && crossings[k] <= xStop ) EventTimes[k] = crossings[k] ;
+    if ( StoppingEvent >= 0 ) EventTimes[StoppingEvent] = xStop ;
+    return xStop ;
+}
+
+
+template <class Stepper>
+Doub
+HybridSimulator::giveEventValue (Stepper &stepper, Int idxEvent, Doub x)
+{
+    for (Int i=0;i<mf_EventState.size();i++) mf_EventState[i] = stepper.dense_out ( i , x , stepper.hdid ) ;
+    mf_HybridRhs->events ( mf_EventState , mf_EventValues ) ;
+    return mf_EventValues[idxEvent] ;
+}
+
+
+void
+HybridSimulator::printStatistics ()
+{
+    cout << ( UseStiffSolver ? "StepperSie" : "StepperDopr5" ) << " __ ok steps = " << NumOkSteps << " __ rejected steps = " << NumBadSteps
+         << " __ rhs evals = " << NumRhsEvals << " __ jacobian evals = " << NumJacobianEvals << " __ mrna events = " << EventObtained << " __ mrna leaps = " << mf_MrnaSimulator->NumLeaps << endl ;
+    if ( FPST_PROFILE_ENABLED ) Profile.print ( cout , "profile " ) ;
+}
+
+
+void
+HybridSimulator::integrateBetweenMrnaEvents (CellState *cellState, Doub tStart, Doub tEnd)
+{
+    // mrnas are constant between two events : each event is a hard breakpoint,
+    // so the stepper never steps across a discontinuity and the rhs needs no lookup
+    mf_HybridRhs->mf_ConstantMrnas = true ;
+    Doub t = tStart , tEvent ;
+    for ( Int k = 0 ; k <= mf_MrnaChunk->numEvents ; k++ )
     {
-        FutureGeneTable[i][0] = cellState->mf_GeneMrnas [3*i] ;
-        FutureMrnaTable[i][0] = cellState->mf_GeneMrnas [3*i+2] ;
-        FutureGeneMrnaEventsTable[0] = 0. ;
+        tEvent = ( k < mf_MrnaChunk->numEvents ) ? mf_MrnaChunk->times[k] : tEnd ;
+        integrateOde ( cellState , t , tEvent ) ;
+        if ( StoppingEvent >= 0 ) break ;
+        t = MAX ( t , tEvent ) ;
+        if ( k < mf_MrnaChunk->numEvents ) mf_HybridRhs->applyNextMrnaEvent () ;
     }
-    // simulate
-    while (t<duration)
+    mf_HybridRhs->mf_ConstantMrnas = false ;
+}
+
+
+Doub
+HybridSimulator::computeNextMrnaChunk (CellState *cellState, Doub duration)
+{
+    // store mrna levels at chunk start
+    for (int i=0;i<mf_ModelParameters->mf_NumGenes;i++) mf_MrnaChunk->startMrnas[i] = cellState->mf_GeneMrnas [3*i+2] ;
+    mf_MrnaChunk->numEvents = 0 ;
+    mf_MrnaChunk->numSwitches = 0 ;
+    // simulate until the chunk is full or the duration is reached
+    Doub t = mf_MrnaSimulator->t , nt ;
+    Int m , g ;
+    FPST_PROFILE_START ( mrnaClock )
+    while ( t < duration && mf_MrnaChunk->numEvents < ChunkMaxEvents && mf_MrnaChunk->numSwitches < ChunkMaxEvents )
     {
         nt = mf_MrnaSimulator->doStep ( cellState , duration ) ;
-        dt = nt - t ;
-        if (dt==0) { cout << "dt = 0.." << endl; exit(3);}
-        t = mf_MrnaSimulator->t;
-        // store
-        for (int i=0;i<mf_ModelParameters->mf_NumGenes;i++)
+        FPST_PROFILE_COUNT ( Profile.NumMrnaSteps , 1 )
+        if (nt==t) throw runtime_error ( "mrna step of zero length (dt = 0)" ) ; // not exit : the simulator may run in a host program
+        t = nt ;
+        if ( mf_MrnaSimulator->lastSwitchedGene >= 0 )
         {
-            FutureGeneTable[i][EventObtained] = cellState->mf_GeneMrnas [3*i];
-            FutureMrnaTable[i][EventObtained] = cellState->mf_GeneMrnas [3*i+2];
-            FutureGeneMrnaEventsTable[EventObtained] = t;
+            mf_MrnaChunk->switchTimes[mf_MrnaChunk->numSwitches] = t ;
+            mf_MrnaChunk->switchGenes[mf_MrnaChunk->numSwitches] = mf_MrnaSimulator->lastSwitchedGene ;
+            mf_MrnaChunk->numSwitches++ ;
         }
-        EventObtained++;
-        if (EventObtained>MaxEvents) { cout << "Mrna Table To short. Change Max Events ?" << endl; exit(42); }
+        m = mf_MrnaSimulator->lastReaction ;
+        if ( m < 0 || mf_MrnaSimulator->lastMrnaChange == 0. ) continue ; // no event, gene switch or empty leap : no mrna change
+        g = m/4 ;
+        // store only the changed mrna
+        mf_MrnaChunk->times[mf_MrnaChunk->numEvents] = t ;
+        mf_MrnaChunk->genes[mf_MrnaChunk->numEvents] = g ;
+        mf_MrnaChunk->newMrnas[mf_MrnaChunk->numEvents] = cellState->mf_GeneMrnas [3*g+2] ;
+        mf_MrnaChunk->oldMrnas[mf_MrnaChunk->numEvents] = cellState->mf_GeneMrnas [3*g+2] - mf_MrnaSimulator->lastMrnaChange ;
+        mf_MrnaChunk->numEvents++ ;
+        EventObtained++ ;
     }
+    FPST_PROFILE_STOP ( mrnaClock , Profile.MrnaSeconds )
+    FPST_PROFILE_COUNT ( Profile.NumChunks , 1 )
+    FPST_PROFILE_COUNT ( Profile.NumMrnaChanges , mf_MrnaChunk->numEvents )
+    FPST_PROFILE_COUNT ( Profile.NumFullChunks , ( mf_MrnaChunk->numEvents == ChunkMaxEvents || mf_MrnaChunk->numSwitches == ChunkMaxEvents ) ? 1 : 0 )
+    FPST_PROFILE_MAX ( Profile.MaxChunkEvents , long ( mf_MrnaChunk->numEvents ) )
+    return t ;
 }
 
 
@@ -9,33 +9,68 @@ __ March 2015
 #include "HybridRhs.hpp"
 
 # include "libs/odeint.h"
+#include <stdexcept>
 
 struct HybridSimulator
 {
 
     // constructor and key fields
-    HybridSimulator ( ModelParameters* modelParameters , Int randomSeed = 1 ) ;
+    HybridSimulator ( ModelParameters* modelParameters , Int randomSeed = 1 , bool breakAtMrnaEvents = false , bool useStiffSolver = false , Doub leapEpsilon = 0. ) ;
 	ModelParameters* mf_ModelParameters ;
     MrnaSimulator* mf_MrnaSimulator ;
 
     // key methods
     void simulate ( CellState* cellState , Doub duration ) ;
-    void computeGeneMrnaTrajs ( CellState* cellState , Doub duration ) ;
+    void simulate ( CellState* cellState , Doub duration , VecDoub &observationTimes , VecInt &speciesIndexes , MatDoub &observations ) ;
+    void simulateChunks ( CellState* cellState , Doub duration ) ;
+    Doub computeNextMrnaChunk ( CellState* cellState , Doub duration ) ;
+    void integrateBetweenMrnaEvents ( CellState* cellState , Doub tStart , Doub tEnd ) ;
+    void integrateOde ( CellState* cellState , Doub tStart , Doub tEnd ) ;
+    template <class Stepper> void integrateDense ( CellState* cellState , Doub tStart , Doub tEnd ) ;
+    template <class Stepper> Doub locateEvents ( Stepper &stepper , VecDoub &gOld , VecDoub &gNew ) ;
+    template <class Stepper> Doub giveEventValue ( Stepper &stepper , Int idxEvent , Doub x ) ;
+    void printStatistics () ;
 
 
-    // mrna/gene trajs storage fields
-    const Int MaxEvents ;
-    MatDoub FutureMrnaTable;
-    MatDoub FutureGeneTable;
-    VecDoub FutureGeneMrnaEventsTable;
-    Int EventObtained;
+    // mrna trajs storage fields (one bounded chunk at a time)
+    const Int ChunkMaxEvents ;
+    MrnaChunk* mf_MrnaChunk ;
+    Int EventObtained; // total number of mrna changes (events, or leaps with LeapEpsilon > 0) during the last simulate
 
     // ode integration fields
     HybridRhs* mf_HybridRhs ;
     Odeint<StepperDopr5<HybridRhs> >* mf_HybridOdeInt ;
+    Odeint<StepperSie<HybridRhs> >* mf_HybridStiffOdeInt ; // semi-implicit extrapolation, uses HybridRhs::jacobian
     Output* CellOutput ;
     const Doub AbsTolNumErr ;
     const Doub RelTolNumErr ;
+    bool BreakAtMrnaEvents ; // integrate piecewise between mrna events instead of stepping across them
+    bool UseStiffSolver ;
+
+    // observation schedule of the current simulate, filled by dense output (NULL when not observing)
+    VecDoub* mf_ObservationTimes ;
+    VecInt* mf_ObservedSpecies ;
+    MatDoub* mf_Observations ; // [species][time]
+    Int NextObservation ;
+    Doub DenseStep ; // step size carried over from one integrated segment to the next
+
+    // threshold events of the model (see HybridRhs::events), located by root-finding on the dense output
+    bool CheckEvents ; // set to false to ignore the events, e.g. during equilibration
+    VecDoub EventTimes ; // time of the first crossing of each event during the last simulate, -1 if none
+    Int StoppingEvent ; // terminal event that stopped the last simulate, -1 if the full duration was simulated
+    Doub StopTime ; // time reached by the last simulate
+    VecDoub mf_EventState ; // work space for the root-finding
+    VecDoub mf_EventValues ;
+
+    // statistics of the last simulate
+    Int NumOkSteps ;
+    Int NumBadSteps ;
+    long NumRhsEvals ;
+    long NumJacobianEvals ;
+
+    // hot-path counters and timers (see SimulationProfile.hpp), filled only when compiled with -DFPST_PROFILE
+    SimulationProfile Profile ; // of the last simulate, i.e. of one cell
+    SimulationProfile PopulationProfile ; // sum over the simulates since the construction (reset it to start a population)
 
 };
 
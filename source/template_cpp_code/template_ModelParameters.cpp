@@ -6,9 +6,58 @@ __ March 2015
 */
 
 
+#include <fstream>
+
 #include "ModelParameters.hpp"
 
-ModelParameters::ModelParameters ()
+ModelParameters::ModelParameters ( string parameterFile )
 {
     // init parameter values
 placeholder_parameter_init}
+
+
+static bool readParameterValues ( ifstream &file , VecDoub &values )
+{
+    for (Int i=0;i<values.size();i++) file >> values[i] ;
+    return bool (file) ;
+}
+
+string
+ModelParameters::readParameterFile ( string filename )
+{
+    ModelParameters values (*this) ; // read into a copy, so that a bad file leaves the parameters unchanged
+    ifstream file ( filename.c_str() ) ;
+    if ( !file ) return "cannot open parameter file " + filename ;
+    string name , value ;
+    while ( file >> name )
+    {
+        if ( name[0] == '#' ) { getline ( file , value ) ; continue ; }
+        bool ok = true ;
+        if ( name == "topologyHash" )
+        {
+            file >> value ;
+            if ( value != mf_TopologyHash ) return "parameter file of another model: " + filename ;
+        }
+        else if ( name == "modelHash" ) file >> values.mf_ModelHash ;
+        else if ( name == "kons" ) ok = readParameterValues ( file , values.mf_kons ) ;
+        else if ( name == "koffs" ) ok = readParameterValues ( file , values.mf_koffs ) ;
+        else if ( name == "ksms" ) ok = readParameterValues ( file , values.mf_ksms ) ;
+        else if ( name == "rms" ) ok = readParameterValues ( file , values.mf_rms ) ;
+        else if ( name == "ksps" ) ok = readParameterValues ( file , values.mf_ksps ) ;
+        else if ( name == "rps" ) ok = readParameterValues ( file , values.mf_rps ) ;
+        else if ( name == "kreacs" ) ok = readParameterValues ( file , values.mf_kreacs ) ;
+        else if ( name == "degrates" ) ok = readParameterValues ( file , values.mf_degrates ) ;
+        else if ( name == "eventThresholds" ) ok = readParameterValues ( file , values.mf_EventThresholds ) ;
+        else return "unknown parameter " + name + " in parameter file " + filename ;
+        if ( !ok ) return "wrong number of values for parameter " + name + " in parameter file " + filename ;
+    }
+    *this = values ;
+    return "" ;
+}
+
+void
+ModelParameters::loadParameterFile ( string filename )
+{
+    string error = readParameterFile (filename) ;
+    if ( error != "" ) { cout << " " << error << endl; exit(1); }
+}
@@ -17,6 +17,10 @@ struct ModelParameters
 	Int mf_NumAllProteinSpecies ;
 	Int mf_NumModifiedProteins ;
 	Int mf_NumReacs ;
+	Int mf_NumRateDerivatives ;
+	string mf_ModelHash ; // identifies the model in checkpoints
+	string mf_TopologyHash ; // identifies species, reactions and events, but not the parameter values
+	vector<string> mf_SpeciesNames ; // natives then modified, in the order of mf_AllProts
 	VecDoub mf_kons ;
 	VecDoub mf_koffs ;
 	VecDoub mf_ksms ;
@@ -25,8 +29,15 @@ struct ModelParameters
 	VecDoub mf_rps ;
 	VecDoub mf_kreacs ;
 	VecDoub mf_degrates ;
+	Int mf_NumEvents ; // threshold events, see HybridRhs::events
+	vector<string> mf_EventNames ;
+	VecDoub mf_EventThresholds ;
+	VecInt mf_EventDirections ; // 1 upward crossings, -1 downward, 0 both
+	vector<bool> mf_EventTerminal ; // a terminal event stops the simulation of the cell
 
-	ModelParameters () ;
+	ModelParameters ( string parameterFile = "parameters.txt" ) ; // the file is only read when the parameters are not baked (and it is not "")
+	void loadParameterFile ( string filename ) ; // parameter values (and model hash) written by writeParameterFile, exits on a bad file
+	string readParameterFile ( string filename ) ; // the same, but returns the error ("" if none) and keeps the parameters on a bad file
 };
 
 #endif
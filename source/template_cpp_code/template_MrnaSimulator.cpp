@@ -8,46 +8,14 @@ __ March 2015
 
 #include "MrnaSimulator.hpp"
 
-// additionally needed function
-void sparmatfill(NRvector<NRsparseCol> &sparmat, MatDoub &fullmat)
-{
-    Int n,m,nz,nn=fullmat.nrows(),mm=fullmat.ncols();
-    if (sparmat.size() != mm) throw("bad sizes");
-    for (m=0;m<mm;m++)
-    {
-        for (nz=n=0;n<nn;n++) if (fullmat[n][m]) nz++;
-        sparmat[m].resize(nn,nz);
-        for (nz=n=0;n<nn;n++) if (fullmat[n][m])
-        {
-            sparmat[m].row_ind[nz] = n;
-            sparmat[m].val[nz++] = fullmat[n][m];
-        }
-    }
-}
-
 
 // constructor
-MrnaSimulator::MrnaSimulator ( ModelParameters* modelParameters , Int seed )
-    : mf_ModelParameters(modelParameters), ran(seed),
-    mm(4*mf_ModelParameters->mf_NumGenes), nn(3*mf_ModelParameters->mf_NumGenes),
-    a(mm,0.), outchg(mm), depend(mm), pr(mm), t(0.),asum(0.),
-    dispatch(new rateptr[mm])
-{
-    Int i,j,k,d;
-    describereactions();
-    sparmatfill(outchg,outstate);
-    MatDoub dep(mm,mm);
-    for (i=0;i<mm;i++) for (j=0;j<mm;j++)
-    {
-        d = 0;
-        for (k=0;k<nn;k++) d = d || (instate[k][i] && outstate[k][j]);
-        dep[i][j] = d;
-    }
-    sparmatfill(depend,dep);
-    for (i=0;i<mm;i++)
-    {
-        pr[i] = i;
-    }
+MrnaSimulator::MrnaSimulator ( ModelParameters* modelParameters , Int seed , Doub leapEpsilon )
+    : mf_ModelParameters(modelParameters), ran(seed), NumGenes(mf_ModelParameters->mf_NumGenes),
+    a(NumGenes,4,0.), asum(NumGenes,0.), nextTimes(NumGenes,0.), heap(NumGenes,0),
+    t(0.), lastReaction(-1), lastMrnaChange(0.), lastSwitchedGene(-1), LeapEpsilon(leapEpsilon), LeapMinEvents(2.),
+    switchTimes(NumGenes,0.), mrnaTimes(NumGenes,0.), leapStarts(NumGenes,-1.), leapEnds(NumGenes,0.), leapChanges(NumGenes,0.), mrnaScales(NumGenes,1.), NumLeaps(0)
+{
 }
 
 
@@ -56,52 +24,71 @@ void
 MrnaSimulator::prepareForSteps ( CellState* cellState )
 {
     t=0;
-    Int i;
-    asum = 0.;
-    for (i=0;i<mm;i++)
+    NumLeaps=0;
+    Int g,k;
+    Doub kon,koff;
+    for (g=0;g<NumGenes;g++)
     {
-        pr[i] = i;
-        a[i] = (this->*dispatch[i])(cellState->mf_GeneMrnas);
-        asum += a[i];
+        computeGeneRates (cellState->mf_GeneMrnas,g) ;
+        if (LeapEpsilon > 0.)
+        {
+            // mean mrna level of the gene, at least one
+            kon = mf_ModelParameters->mf_kons[g] ; koff = mf_ModelParameters->mf_koffs[g] ;
+            mrnaScales[g] = 1. ;
+            if ( mf_ModelParameters->mf_rms[g] > 0. && kon+koff > 0. )
+                mrnaScales[g] = MAX ( mf_ModelParameters->mf_ksms[g]*kon/((kon+koff)*mf_ModelParameters->mf_rms[g]) , 1. ) ;
+            scheduleSwitch (g) ;
+            scheduleMrna (cellState->mf_GeneMrnas,g) ;
+            nextTimes[g] = MIN (switchTimes[g],mrnaTimes[g]) ;
+        }
+        else scheduleGene (g) ;
+        heap[g] = g ;
     }
+    for (k=NumGenes/2-1;k>=0;k--) siftDown (k) ;
 }
 
 // simulation
 Doub
 MrnaSimulator::doStep ( CellState* cellState , Doub targetTime )
 {
-    Int i,n,m,k=0;
-    Doub tau,atarg,sum,anew;
-    if (asum == 0.) {t = targetTime; return t;}
-    tau = -log(ran.doub())/asum;
-    if (t+tau>targetTime)
+    Int g,r;
+    Doub atarg,sum;
+    lastReaction = -1;
+    lastMrnaChange = 0.;
+    lastSwitchedGene = -1;
+    if (NumGenes == 0) {t = targetTime; return t;}
+    g = heap[0];
+    if (nextTimes[g]>targetTime)
     {
+        if (LeapEpsilon > 0.) endLeaps (cellState->mf_GeneMrnas,targetTime) ;
         t=targetTime;
         return t;
     }
-    atarg = ran.doub()*asum;
-    sum = a[pr[0]];
-    while (sum < atarg) sum += a[pr[++k]];
-    m = pr[k];
-    if (k > 0) SWAP(pr[k],pr[k-1]);
-    if (k == mm-1) asum = sum;
-    n = outchg[m].nvals;
-    for (i=0;i<n;i++)
+    t = nextTimes[g];
+    if (LeapEpsilon > 0.)
     {
-        k = outchg[m].row_ind[i];
-        cellState->mf_GeneMrnas[k] += outchg[m].val[i];
+        doLeapStep (cellState->mf_GeneMrnas,g) ;
+        siftDown (0) ;
+        return t;
     }
-    n = depend[m].nvals;
-    for (i=0;i<n;i++)
+    // which reaction of gene g
+    atarg = ran.doub()*asum[g];
+    sum = a[g][0];
+    r = 0;
+    while (sum < atarg && r < 3) sum += a[g][++r];
+    lastReaction = 4*g+r;
+    switch (r)
     {
-        k = depend[m].row_ind[i];
-        anew = (this->*dispatch[k])(cellState->mf_GeneMrnas);
-        asum += (anew - a[k]);
-        a[k] = anew;
+        case 0 : cellState->mf_GeneMrnas[3*g] -= 1. ; cellState->mf_GeneMrnas[3*g+1] += 1. ; lastSwitchedGene = g ; break ;
+        case 1 : cellState->mf_GeneMrnas[3*g] += 1. ; cellState->mf_GeneMrnas[3*g+1] -= 1. ; lastSwitchedGene = g ; break ;
+        case 2 : cellState->mf_GeneMrnas[3*g+2] += 1. ; lastMrnaChange = 1. ; break ;
+        case 3 : cellState->mf_GeneMrnas[3*g+2] -= 1. ; lastMrnaChange = -1. ; break ;
     }
-    if (t*asum < 0.1)
-        for (asum=0.,i=0;i<mm;i++) asum += a[i];
-    return (t += tau);
+    // only gene g changed : update its rates and its next event time, which can only be later
+    computeGeneRates (cellState->mf_GeneMrnas,g) ;
+    scheduleGene (g) ;
+    siftDown (0) ;
+    return t;
 }
 
 // sample a cell from steady-state
@@ -109,50 +96,280 @@ CellState*
 MrnaSimulator::sampleFromOnlyNativeSteadyState (Doub toReachSteadyStateDuration)
 {
     CellState* cell = new CellState (mf_ModelParameters) ;
+    relaxNativeProteins ( cell , toReachSteadyStateDuration ) ;
+    return cell ;
+}
+
+// sample a cell from steady-state without the long burn-in : for each gene, the gene state and the mrna
+// are drawn from the exact stationary law of the telegraph model (given the gene state, mrna ~ Poisson(ksm/rm*q)
+// with q ~ Beta(kon/rm+1,koff/rm) if on, q ~ Beta(kon/rm,koff/rm+1) if off), and the native protein from a gamma
+// law conditioned on them with the exact first and second moments. A short relaxation then fixes higher moments.
+CellState*
+MrnaSimulator::sampleFromTelegraphSteadyState (Doub relaxationDuration)
+{
+    CellState* cell = new CellState (mf_ModelParameters) ;
+    Doub kon,koff,ksm,rm,ksp,rp,on,q;
+    Doub Es,Em,Ey,Esm,Emm,Esy,Emy,Eyy,Vs,Vm,Vy,Csm,Csy,Cmy,det,betaGene,betaMrna,residualVar,condMean;
+    for (Int g=0;g<NumGenes;g++)
+    {
+        kon = mf_ModelParameters->mf_kons[g] ; koff = mf_ModelParameters->mf_koffs[g] ;
+        ksm = mf_ModelParameters->mf_ksms[g] ; rm = mf_ModelParameters->mf_rms[g] ;
+        ksp = mf_ModelParameters->mf_ksps[g] ; rp = mf_ModelParameters->mf_rps[g] ;
+        // stationary moments of (gene on, mrna, native protein)
+        Es = kon/(kon+koff) ; Em = ksm*Es/rm ; Ey = ksp*Em/rp ;
+        Esm = (kon*Em+ksm*Es)/(kon+koff+rm) ;
+        Emm = (ksm*(2.*Esm+Es)+rm*Em)/(2.*rm) ;
+        Esy = (kon*Ey+ksp*Esm)/(kon+koff+rp) ;
+        Emy = (ksm*Esy+ksp*Emm)/(rm+rp) ;
+        Eyy = ksp*Emy/rp ;
+        Vs = Es*(1.-Es) ; Vm = Emm-Em*Em ; Vy = Eyy-Ey*Ey ;
+        Csm = Esm-Es*Em ; Csy = Esy-Es*Ey ; Cmy = Emy-Em*Ey ;
+        // gene state and mrna
+        on = ( ran.doub() < Es ) ? 1. : 0. ;
+        if (koff == 0.) q = 1. ;
+        else if (kon == 0.) q = 0. ;
+        else if (on == 1.) q = betaDev (kon/rm+1.,koff/rm) ;
+        else q = betaDev (kon/rm,koff/rm+1.) ;
+        cell->mf_GeneMrnas[3*g] = on ;
+        cell->mf_GeneMrnas[3*g+1] = 1.-on ;
+        cell->mf_GeneMrnas[3*g+2] = poissonDev (ksm/rm*q) ;
+        // native protein, by linear regression on (gene on, mrna)
+        det = Vs*Vm-Csm*Csm ;
+        if (det > 1e-12*Vs*Vm) { betaGene = (Vm*Csy-Csm*Cmy)/det ; betaMrna = (Vs*Cmy-Csm*Csy)/det ; }
+        else if (Vm > 0.) { betaGene = 0. ; betaMrna = Cmy/Vm ; }
+        else { betaGene = 0. ; betaMrna = 0. ; }
+        residualVar = Vy-betaGene*Csy-betaMrna*Cmy ;
+        condMean = MAX ( Ey+betaGene*(on-Es)+betaMrna*(cell->mf_GeneMrnas[3*g+2]-Em) , 0. ) ;
+        if (residualVar > 0. && condMean > 0.) cell->mf_AllProts[g] = gammaDev (condMean*condMean/residualVar)*residualVar/condMean ;
+        else cell->mf_AllProts[g] = condMean ;
+    }
+    relaxNativeProteins ( cell , relaxationDuration ) ;
+    return cell ;
+}
+
+// native part only : exact exponential relaxation of native proteins between mrna events
+void
+MrnaSimulator::relaxNativeProteins ( CellState* cell , Doub duration )
+{
     prepareForSteps (cell) ;
     Doub dt,oldt,newt;
-    while (t<toReachSteadyStateDuration)
+    VecDoub mrnas (NumGenes) ;
+    while (t<duration)
     {
+        // the proteins relax towards the levels set by the mrnas before the step
+        for (Int i=0;i<NumGenes;i++) mrnas[i] = cell->mf_GeneMrnas[3*i+2] ;
         oldt = t ;
-        newt = doStep ( cell , toReachSteadyStateDuration ) ;
+        newt = doStep ( cell , duration ) ;
         dt = newt - oldt ;
         for (Int i=0;i<mf_ModelParameters->mf_NumGenes;i++)
         {
-            cell->mf_AllProts[i] = mf_ModelParameters->mf_ksps[i]*cell->mf_GeneMrnas[3*i+2]/mf_ModelParameters->mf_rps[i]+(cell->mf_AllProts[i]-mf_ModelParameters->mf_ksps[i]*cell->mf_GeneMrnas[3*i+2]/mf_ModelParameters->mf_rps[i])*exp(-mf_ModelParameters->mf_rps[i]*dt);
+            cell->mf_AllProts[i] = mf_ModelParameters->mf_ksps[i]*mrnas[i]/mf_ModelParameters->mf_rps[i]+(cell->mf_AllProts[i]-mf_ModelParameters->mf_ksps[i]*mrnas[i]/mf_ModelParameters->mf_rps[i])*exp(-mf_ModelParameters->mf_rps[i]*dt);
         }
     }
-    return cell ;
 }
 
 
-// others function, notably for init structure ( called by constructor )
+// others function, for the per gene rates and the event queue
+void
+MrnaSimulator::computeGeneRates ( VecDoub &s , Int g )
+{
+    a[g][0] = mf_ModelParameters->mf_koffs[g]*s[3*g] ;
+    a[g][1] = mf_ModelParameters->mf_kons[g]*s[3*g+1] ;
+    a[g][2] = mf_ModelParameters->mf_ksms[g]*s[3*g] ;
+    a[g][3] = mf_ModelParameters->mf_rms[g]*s[3*g+2] ;
+    asum[g] = a[g][0] + a[g][1] + a[g][2] + a[g][3] ;
+}
+
 void
-MrnaSimulator::describereactions ()
-{
-	instate = MatDoub ( nn , mm , 0. ) ;
-	Int m = 0 ;
-	for ( Int g=0 ; g<mf_ModelParameters->mf_NumGenes ; g++ )
-	{
-		instate [3*g+0][m] = 1. ; m++ ;
-		instate [3*g+1][m] = 1. ; m++ ;
-		instate [3*g+0][m] = 1. ; m++ ;
-		instate [3*g+2][m] = 1. ; m++ ;
-	}
-
-	outstate = MatDoub ( nn , mm , 0. ) ;
-	m = 0 ;
-	for ( Int g=0 ; g<mf_ModelParameters->mf_NumGenes ; g++ )
-	{
-		outstate [3*g+0][m] = -1. ;
-		outstate [3*g+1][m] = 1. ; m++ ;
-
-		outstate [3*g+0][m] = 1. ;
-		outstate [3*g+1][m] = -1. ; m++ ;
-
-		outstate [3*g+2][m] = 1. ; m++ ;
-		outstate [3*g+2][m] = -1. ; m++ ;
-	}
-
-	// for dispatching
-placeholder_dispatch
+MrnaSimulator::scheduleGene ( Int g )
+{
+    if (asum[g] == 0.) nextTimes[g] = numeric_limits<Doub>::max () ;
+    else nextTimes[g] = t - log(ran.doub())/asum[g] ;
+}
+
+// leap mode : gene g has the earliest next time, either its switch, its next mrna reaction, or the middle or the
+// end of its current leap (a leap stopped by a switch ends at the switch time, both are then done)
+void
+MrnaSimulator::doLeapStep ( VecDoub &s , Int g )
+{
+    bool switched = ( switchTimes[g] <= t ) ;
+    if ( mrnaTimes[g] <= switchTimes[g] )
+    {
+        if ( leapStarts[g] >= 0. && t < leapEnds[g] )
+        {
+            // the mrna change of a leap is applied in its middle, so that the piecewise constant mrna level seen
+            // by the ode has the right integral over the leap up to second order
+            lastMrnaChange = leapChanges[g] ;
+            s[3*g+2] += lastMrnaChange ;
+            lastReaction = 4*g + ( lastMrnaChange >= 0. ? 2 : 3 ) ;
+            mrnaTimes[g] = leapEnds[g] ;
+            nextTimes[g] = MIN (switchTimes[g],mrnaTimes[g]) ;
+            return ;
+        }
+        if ( leapStarts[g] < 0. )
+        {
+            lastMrnaChange = ( ran.doub()*(a[g][2]+a[g][3]) < a[g][2] ) ? 1. : -1. ;
+            s[3*g+2] += lastMrnaChange ;
+            lastReaction = 4*g + ( lastMrnaChange >= 0. ? 2 : 3 ) ;
+        }
+    }
+    if ( switched )
+    {
+        if ( lastReaction < 0 ) lastReaction = 4*g + ( s[3*g] == 1. ? 0 : 1 ) ;
+        lastSwitchedGene = g ;
+        s[3*g] = 1.-s[3*g] ;
+        s[3*g+1] = 1.-s[3*g+1] ;
+    }
+    computeGeneRates (s,g) ;
+    if ( switched ) scheduleSwitch (g) ;
+    scheduleMrna (s,g) ;
+    nextTimes[g] = MIN (switchTimes[g],mrnaTimes[g]) ;
+}
+
+// leap mode : the leaps in progress are ended at targetTime, with the mrna levels drawn at targetTime
+void
+MrnaSimulator::endLeaps ( VecDoub &s , Doub targetTime )
+{
+    Int g,k;
+    t = targetTime ;
+    for (g=0;g<NumGenes;g++)
+    {
+        if ( leapStarts[g] < 0. ) continue ;
+        if ( mrnaTimes[g] == leapEnds[g] ) s[3*g+2] -= leapChanges[g] ; // back to the level at the leap start
+        s[3*g+2] += drawLeapChange ( s , g , t-leapStarts[g] ) ;
+        computeGeneRates (s,g) ;
+        scheduleMrna (s,g) ;
+        nextTimes[g] = MIN (switchTimes[g],mrnaTimes[g]) ;
+    }
+    for (k=NumGenes/2-1;k>=0;k--) siftDown (k) ;
+}
+
+// with the gene state fixed, the mrna level after a leap has an exact law : surviving mrnas
+// ~ Binomial(mrna,exp(-rm*duration)) plus new ones ~ Poisson(ksm*on*(1-exp(-rm*duration))/rm)
+Doub
+MrnaSimulator::drawLeapChange ( VecDoub &s , Int g , Doub duration )
+{
+    Doub rm = mf_ModelParameters->mf_rms[g] , survival = exp(-rm*duration) , change ;
+    change = binomialDev ( s[3*g+2] , survival ) - s[3*g+2] ;
+    if ( a[g][2] > 0. ) change += poissonDev ( rm > 0. ? a[g][2]*(1.-survival)/rm : a[g][2]*duration ) ;
+    return change ;
+}
+
+// the switch rate of a gene does not depend on its mrna, so its next switch time stays valid between switches
+void
+MrnaSimulator::scheduleSwitch ( Int g )
+{
+    Doub rate = a[g][0] + a[g][1] ;
+    if (rate == 0.) switchTimes[g] = numeric_limits<Doub>::max () ;
+    else switchTimes[g] = t - log(ran.doub())/rate ;
+}
+
+// the leap length bounds the mean and the standard deviation of the mrna change by LeapEpsilon times the mean
+// mrna level of the gene : it does not depend on the mrna level, so that the leap lengths do not bias the time
+// averages of the mrna levels seen by the ode
+void
+MrnaSimulator::scheduleMrna ( VecDoub &s , Int g )
+{
+    Doub on = ( a[g][2] > 0. ) ? 1. : 0. ;
+    Doub birth = mf_ModelParameters->mf_ksms[g]*on , death = mf_ModelParameters->mf_rms[g]*mrnaScales[g] ;
+    Doub bound = LeapEpsilon*mrnaScales[g] , tau = bound*bound/(birth+death) ;
+    leapStarts[g] = -1. ;
+    if (a[g][2]+a[g][3] == 0.) { mrnaTimes[g] = numeric_limits<Doub>::max () ; return ; }
+    if (birth != death) tau = MIN ( tau , bound/fabs(birth-death) ) ;
+    tau = MIN ( tau*(1.-0.5*ran.doub()) , switchTimes[g]-t ) ; // random, so that similar genes do not leap together
+    if ( (birth+death)*tau >= LeapMinEvents )
+    {
+        leapStarts[g] = t ;
+        leapEnds[g] = ( tau == switchTimes[g]-t ) ? switchTimes[g] : t+tau ;
+        leapChanges[g] = drawLeapChange ( s , g , leapEnds[g]-t ) ;
+        mrnaTimes[g] = t+0.5*(leapEnds[g]-t) ;
+        NumLeaps++ ;
+    }
+    else mrnaTimes[g] = t - log(ran.doub())/(a[g][2]+a[g][3]) ;
+}
+
+void
+MrnaSimulator::siftDown ( Int k )
+{
+    Int child ;
+    while ( (child = 2*k+1) < NumGenes )
+    {
+        if ( child+1 < NumGenes && nextTimes[heap[child+1]] < nextTimes[heap[child]] ) child++ ;
+        if ( nextTimes[heap[k]] <= nextTimes[heap[child]] ) return ;
+        SWAP (heap[k],heap[child]) ;
+        k = child ;
+    }
+}
+
+
+// random deviates for the steady-state sampler
+Doub
+MrnaSimulator::normalDev ()
+{
+    // Box-Muller, 1-doub() lies in (0,1]
+    return sqrt(-2.*log(1.-ran.doub()))*cos(2.*3.141592653589793238*ran.doub()) ;
+}
+
+Doub
+MrnaSimulator::gammaDev ( Doub shape )
+{
+    // Marsaglia and Tsang, with the usual boost for shape < 1
+    if (shape < 1.) return gammaDev (shape+1.)*pow(1.-ran.doub(),1./shape) ;
+    Doub d = shape-1./3. , c = 1./sqrt(9.*d) , x , v , u ;
+    while (true)
+    {
+        do { x = normalDev () ; v = 1.+c*x ; } while (v <= 0.) ;
+        v = v*v*v ;
+        u = 1.-ran.doub() ;
+        if ( log(u) < 0.5*x*x+d-d*v+d*log(v) ) return d*v ;
+    }
+}
+
+Doub
+MrnaSimulator::betaDev ( Doub a , Doub b )
+{
+    Doub x = gammaDev (a) ;
+    return x/(x+gammaDev(b)) ;
+}
+
+Doub
+MrnaSimulator::binomialDev ( Doub n , Doub p )
+{
+    // splitting on the order statistics of the uniforms (Devroye, 1986) down to a few trials
+    Doub k = 0. , x , r ;
+    while ( n > 16. )
+    {
+        r = floor(n/2.)+1. ;
+        x = betaDev ( r , n+1.-r ) ;
+        if ( x >= p ) { n = r-1. ; p = p/x ; }
+        else { k += r ; n -= r ; p = (p-x)/(1.-x) ; }
+    }
+    for (Int i=0;i<n;i++) if ( ran.doub() < p ) k += 1. ;
+    return k ;
+}
+
+Doub
+MrnaSimulator::poissonDev ( Doub mean )
+{
+    Int k ;
+    if (mean < 10.)
+    {
+        // multiplication of uniforms
+        Doub L = exp(-mean) , prod = 1.-ran.doub() ;
+        for (k=0;prod>L;k++) prod *= 1.-ran.doub() ;
+        return k ;
+    }
+    // transformed rejection with squeeze (Hormann, 1993)
+    Doub slam = sqrt(mean) , loglam = log(mean) ;
+    Doub b = 0.931+2.53*slam , a = -0.059+0.02483*b ;
+    Doub invalpha = 1.1239+1.1328/(b-3.4) , vr = 0.9277-3.6224/(b-2.) ;
+    Doub U,V,us ;
+    while (true)
+    {
+        U = ran.doub()-0.5 ; V = ran.doub() ; us = 0.5-fabs(U) ;
+        k = Int ( floor ( (2.*a/us+b)*U+mean+0.43 ) ) ;
+        if ( us >= 0.07 && V <= vr ) return k ;
+        if ( k < 0 || ( us < 0.013 && V > us ) ) continue ;
+        if ( log(V)+log(invalpha)-log(a/(us*us)+b) <= -mean+k*loglam-lgamma(k+1.) ) return k ;
+    }
 }
@@ -6,39 +6,69 @@ __ March 2015
 */
 
 
+#ifndef MRNA_SIMULATOR
+#define MRNA_SIMULATOR
+
 #include "CellState.hpp"
 
 #include "libs/ran.h"
-#include "libs/sparse.h"
 
+// Genes never interact, so each gene (on/off switch + mrna birth-death) is advanced as an
+// independent exact jump process with its own next event time. doStep fires the earliest
+// one, found with an indexed binary min-heap over genes (next reaction method).
+// With LeapEpsilon > 0, the mrna reactions of a gene are grouped into leaps whose length bounds the mean and
+// the standard deviation of the mrna change by LeapEpsilon times the mean mrna level of the gene (tau selection
+// of Cao, Gillespie and Petzold), as long as a leap holds at least LeapMinEvents expected reactions; otherwise
+// they stay exact. Gene switches are always exact : they have their own next times, and leaps stop at them,
+// so the mrna level at the end of a leap is drawn from its exact law (binomial survival, poisson births).
+// The mrna change of a leap is drawn at its start and applied in its middle : this piecewise constant mrna
+// level is the approximation seen by the protein ode.
 struct MrnaSimulator
 {
 
         // main fields and methods
         ModelParameters* mf_ModelParameters ;
-        MrnaSimulator ( ModelParameters* modelParameters , Int seed = 1 ) ;
+        MrnaSimulator ( ModelParameters* modelParameters , Int seed = 1 , Doub leapEpsilon = 0. ) ;
         void prepareForSteps ( CellState* cellState ) ;
         Doub doStep ( CellState* cellState , Doub targetTime ) ;
         CellState* sampleFromOnlyNativeSteadyState ( Doub toReachSteadyStateDuration ) ;
+        CellState* sampleFromTelegraphSteadyState ( Doub relaxationDuration ) ;
+        void relaxNativeProteins ( CellState* cellState , Doub duration ) ;
 
         // other fields and methods
         Ran ran; // random generator
-        Int mm, nn;
-        VecDoub a;  // reaction rates
-        MatDoub instate, outstate; // reactants matrix, change state matrix
-        NRvector<NRsparseCol> outchg, depend; // change state sparse matrix, reaction dependancy sparse matrix
-        VecInt pr;  // priority list for reaction
+        Int NumGenes;
+        MatDoub a; // per gene reaction rates : gene off, gene on, transcription, mrna decay
+        VecDoub asum; // per gene sum of reaction rates
+        VecDoub nextTimes; // per gene time of next event
+        VecInt heap; // genes ordered as a min-heap on nextTimes
         Doub t; // time
-        Doub asum; // sum of all reactions rates
-        typedef Doub(MrnaSimulator::*rateptr)(VecDoub &s);
-        rateptr *dispatch;
-        void describereactions();
-        ~MrnaSimulator() {delete [] dispatch;}
-
-
-	// rate functions
-placeholder_rate_functions};
-
-
+        Int lastReaction; // reaction fired by the last doStep (4*gene+r), -1 if none
+        Doub lastMrnaChange; // change of the mrna level of gene lastReaction/4 by the last doStep
+        Int lastSwitchedGene; // gene switched by the last doStep (possibly with an mrna change in leap mode), -1 if none
+        Doub LeapEpsilon; // 0 for the exact simulation
+        Doub LeapMinEvents;
+        VecDoub switchTimes; // leap mode : per gene time of next switch
+        VecDoub mrnaTimes; // leap mode : per gene time of next mrna reaction, or middle or end of the current leap
+        VecDoub leapStarts; // leap mode : per gene start of the current leap, -1 if the next mrna reaction is exact
+        VecDoub leapEnds; // leap mode : per gene end of the current leap
+        VecDoub leapChanges; // leap mode : per gene mrna change of the current leap
+        VecDoub mrnaScales; // leap mode : per gene mean mrna level, at least one
+        long NumLeaps; // leaps taken since prepareForSteps
+        void computeGeneRates ( VecDoub &s , Int g ) ;
+        void scheduleGene ( Int g ) ;
+        void siftDown ( Int k ) ;
+        void doLeapStep ( VecDoub &s , Int g ) ;
+        void endLeaps ( VecDoub &s , Doub targetTime ) ;
+        Doub drawLeapChange ( VecDoub &s , Int g , Doub duration ) ;
+        void scheduleSwitch ( Int g ) ;
+        void scheduleMrna ( VecDoub &s , Int g ) ;
+        Doub normalDev () ;
+        Doub gammaDev ( Doub shape ) ;
+        Doub betaDev ( Doub a , Doub b ) ;
+        Doub binomialDev ( Doub n , Doub p ) ;
+        Doub poissonDev ( Doub mean ) ;
 
+};
 
+#endif
@@ -0,0 +1,609 @@
+/*
+__ FluctuProtST, Version 1.2
+__ Francois Bertaux, Inria Paris-Rocquencourt
+__ francois.bertaux@inria.fr
+__ March 2015
+*/
+
+
+// Python extension module of the model, written and compiled by FluctuProtST.buildPythonModule.
+// CellState.allProts and CellState.geneMrnas are NumPy views on the levels of the cell, and population runs read and
+// write the rows of the given arrays in place : no array is converted or copied. The GIL is released while simulating,
+// so that python threads can simulate cells concurrently, each with its own HybridSimulator (a simulator runs one
+// simulation at a time, and a cell must not be changed while it is simulated).
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
+#include <numpy/arrayobject.h>
+
+#include "../HybridSimulator.hpp"
+
+
+static const char* ParameterFile = "placeholder_parameter_file" ; // empty when the parameters are baked
+static const char* SpeciesNames[] = { placeholder_species_names NULL } ;
+static const char* EventNames[] = { placeholder_event_names NULL } ;
+static const Int NumGenes = placeholder_num_genes ;
+static ModelParameters* SharedModelParameters = NULL ;
+static vector<ModelParameters*> RetiredModelParameters ; // replaced by loadParameterFile, still used by older cells and simulators
+static PyTypeObject* CellStateType = NULL ;
+static PyTypeObject* SimulatorType = NULL ;
+
+
+// reads a parameter file into modelParameters, which are left unchanged (and a Python exception set) on a bad file
+static bool
+readParameterFile ( ModelParameters* modelParameters , const char* path )
+{
+    if ( ! ifstream (path) ) { PyErr_Format ( PyExc_IOError , "cannot open parameter file %s" , path ) ; return false ; }
+    string error = modelParameters->readParameterFile (path) ;
+    if ( error != "" ) { PyErr_SetString ( PyExc_ValueError , error.c_str() ) ; return false ; }
+    return true ;
+}
+
+
+// created at the first use, and shared (read only) by all the cells and simulators of the module
+static ModelParameters*
+giveModelParameters ()
+{
+    if ( SharedModelParameters != NULL ) return SharedModelParameters ;
+    ModelParameters* modelParameters = new ModelParameters ("") ;
+    if ( ParameterFile[0] != 0 && ! readParameterFile ( modelParameters , ParameterFile ) ) { delete modelParameters ; return NULL ; }
+    SharedModelParameters = modelParameters ;
+    return SharedModelParameters ;
+}
+
+
+// a 1d array on the memory of values, keeping owner alive (the vectors of a cell are never resized)
+static PyObject*
+giveArrayView ( VecDoub &values , PyObject* owner )
+{
+    npy_intp size = values.size () ;
+    PyObject* array = PyArray_SimpleNewFromData ( 1 , &size , NPY_DOUBLE , size > 0 ? &values[0] : NULL ) ;
+    if ( array == NULL ) return NULL ;
+    Py_INCREF (owner) ;
+    if ( PyArray_SetBaseObject ( (PyArrayObject*) array , owner ) < 0 ) { Py_DECREF (array) ; return NULL ; }
+    return array ;
+}
+
+
+// arrays written in place must be float64, C-contiguous and writable, of the given shape (-1 for any size)
+static PyArrayObject*
+giveInPlaceArray ( PyObject* object , const char* name , Int numDims , const npy_intp* shape )
+{
+    if ( ! PyArray_Check (object) || PyArray_TYPE ( (PyArrayObject*) object ) != NPY_DOUBLE
+            || ! PyArray_IS_C_CONTIGUOUS ( (PyArrayObject*) object ) || ! PyArray_ISWRITEABLE ( (PyArrayObject*) object ) )
+        { PyErr_Format ( PyExc_TypeError , "%s must be a writable C-contiguous float64 array" , name ) ; return NULL ; }
+    PyArrayObject* array = (PyArrayObject*) object ;
+    bool goodShape = ( PyArray_NDIM (array) == numDims ) ;
+    for (Int k=0;k<numDims && goodShape;k++) goodShape = ( shape[k] < 0 || PyArray_DIM (array,k) == shape[k] ) ;
+    if ( ! goodShape ) { PyErr_Format ( PyExc_ValueError , "%s has not the expected shape" , name ) ; return NULL ; }
+    return array ;
+}
+
+
+// observation schedule : sorted times in [0,duration] and indexes of species (small inputs, converted)
+static bool
+readSchedule ( PyObject* timesObject , PyObject* indexesObject , Doub duration , VecDoub &times , VecInt &indexes )
+{
+    PyArrayObject* timesArray = (PyArrayObject*) PyArray_FROMANY ( timesObject , NPY_DOUBLE , 1 , 1 , NPY_ARRAY_IN_ARRAY ) ;
+    PyArrayObject* indexesArray = (PyArrayObject*) PyArray_FROMANY ( indexesObject , NPY_INTP , 1 , 1 , NPY_ARRAY_IN_ARRAY | NPY_ARRAY_FORCECAST ) ;
+    bool ok = ( timesArray != NULL && indexesArray != NULL ) ;
+    if ( ok )
+    {
+        Doub* t = (Doub*) PyArray_DATA (timesArray) ;
+        npy_intp* s = (npy_intp*) PyArray_DATA (indexesArray) ;
+        times.resize ( PyArray_DIM (timesArray,0) ) ;
+        indexes.resize ( PyArray_DIM (indexesArray,0) ) ;
+        for (Int k=0;k<times.size();k++)
+        {
+            times[k] = t[k] ;
+            if ( t[k] < 0. || t[k] > duration || ( k > 0 && t[k] < t[k-1] ) ) ok = false ;
+        }
+        if ( ! ok ) PyErr_SetString ( PyExc_ValueError , "observation times must be sorted and within the simulated duration" ) ;
+        for (Int j=0;j<indexes.size() && ok;j++)
+        {
+            indexes[j] = s[j] ;
+            if ( s[j] < 0 || s[j] >= giveModelParameters()->mf_NumAllProteinSpecies ) { PyErr_SetString ( PyExc_IndexError , "species index out of range" ) ; ok = false ; }
+        }
+    }
+    Py_XDECREF (timesArray) ;
+    Py_XDECREF (indexesArray) ;
+    return ok ;
+}
+
+
+static PyObject*
+giveProfileDict ( const SimulationProfile &profile )
+{
+    vector<string> names ;
+    vector<Doub> values ;
+    profile.giveFields ( names , values ) ;
+    PyObject* dict = PyDict_New () ;
+    for (Int k=0;k<names.size() && dict!=NULL;k++)
+    {
+        PyObject* value = PyFloat_FromDouble ( values[k] ) ;
+        if ( value == NULL || PyDict_SetItemString ( dict , names[k].c_str() , value ) < 0 ) { Py_XDECREF (value) ; Py_DECREF (dict) ; return NULL ; }
+        Py_DECREF (value) ;
+    }
+    return dict ;
+}
+
+
+////////////////////////////////////////////////////////
+// CellState
+////////////////////////////////////////////////////////
+
+typedef struct
+{
+    PyObject_HEAD
+    CellState* cell ;
+} CellStateObject ;
+
+
+static PyObject*
+wrapCellState ( CellState* cell )
+{
+    CellStateObject* self = (CellStateObject*) CellStateType->tp_alloc ( CellStateType , 0 ) ;
+    if ( self == NULL ) { delete cell ; return NULL ; }
+    self->cell = cell ;
+    return (PyObject*) self ;
+}
+
+
+// CellState () : genes on, mrnas and native proteins at their mean levels, modified proteins at 0
+static PyObject*
+CellState_new ( PyTypeObject* type , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { NULL } ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "" , (char**) keywords ) ) return NULL ;
+    ModelParameters* modelParameters = giveModelParameters () ;
+    if ( modelParameters == NULL ) return NULL ;
+    return wrapCellState ( new CellState (modelParameters) ) ;
+}
+
+
+static void
+CellState_dealloc ( CellStateObject* self )
+{
+    delete self->cell ;
+    PyTypeObject* type = Py_TYPE (self) ;
+    type->tp_free ( (PyObject*) self ) ;
+    Py_DECREF (type) ;
+}
+
+
+static PyObject* CellState_getAllProts ( CellStateObject* self , void* ) { return giveArrayView ( self->cell->mf_AllProts , (PyObject*) self ) ; }
+static PyObject* CellState_getGeneMrnas ( CellStateObject* self , void* ) { return giveArrayView ( self->cell->mf_GeneMrnas , (PyObject*) self ) ; }
+static PyObject* CellState_copy ( CellStateObject* self , PyObject* ) { return wrapCellState ( new CellState (*self->cell) ) ; }
+
+
+// name access to species, as the methods of CellState.hpp
+static bool
+readLevel ( PyObject* arg , Doub &value )
+{
+    value = PyFloat_AsDouble (arg) ;
+    return ! ( value == -1. && PyErr_Occurred () ) ;
+}
+
+placeholder_cell_functions
+
+static PyMethodDef CellState_methods[] =
+{
+    { "copy" , (PyCFunction) CellState_copy , METH_NOARGS , "an independent copy of the cell" } ,
+placeholder_cell_methods    { NULL , NULL , 0 , NULL }
+} ;
+
+static PyGetSetDef CellState_getset[] =
+{
+    { "allProts" , (getter) CellState_getAllProts , NULL , "levels of all proteins, natives then modified (view)" , NULL } ,
+    { "geneMrnas" , (getter) CellState_getGeneMrnas , NULL , "gene on, gene off and mrna level of each gene (view)" , NULL } ,
+    { NULL , NULL , NULL , NULL , NULL }
+} ;
+
+static PyType_Slot CellState_slots[] =
+{
+    { Py_tp_new , (void*) CellState_new } ,
+    { Py_tp_dealloc , (void*) CellState_dealloc } ,
+    { Py_tp_methods , (void*) CellState_methods } ,
+    { Py_tp_getset , (void*) CellState_getset } ,
+    { Py_tp_doc , (void*) "state of one cell : genes, mrnas and protein levels" } ,
+    { 0 , NULL }
+} ;
+
+static PyType_Spec CellState_spec = { "placeholder_module_name.CellState" , sizeof(CellStateObject) , 0 , Py_TPFLAGS_DEFAULT , CellState_slots } ;
+
+
+////////////////////////////////////////////////////////
+// HybridSimulator
+////////////////////////////////////////////////////////
+
+typedef struct
+{
+    PyObject_HEAD
+    HybridSimulator* simulator ;
+    bool busy ;
+} SimulatorObject ;
+
+
+// HybridSimulator ( randomSeed=1 , breakAtMrnaEvents=False , useStiffSolver=False , leapEpsilon=0. )
+static int
+Simulator_init ( SimulatorObject* self , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { "randomSeed" , "breakAtMrnaEvents" , "useStiffSolver" , "leapEpsilon" , NULL } ;
+    int randomSeed = 1 , breakAtMrnaEvents = 0 , useStiffSolver = 0 ;
+    Doub leapEpsilon = 0. ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "|ippd" , (char**) keywords , &randomSeed , &breakAtMrnaEvents , &useStiffSolver , &leapEpsilon ) ) return -1 ;
+    if ( leapEpsilon < 0. ) { PyErr_SetString ( PyExc_ValueError , "leapEpsilon must be non negative" ) ; return -1 ; }
+    // re-initializing deletes the simulator : not while another thread simulates with it (GIL released)
+    if ( self->busy ) { PyErr_SetString ( PyExc_RuntimeError , "HybridSimulator already simulating in another thread" ) ; return -1 ; }
+    ModelParameters* modelParameters = giveModelParameters () ;
+    if ( modelParameters == NULL ) return -1 ;
+    delete self->simulator ;
+    self->simulator = new HybridSimulator ( modelParameters , randomSeed , breakAtMrnaEvents , useStiffSolver , leapEpsilon ) ;
+    self->busy = false ;
+    return 0 ;
+}
+
+
+static void
+Simulator_dealloc ( SimulatorObject* self )
+{
+    delete self->simulator ;
+    PyTypeObject* type = Py_TYPE (self) ;
+    type->tp_free ( (PyObject*) self ) ;
+    Py_DECREF (type) ;
+}
+
+
+// message of the exception being handled : the simulator throws runtime_error (and Numerical Recipes an int, after
+// printing its message) instead of ending the host process. Called from a catch block.
+static string
+giveSimulationError ()
+{
+    try { throw ; }
+    catch ( exception &e ) { return string ("simulation failed : ") + e.what () ; }
+    catch ( ... ) { return "simulation failed in the Numerical Recipes code (see its message on stdout)" ; }
+}
+
+
+// a simulator runs one simulation at a time : the GIL is released during it
+static bool
+acquireSimulator ( SimulatorObject* self )
+{
+    if ( self->simulator == NULL ) { PyErr_SetString ( PyExc_RuntimeError , "HybridSimulator not initialized" ) ; return false ; }
+    if ( self->busy ) { PyErr_SetString ( PyExc_RuntimeError , "HybridSimulator already simulating in another thread" ) ; return false ; }
+    self->busy = true ;
+    return true ;
+}
+
+
+// simulate ( cell , duration , observationTimes=None , speciesIndexes=None ) : the cell is simulated in place ; with an
+// observation schedule, returns the levels of the species at the times, as an array [species][time]
+static PyObject*
+Simulator_simulate ( SimulatorObject* self , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { "cell" , "duration" , "observationTimes" , "speciesIndexes" , NULL } ;
+    PyObject *cellObject , *timesObject = Py_None , *indexesObject = Py_None ;
+    Doub duration ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "O!d|OO" , (char**) keywords , CellStateType , &cellObject , &duration , &timesObject , &indexesObject ) ) return NULL ;
+    bool observing = ( timesObject != Py_None || indexesObject != Py_None ) ;
+    VecDoub times ;
+    VecInt indexes ;
+    if ( observing && ! readSchedule ( timesObject , indexesObject , duration , times , indexes ) ) return NULL ;
+    if ( ! acquireSimulator (self) ) return NULL ;
+    CellState* cell = ( (CellStateObject*) cellObject )->cell ;
+    MatDoub observations ( indexes.size() , times.size() ) ;
+    string error ;
+    Py_BEGIN_ALLOW_THREADS
+    try
+    {
+        if ( observing ) self->simulator->simulate ( cell , duration , times , indexes , observations ) ;
+        else self->simulator->simulate ( cell , duration ) ;
+    }
+    catch ( ... ) { error = giveSimulationError () ; }
+    Py_END_ALLOW_THREADS
+    self->busy = false ;
+    if ( error != "" ) { PyErr_SetString ( PyExc_RuntimeError , error.c_str() ) ; return NULL ; }
+    if ( ! observing ) Py_RETURN_NONE ;
+    npy_intp shape[2] = { indexes.size() , times.size() } ;
+    PyObject* result = PyArray_SimpleNew ( 2 , shape , NPY_DOUBLE ) ;
+    if ( result == NULL ) return NULL ;
+    Doub* data = (Doub*) PyArray_DATA ( (PyArrayObject*) result ) ;
+    for (Int j=0;j<shape[0];j++) for (Int k=0;k<shape[1];k++) data[j*shape[1]+k] = observations[j][k] ;
+    return result ;
+}
+
+
+// simulatePopulation ( allProts , geneMrnas , duration , observationTimes=None , speciesIndexes=None , observations=None ) :
+// the cells are the rows of allProts [cell][species] and geneMrnas [cell][3*gene], simulated one after the other and
+// written back in place ; with a schedule, the levels are written into observations [cell][species][time].
+// Returns the terminal event that stopped each cell (-1 if none) and the time it reached.
+// Rows are copied into a work cell and back, as the vectors of a CellState own their memory.
+static PyObject*
+Simulator_simulatePopulation ( SimulatorObject* self , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { "allProts" , "geneMrnas" , "duration" , "observationTimes" , "speciesIndexes" , "observations" , NULL } ;
+    PyObject *protsObject , *mrnasObject , *timesObject = Py_None , *indexesObject = Py_None , *observationsObject = Py_None ;
+    Doub duration ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "OOd|OOO" , (char**) keywords , &protsObject , &mrnasObject , &duration ,
+                                         &timesObject , &indexesObject , &observationsObject ) ) return NULL ;
+    if ( self->simulator == NULL ) { PyErr_SetString ( PyExc_RuntimeError , "HybridSimulator not initialized" ) ; return NULL ; }
+    ModelParameters* modelParameters = self->simulator->mf_ModelParameters ;
+    npy_intp protsShape[2] = { -1 , modelParameters->mf_NumAllProteinSpecies } ;
+    PyArrayObject* prots = giveInPlaceArray ( protsObject , "allProts" , 2 , protsShape ) ;
+    if ( prots == NULL ) return NULL ;
+    npy_intp numCells = PyArray_DIM (prots,0) ;
+    npy_intp mrnasShape[2] = { numCells , 3*modelParameters->mf_NumGenes } ;
+    PyArrayObject* mrnas = giveInPlaceArray ( mrnasObject , "geneMrnas" , 2 , mrnasShape ) ;
+    if ( mrnas == NULL ) return NULL ;
+    bool observing = ( timesObject != Py_None || indexesObject != Py_None ) ;
+    VecDoub times ;
+    VecInt indexes ;
+    PyArrayObject* observations = NULL ;
+    if ( observing )
+    {
+        if ( ! readSchedule ( timesObject , indexesObject , duration , times , indexes ) ) return NULL ;
+        npy_intp observationsShape[3] = { numCells , indexes.size() , times.size() } ;
+        if ( observationsObject == Py_None ) { PyErr_SetString ( PyExc_ValueError , "an observation schedule needs an observations array" ) ; return NULL ; }
+        observations = giveInPlaceArray ( observationsObject , "observations" , 3 , observationsShape ) ;
+        if ( observations == NULL ) return NULL ;
+    }
+    npy_intp cellsShape[1] = { numCells } ;
+    PyObject* stoppingEvents = PyArray_SimpleNew ( 1 , cellsShape , NPY_INTP ) ;
+    PyObject* stopTimes = PyArray_SimpleNew ( 1 , cellsShape , NPY_DOUBLE ) ;
+    if ( stoppingEvents == NULL || stopTimes == NULL ) { Py_XDECREF (stoppingEvents) ; Py_XDECREF (stopTimes) ; return NULL ; }
+    if ( ! acquireSimulator (self) ) { Py_DECREF (stoppingEvents) ; Py_DECREF (stopTimes) ; return NULL ; }
+    Int S = modelParameters->mf_NumAllProteinSpecies , G3 = 3*modelParameters->mf_NumGenes , numSpecies = indexes.size () , numTimes = times.size () ;
+    Doub *protsData = (Doub*) PyArray_DATA (prots) , *mrnasData = (Doub*) PyArray_DATA (mrnas) ;
+    Doub *observationsData = observing ? (Doub*) PyArray_DATA (observations) : NULL ;
+    npy_intp* eventsData = (npy_intp*) PyArray_DATA ( (PyArrayObject*) stoppingEvents ) ;
+    Doub* timesData = (Doub*) PyArray_DATA ( (PyArrayObject*) stopTimes ) ;
+    string error ;
+    npy_intp failedCell = 0 ;
+    Py_BEGIN_ALLOW_THREADS
+    CellState cell (modelParameters) ;
+    MatDoub cellObservations ( numSpecies , numTimes ) ;
+    for (npy_intp i=0;i<numCells;i++)
+    {
+        for (Int k=0;k<S;k++) cell.mf_AllProts[k] = protsData[i*S+k] ;
+        for (Int k=0;k<G3;k++) cell.mf_GeneMrnas[k] = mrnasData[i*G3+k] ;
+        try
+        {
+            if ( observing ) self->simulator->simulate ( &cell , duration , times , indexes , cellObservations ) ;
+            else self->simulator->simulate ( &cell , duration ) ;
+        }
+        catch ( ... ) { error = giveSimulationError () ; failedCell = i ; break ; }
+        if ( observing )
+            for (Int j=0;j<numSpecies;j++) for (Int k=0;k<numTimes;k++) observationsData[(i*numSpecies+j)*numTimes+k] = cellObservations[j][k] ;
+        for (Int k=0;k<S;k++) protsData[i*S+k] = cell.mf_AllProts[k] ;
+        for (Int k=0;k<G3;k++) mrnasData[i*G3+k] = cell.mf_GeneMrnas[k] ;
+        eventsData[i] = self->simulator->StoppingEvent ;
+        timesData[i] = self->simulator->StopTime ;
+    }
+    Py_END_ALLOW_THREADS
+    self->busy = false ;
+    if ( error != "" )
+    {
+        // the cells before failedCell are simulated, the others left unchanged
+        Py_DECREF (stoppingEvents) ; Py_DECREF (stopTimes) ;
+        PyErr_Format ( PyExc_RuntimeError , "cell %zd : %s" , (Py_ssize_t) failedCell , error.c_str() ) ;
+        return NULL ;
+    }
+    return Py_BuildValue ( "(NN)" , stoppingEvents , stopTimes ) ;
+}
+
+
+// sampleFromTelegraphSteadyState ( relaxationDuration=24. ) : a new cell, see MrnaSimulator
+static PyObject*
+Simulator_sampleFromTelegraphSteadyState ( SimulatorObject* self , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { "relaxationDuration" , NULL } ;
+    Doub relaxationDuration = 24. ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "|d" , (char**) keywords , &relaxationDuration ) ) return NULL ;
+    if ( ! acquireSimulator (self) ) return NULL ;
+    CellState* cell ;
+    Py_BEGIN_ALLOW_THREADS
+    cell = self->simulator->mf_MrnaSimulator->sampleFromTelegraphSteadyState (relaxationDuration) ;
+    Py_END_ALLOW_THREADS
+    self->busy = false ;
+    return wrapCellState (cell) ;
+}
+
+
+// samplePopulation ( numCells , relaxationDuration=24. ) : new arrays allProts [cell][species] and geneMrnas [cell][3*gene]
+// of cells drawn from the telegraph steady-state
+static PyObject*
+Simulator_samplePopulation ( SimulatorObject* self , PyObject* args , PyObject* kwargs )
+{
+    static const char* keywords[] = { "numCells" , "relaxationDuration" , NULL } ;
+    Py_ssize_t numCells ;
+    Doub relaxationDuration = 24. ;
+    if ( ! PyArg_ParseTupleAndKeywords ( args , kwargs , "n|d" , (char**) keywords , &numCells , &relaxationDuration ) ) return NULL ;
+    if ( numCells < 0 ) { PyErr_SetString ( PyExc_ValueError , "numCells must be non negative" ) ; return NULL ; }
+    if ( ! acquireSimulator (self) ) return NULL ;
+    ModelParameters* modelParameters = self->simulator->mf_ModelParameters ;
+    Int S = modelParameters->mf_NumAllProteinSpecies , G3 = 3*modelParameters->mf_NumGenes ;
+    npy_intp protsShape[2] = { numCells , S } , mrnasShape[2] = { numCells , G3 } ;
+    PyObject* prots = PyArray_SimpleNew ( 2 , protsShape , NPY_DOUBLE ) ;
+    PyObject* mrnas = PyArray_SimpleNew ( 2 , mrnasShape , NPY_DOUBLE ) ;
+    if ( prots == NULL || mrnas == NULL ) { Py_XDECREF (prots) ; Py_XDECREF (mrnas) ; self->busy = false ; return NULL ; }
+    Doub *protsData = (Doub*) PyArray_DATA ( (PyArrayObject*) prots ) , *mrnasData = (Doub*) PyArray_DATA ( (PyArrayObject*) mrnas ) ;
+    Py_BEGIN_ALLOW_THREADS
+    for (npy_intp i=0;i<numCells;i++)
+    {
+        CellState* cell = self->simulator->mf_MrnaSimulator->sampleFromTelegraphSteadyState (relaxationDuration) ;
+        for (Int k=0;k<S;k++) protsData[i*S+k] = cell->mf_AllProts[k] ;
+        for (Int k=0;k<G3;k++) mrnasData[i*G3+k] = cell->mf_GeneMrnas[k] ;
+        delete cell ;
+    }
+    Py_END_ALLOW_THREADS
+    self->busy = false ;
+    return Py_BuildValue ( "(NN)" , prots , mrnas ) ;
+}
+
+
+static PyObject*
+Simulator_resetPopulationProfile ( SimulatorObject* self , PyObject* )
+{
+    if ( ! acquireSimulator (self) ) return NULL ;
+    self->simulator->PopulationProfile.reset () ;
+    self->busy = false ;
+    Py_RETURN_NONE ;
+}
+
+
+// statistics of the last simulate
+static PyObject*
+Simulator_getStatistics ( SimulatorObject* self , void* )
+{
+    if ( ! acquireSimulator (self) ) return NULL ;
+    HybridSimulator* s = self->simulator ;
+    PyObject* eventTimes = PyList_New ( s->EventTimes.size() ) ;
+    for (Int k=0;k<s->EventTimes.size() && eventTimes!=NULL;k++) PyList_SET_ITEM ( eventTimes , k , PyFloat_FromDouble ( s->EventTimes[k] ) ) ;
+    self->busy = false ;
+    if ( eventTimes == NULL ) return NULL ;
+    return Py_BuildValue ( "{s:l,s:l,s:l,s:l,s:l,s:l,s:i,s:d,s:N}" , "numOkSteps" , long(s->NumOkSteps) , "numBadSteps" , long(s->NumBadSteps) ,
+                           "numRhsEvals" , s->NumRhsEvals , "numJacobianEvals" , s->NumJacobianEvals , "numMrnaEvents" , long(s->EventObtained) ,
+                           "numMrnaLeaps" , s->mf_MrnaSimulator->NumLeaps , "stoppingEvent" , int(s->StoppingEvent) , "stopTime" , s->StopTime ,
+                           "eventTimes" , eventTimes ) ;
+}
+
+
+static PyObject*
+Simulator_getProfile ( SimulatorObject* self , void* )
+{
+    if ( ! acquireSimulator (self) ) return NULL ;
+    PyObject* profile = giveProfileDict ( self->simulator->Profile ) ;
+    self->busy = false ;
+    return profile ;
+}
+
+
+static PyObject*
+Simulator_getPopulationProfile ( SimulatorObject* self , void* )
+{
+    if ( ! acquireSimulator (self) ) return NULL ;
+    PyObject* profile = giveProfileDict ( self->simulator->PopulationProfile ) ;
+    self->busy = false ;
+    return profile ;
+}
+
+
+static PyObject*
+Simulator_getCheckEvents ( SimulatorObject* self , void* )
+{
+    if ( self->simulator == NULL ) { PyErr_SetString ( PyExc_RuntimeError , "HybridSimulator not initialized" ) ; return NULL ; }
+    return PyBool_FromLong ( self->simulator->CheckEvents ) ;
+}
+
+
+static int
+Simulator_setCheckEvents ( SimulatorObject* self , PyObject* value , void* )
+{
+    if ( value == NULL ) { PyErr_SetString ( PyExc_AttributeError , "cannot delete checkEvents" ) ; return -1 ; }
+    int checkEvents = PyObject_IsTrue (value) ;
+    if ( checkEvents < 0 || ! acquireSimulator (self) ) return -1 ;
+    self->simulator->CheckEvents = checkEvents ;
+    self->busy = false ;
+    return 0 ;
+}
+
+
+static PyMethodDef Simulator_methods[] =
+{
+    { "simulate" , (PyCFunction) Simulator_simulate , METH_VARARGS | METH_KEYWORDS , "simulate ( cell , duration , observationTimes=None , speciesIndexes=None )" } ,
+    { "simulatePopulation" , (PyCFunction) Simulator_simulatePopulation , METH_VARARGS | METH_KEYWORDS ,
+        "simulatePopulation ( allProts , geneMrnas , duration , observationTimes=None , speciesIndexes=None , observations=None ) -> ( stoppingEvents , stopTimes )" } ,
+    { "sampleFromTelegraphSteadyState" , (PyCFunction) Simulator_sampleFromTelegraphSteadyState , METH_VARARGS | METH_KEYWORDS ,
+        "sampleFromTelegraphSteadyState ( relaxationDuration=24. ) -> CellState" } ,
+    { "samplePopulation" , (PyCFunction) Simulator_samplePopulation , METH_VARARGS | METH_KEYWORDS ,
+        "samplePopulation ( numCells , relaxationDuration=24. ) -> ( allProts , geneMrnas )" } ,
+    { "resetPopulationProfile" , (PyCFunction) Simulator_resetPopulationProfile , METH_NOARGS , "restart the sum of the profiles" } ,
+    { NULL , NULL , 0 , NULL }
+} ;
+
+static PyGetSetDef Simulator_getset[] =
+{
+    { "statistics" , (getter) Simulator_getStatistics , NULL , "step and event counts of the last simulate" , NULL } ,
+    { "profile" , (getter) Simulator_getProfile , NULL , "hot-path profile of the last simulate (zero without -DFPST_PROFILE)" , NULL } ,
+    { "populationProfile" , (getter) Simulator_getPopulationProfile , NULL , "sum of the profiles since the construction or resetPopulationProfile" , NULL } ,
+    { "checkEvents" , (getter) Simulator_getCheckEvents , (setter) Simulator_setCheckEvents , "whether the events of the model are located" , NULL } ,
+    { NULL , NULL , NULL , NULL , NULL }
+} ;
+
+static PyType_Slot Simulator_slots[] =
+{
+    { Py_tp_new , (void*) PyType_GenericNew } ,
+    { Py_tp_init , (void*) Simulator_init } ,
+    { Py_tp_dealloc , (void*) Simulator_dealloc } ,
+    { Py_tp_methods , (void*) Simulator_methods } ,
+    { Py_tp_getset , (void*) Simulator_getset } ,
+    { Py_tp_doc , (void*) "HybridSimulator ( randomSeed=1 , breakAtMrnaEvents=False , useStiffSolver=False , leapEpsilon=0. )" } ,
+    { 0 , NULL }
+} ;
+
+static PyType_Spec Simulator_spec = { "placeholder_module_name.HybridSimulator" , sizeof(SimulatorObject) , 0 , Py_TPFLAGS_DEFAULT , Simulator_slots } ;
+
+
+////////////////////////////////////////////////////////
+// module
+////////////////////////////////////////////////////////
+
+// loadParameterFile ( path ) : parameter values written by writeParameterFile, for the cells and simulators created after.
+// They are read into new parameters : the older cells and simulators keep theirs, which are never modified while
+// they may be simulating in other threads.
+static PyObject*
+module_loadParameterFile ( PyObject* , PyObject* args )
+{
+    const char* path ;
+    if ( ! PyArg_ParseTuple ( args , "s" , &path ) ) return NULL ;
+    ModelParameters* modelParameters = giveModelParameters () ;
+    if ( modelParameters == NULL ) return NULL ;
+    ModelParameters* loaded = new ModelParameters (*modelParameters) ;
+    if ( ! readParameterFile ( loaded , path ) ) { delete loaded ; return NULL ; }
+    RetiredModelParameters.push_back (modelParameters) ;
+    SharedModelParameters = loaded ;
+    Py_RETURN_NONE ;
+}
+
+
+static PyObject*
+giveNameTuple ( const char** names )
+{
+    Int n = 0 ;
+    while ( names[n] != NULL ) n++ ;
+    PyObject* tuple = PyTuple_New (n) ;
+    for (Int k=0;k<n && tuple!=NULL;k++) PyTuple_SET_ITEM ( tuple , k , PyUnicode_FromString ( names[k] ) ) ;
+    return tuple ;
+}
+
+
+static PyMethodDef module_methods[] =
+{
+    { "loadParameterFile" , (PyCFunction) module_loadParameterFile , METH_VARARGS , "loadParameterFile ( path )" } ,
+    { NULL , NULL , 0 , NULL }
+} ;
+
+static struct PyModuleDef module_definition = { PyModuleDef_HEAD_INIT , "placeholder_module_name" , "compiled FluctuProtST simulator of the model" , -1 , module_methods } ;
+
+
+PyMODINIT_FUNC
+PyInit_placeholder_module_name ()
+{
+    import_array () ;
+    PyObject* module = PyModule_Create (&module_definition) ;
+    if ( module == NULL ) return NULL ;
+    CellStateType = (PyTypeObject*) PyType_FromSpec (&CellState_spec) ;
+    SimulatorType = (PyTypeObject*) PyType_FromSpec (&Simulator_spec) ;
+    if ( CellStateType == NULL || SimulatorType == NULL ) { Py_DECREF (module) ; return NULL ; }
+    Py_INCREF (CellStateType) ;
+    Py_INCREF (SimulatorType) ;
+    if ( PyModule_AddObject ( module , "CellState" , (PyObject*) CellStateType ) < 0
+            || PyModule_AddObject ( module , "HybridSimulator" , (PyObject*) SimulatorType ) < 0
+            || PyModule_AddObject ( module , "speciesNames" , giveNameTuple (SpeciesNames) ) < 0
+            || PyModule_AddObject ( module , "eventNames" , giveNameTuple (EventNames) ) < 0
+            || PyModule_AddIntConstant ( module , "numGenes" , NumGenes ) < 0
+            || PyModule_AddIntConstant ( module , "profilingEnabled" , FPST_PROFILE_ENABLED ) < 0 )
+        { Py_DECREF (module) ; return NULL ; }
+    return module ;
+}
@@ -0,0 +1,94 @@
+/*
+__ FluctuProtST, Version 1.2
+__ Francois Bertaux, Inria Paris-Rocquencourt
+__ francois.bertaux@inria.fr
+__ March 2015
+*/
+
+
+#include "SimulationProfile.hpp"
+
+
+SimulationProfile::SimulationProfile ()
+{
+    reset () ;
+}
+
+
+void
+SimulationProfile::reset ()
+{
+    NumSimulates = 0 ;
+    NumMrnaSteps = 0 ; NumMrnaChanges = 0 ; MrnaSeconds = 0. ;
+    NumChunks = 0 ; NumFullChunks = 0 ; MaxChunkEvents = 0 ; ChunkCapacity = 0 ;
+    NumTindexSearches = 0 ; TindexForwardWalk = 0 ; TindexBackwardWalk = 0 ; MaxTindexWalk = 0 ;
+    NumRhsBodies = 0 ; RhsSeconds = 0. ; NumJacobianBodies = 0 ; JacobianSeconds = 0. ;
+    NumOdeSegments = 0 ; NumOkSteps = 0 ; NumBadSteps = 0 ; NumRejectedTrials = 0 ; OdeSeconds = 0. ;
+    TotalSeconds = 0. ;
+}
+
+
+void
+SimulationProfile::add ( const SimulationProfile &other )
+{
+    NumSimulates += other.NumSimulates ;
+    NumMrnaSteps += other.NumMrnaSteps ; NumMrnaChanges += other.NumMrnaChanges ; MrnaSeconds += other.MrnaSeconds ;
+    NumChunks += other.NumChunks ; NumFullChunks += other.NumFullChunks ;
+    MaxChunkEvents = MAX ( MaxChunkEvents , other.MaxChunkEvents ) ; ChunkCapacity = MAX ( ChunkCapacity , other.ChunkCapacity ) ;
+    NumTindexSearches += other.NumTindexSearches ; TindexForwardWalk += other.TindexForwardWalk ;
+    TindexBackwardWalk += other.TindexBackwardWalk ; MaxTindexWalk = MAX ( MaxTindexWalk , other.MaxTindexWalk ) ;
+    NumRhsBodies += other.NumRhsBodies ; RhsSeconds += other.RhsSeconds ;
+    NumJacobianBodies += other.NumJacobianBodies ; JacobianSeconds += other.JacobianSeconds ;
+    NumOdeSegments += other.NumOdeSegments ; NumOkSteps += other.NumOkSteps ; NumBadSteps += other.NumBadSteps ;
+    NumRejectedTrials += other.NumRejectedTrials ; OdeSeconds += other.OdeSeconds ;
+    TotalSeconds += other.TotalSeconds ;
+}
+
+
+void
+SimulationProfile::giveFields ( vector<string> &names , vector<Doub> &values ) const
+{
+    const char* fieldNames[] = { "NumSimulates" , "NumMrnaSteps" , "NumMrnaChanges" , "MrnaSeconds" , "NumChunks" , "NumFullChunks" ,
+                                 "MaxChunkEvents" , "ChunkCapacity" , "NumTindexSearches" , "TindexForwardWalk" , "TindexBackwardWalk" ,
+                                 "MaxTindexWalk" , "NumRhsBodies" , "RhsSeconds" , "NumJacobianBodies" , "JacobianSeconds" ,
+                                 "NumOdeSegments" , "NumOkSteps" , "NumBadSteps" , "NumRejectedTrials" , "OdeSeconds" , "TotalSeconds" } ;
+    Doub fieldValues[] = { Doub(NumSimulates) , Doub(NumMrnaSteps) , Doub(NumMrnaChanges) , MrnaSeconds , Doub(NumChunks) , Doub(NumFullChunks) ,
+                           Doub(MaxChunkEvents) , Doub(ChunkCapacity) , Doub(NumTindexSearches) , Doub(TindexForwardWalk) , Doub(TindexBackwardWalk) ,
+                           Doub(MaxTindexWalk) , Doub(NumRhsBodies) , RhsSeconds , Doub(NumJacobianBodies) , JacobianSeconds ,
+                           Doub(NumOdeSegments) , Doub(NumOkSteps) , Doub(NumBadSteps) , Doub(NumRejectedTrials) , OdeSeconds , TotalSeconds } ;
+    Int numFields = sizeof(fieldValues) / sizeof(Doub) ;
+    names.assign ( fieldNames , fieldNames + numFields ) ;
+    values.assign ( fieldValues , fieldValues + numFields ) ;
+}
+
+
+void
+SimulationProfile::print ( ostream &out , string prefix ) const
+{
+    vector<string> names ;
+    vector<Doub> values ;
+    giveFields ( names , values ) ;
+    for (Int k=0;k<names.size();k++) out << prefix << names[k] << " " << setprecision(10) << values[k] << endl ;
+}
+
+
+void
+SimulationProfile::printTableHeader ( ostream &out ) const
+{
+    vector<string> names ;
+    vector<Doub> values ;
+    giveFields ( names , values ) ;
+    for (Int k=0;k<names.size();k++) out << ( k > 0 ? "\t" : "" ) << names[k] ;
+    out << endl ;
+}
+
+
+void
+SimulationProfile::printTableRow ( ostream &out ) const
+{
+    vector<string> names ;
+    vector<Doub> values ;
+    giveFields ( names , values ) ;
+    for (Int k=0;k<values.size();k++) out << ( k > 0 ? "\t" : "" ) << setprecision(10) << values[k] ;
+    out << endl ;
+}
@@ -0,0 +1,82 @@
+/*
+__ FluctuProtST, Version 1.2
+__ Francois Bertaux, Inria Paris-Rocquencourt
+__ francois.bertaux@inria.fr
+__ March 2015
+*/
+
+
+#ifndef SIMULATION_PROFILE
+#define SIMULATION_PROFILE
+
+#include "libs/nr3.h"
+#include <chrono>
+#include <iomanip>
+
+// Hot-path counters and timers of the hybrid simulator. They are compiled in only with -DFPST_PROFILE : otherwise
+// the FPST_PROFILE_ macros expand to nothing, the simulator runs its uninstrumented code and all counts stay zero.
+// A timer costs two clock reads (a few tens of ns), so timers wrap whole calls (rhs and jacobian bodies, the
+// filling of a mrna chunk, an ode segment) ; the tindex lookup of the rhs is only counted.
+#ifdef FPST_PROFILE
+#define FPST_PROFILE_ENABLED true
+#define FPST_PROFILE_COUNT(counter,value) (counter) += (value) ;
+#define FPST_PROFILE_MAX(counter,value) if ( (value) > (counter) ) (counter) = (value) ;
+#define FPST_PROFILE_START(clock) Doub clock = giveProfileClock () ;
+#define FPST_PROFILE_STOP(clock,timer) (timer) += giveProfileClock () - (clock) ;
+#else
+#define FPST_PROFILE_ENABLED false
+#define FPST_PROFILE_COUNT(counter,value)
+#define FPST_PROFILE_MAX(counter,value)
+#define FPST_PROFILE_START(clock)
+#define FPST_PROFILE_STOP(clock,timer)
+#endif
+
+inline Doub giveProfileClock () { return chrono::duration<Doub> ( chrono::steady_clock::now ().time_since_epoch () ).count () ; }
+
+struct SimulationProfile
+{
+    SimulationProfile () ;
+    void reset () ;
+    void add ( const SimulationProfile &other ) ; // sums, except the maxima
+    void print ( ostream &out , string prefix = "" ) const ; // one "name value" line per field
+    void printTableHeader ( ostream &out ) const ; // one tab separated line of field names
+    void printTableRow ( ostream &out ) const ; // the fields in the order of printTableHeader
+    void giveFields ( vector<string> &names , vector<Doub> &values ) const ;
+
+    long NumSimulates ; // 1 for the profile of a cell, the number of cells for a population
+
+    // mrna layer : MrnaSimulator::doStep calls while filling the chunks, and the time spent filling them
+    long NumMrnaSteps ;
+    long NumMrnaChanges ; // stored chunk events
+    Doub MrnaSeconds ;
+
+    // chunks : their fill against ChunkMaxEvents (a full chunk means the ode has to stop and restart at its end)
+    long NumChunks ;
+    long NumFullChunks ;
+    long MaxChunkEvents ;
+    long ChunkCapacity ;
+
+    // HybridRhs::findGoodTindex : searches and the number of chunk events walked over
+    long NumTindexSearches ;
+    long TindexForwardWalk ;
+    long TindexBackwardWalk ;
+    long MaxTindexWalk ;
+
+    // generated HybridRhs bodies
+    long NumRhsBodies ;
+    Doub RhsSeconds ;
+    long NumJacobianBodies ;
+    Doub JacobianSeconds ;
+
+    // ode integration : accepted steps, steps shortened by the error control, and for StepperDopr5 the trial steps
+    // rejected (each trial evaluates the rhs 6 times)
+    long NumOdeSegments ;
+    long NumOkSteps ;
+    long NumBadSteps ;
+    long NumRejectedTrials ;
+    Doub OdeSeconds ;
+
+    Doub TotalSeconds ; // whole simulates
+};
+
+#endif
@@ -7,6 +7,7 @@ __ March 2015
 
 
 #include "HybridSimulator.hpp"
+#include "Checkpoint.hpp"
 
 
 int main ()
@@ -14,13 +15,20 @@ int main ()
 	// loading model parameters
 	ModelParameters* modelParameters = new ModelParameters () ;
 
-    // construction of simulator
+    // construction of simulator (with a last argument leapEpsilon > 0, the mrna reactions are grouped into leaps, see MrnaSimulator.hpp)
     HybridSimulator* hybridSimulator = new HybridSimulator ( modelParameters ) ;
 
-	// construction of a cell
-	CellState *cell = new CellState (modelParameters) ;
+	// construction of a cell, with genes, mrnas and native proteins drawn from their steady-state
+	CellState *cell = hybridSimulator->mf_MrnaSimulator->sampleFromTelegraphSteadyState (24.) ;
+
+    // equilibration of the signaling species : the native part is already at steady-state,
+    // so this only needs to cover the time scales of the signaling reactions
     hybridSimulator->simulate ( cell , 7.*24. ) ;
 
+    // save the equilibrated cell, to start other experiments from it without re-simulating (see Checkpoint.hpp)
+    // vector<CellState*> cells ( 1 , cell ) ;
+    // writePopulationCheckpoint ( "equilibrated.fpst" , cells , modelParameters , hybridSimulator->mf_MrnaSimulator->ran , 1 ) ;
+
     // apply a stimulus and simulate the cell response
     // cell->set_NameOfSpecies_Level (0.1) ;
     hybridSimulator->simulate ( cell , 12. ) ;
@@ -28,6 +36,15 @@ int main ()
     // check the result
     // cout << "Level of _NameOfSpecies_ after stimulus = " << cell->get_NameOfSpecies_Level () << endl ;
 
+    // with events in the model (FluctuProtSTModel.addEvent), a terminal event stops the simulate at its crossing
+    // if ( hybridSimulator->StoppingEvent >= 0 ) cout << modelParameters->mf_EventNames[hybridSimulator->StoppingEvent] << " at " << hybridSimulator->StopTime << endl ;
+
+    // step counts of the last simulate (construct with useStiffSolver=true to compare StepperSie against StepperDopr5)
+    // hybridSimulator->printStatistics () ;
+
+    // hot-path counters and timers of the last simulate, when compiled with -DFPST_PROFILE (see SimulationProfile.hpp)
+    // hybridSimulator->Profile.print ( cout ) ;
+
     // free memory used by the cell if not needed
     delete cell ;
 
@@ -0,0 +1,59 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Fixtures of the regression tests (run with python -m pytest -q from the source folder).
+#
+# The tests run in the source folder (the templates are found from there), on the models of
+# the model scripts. Tests of the compiled code need the Numerical Recipes headers : they are
+# skipped unless $FPST_NR_FOLDER is a folder holding nr3.h and the other headers.
+##########################################################################################
+
+
+#### imports
+import os
+import sys
+
+import pytest
+
+SOURCE_FOLDER = os.path.dirname ( os.path.dirname ( os.path.abspath (__file__) ) )
+sys.path.insert ( 0 , SOURCE_FOLDER )
+
+import benchmark_codegen
+import FluctuProtSTPy as fpstpy
+
+
+@pytest.fixture (autouse=True)
+def sourceFolder ( monkeypatch ) :
+	monkeypatch.chdir (SOURCE_FOLDER)
+	return SOURCE_FOLDER
+
+@pytest.fixture (scope="session")
+def toyModel () :
+	return benchmark_codegen.loadModelScript ( SOURCE_FOLDER + "/model_ToyExample.py" )
+
+@pytest.fixture (scope="session")
+def toyParameters ( toyModel ) :
+	return fpstpy.ModelParameters (toyModel)
+
+@pytest.fixture (scope="session")
+def toyEventModel () :
+	# ToyExample, with a terminal event when a sixth of its caspase is cleaved (a part of the stimulated cells reach it)
+	model = benchmark_codegen.loadModelScript ( SOURCE_FOLDER + "/model_ToyExample.py" )
+	model.addEvent ( name="Death" , species="CleavedCaspase" , threshold=0.15 , relativeTo=["Caspase","Caspase_ActiveDeathReceptor","CleavedCaspase"] )
+	return model
+
+@pytest.fixture (scope="session")
+def toyEventParameters ( toyEventModel ) :
+	return fpstpy.ModelParameters (toyEventModel)
+
+@pytest.fixture (scope="session")
+def nrFolder () :
+	folder = os.environ.get ( "FPST_NR_FOLDER" , "" )
+	if not os.path.exists ( folder + "/nr3.h" ) : pytest.skip ("no Numerical Recipes headers ($FPST_NR_FOLDER)")
+	return os.path.abspath (folder)
@@ -0,0 +1,129 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Population checkpoints : the python header has the layout of CheckpointHeader
+# (Checkpoint.hpp), a population restored from a checkpoint continues exactly as the saved
+# one would have, and checkpoints of the compiled simulator (one global generator) or of
+# another model are refused.
+##########################################################################################
+
+
+#### imports
+import glob
+import os
+import re
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import FluctuProtST as fpst
+import FluctuProtSTEnsemble as fpste
+import FluctuProtSTPy as fpstpy
+
+
+def giveSimulatedPopulation ( modelParameters , randomSeed ) :
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( modelParameters , 6 , randomSeed=randomSeed , firstCellIndex=3 )
+	simulator = fpstpy.PopulationSimulator ( modelParameters , randomSeed )
+	simulator.relaxNativeProteins ( population , 1. )
+	simulator.simulate ( population , 1. )
+	return population
+
+def assertSamePopulations ( population , reference ) :
+	for name in ["AllProts","GeneMrnas","CellIndexes","RandomCounters"] :
+		assert np.array_equal ( getattr(population,name) , getattr(reference,name) ) , name
+
+def patchHeader ( path , name , value ) :
+	header = fpstpy.readCheckpointHeader (path)
+	header[name] = value
+	with open ( path , "r+b" ) as f : f.write ( header.tobytes () )
+
+
+def test_headerHasTheLayoutOfCheckpointHeader () :
+	with open ( "template_cpp_code/template_Checkpoint.hpp" , 'r' ) as readFile :
+		struct = re.search ( r"struct CheckpointHeader\s*\{(.*?)\}" , readFile.read () , re.S ).group (1)
+	sizes = { "char" : 1 , "Ullong" : 8 , "Llong" : 8 }
+	fields = []
+	for cppType,name,length in re.findall ( r"(\w+)\s+(\w+)\s*(?:\[(\d+)\])?\s*;" , struct ) :
+		fields.append ( ( name , sizes[cppType] * int(length or 1) ) )
+	header = fpstpy.CHECKPOINT_HEADER
+	assert fields == [ ( name , header.fields[name][0].itemsize ) for name in header.names ]
+	assert header.itemsize == 256
+
+def test_restoredPopulationContinuesIdentically ( toyParameters , tmp_path ) :
+	path = str ( tmp_path / "cells.fpst" )
+	population = giveSimulatedPopulation ( toyParameters , 5 )
+	population.saveCheckpoint ( path , randomSeed=5 )
+	for mmapMode in ["c",None] :
+		restored , randomSeed = fpstpy.CellPopulation.loadCheckpoint ( toyParameters , path , mmapMode=mmapMode )
+		assert randomSeed == 5
+		assertSamePopulations ( restored , population )
+	protocol = fpste.SimulationProtocol ()
+	protocol.addStimulus ( "DeathLigand" , 1000. )
+	protocol.addSimulation (1.)
+	runner = fpste.EnsembleRunner ( toyParameters , randomSeed=5 , cellsPerShard=4 )
+	continued = runner.run ( protocol , population=population )
+	assertSamePopulations ( runner.runFromCheckpoint ( protocol , path ) , continued )
+	assertSamePopulations ( runner.run ( protocol , population=restored ) , continued )
+
+def test_globalGeneratorCheckpointNeedsNewStreams ( toyParameters , tmp_path ) :
+	path = str ( tmp_path / "cells.fpst" )
+	population = giveSimulatedPopulation ( toyParameters , 5 )
+	population.saveCheckpoint ( path , randomSeed=5 )
+	patchHeader ( path , "flags" , fpstpy.CHECKPOINT_GLOBAL_GENERATOR )
+	with pytest.raises ( Exception , match="newStreams" ) : fpstpy.CellPopulation.loadCheckpoint ( toyParameters , path )
+	restored , randomSeed = fpstpy.CellPopulation.loadCheckpoint ( toyParameters , path , newStreams=True )
+	assert np.array_equal ( restored.AllProts , population.AllProts )
+	assert np.array_equal ( restored.CellIndexes , np.arange (6) )
+	assert not np.any ( restored.RandomCounters )
+
+@pytest.mark.parametrize ( "name,value" , [ ("numGenes",3) , ("numAllProteinSpecies",1000) , ("modelHash",b"0"*40) ] )
+def test_checkpointOfAnotherModelIsRefused ( toyParameters , tmp_path , name , value ) :
+	path = str ( tmp_path / "cells.fpst" )
+	giveSimulatedPopulation ( toyParameters , 5 ).saveCheckpoint (path)
+	patchHeader ( path , name , value )
+	with pytest.raises ( Exception , match="another model" ) : fpstpy.CellPopulation.loadCheckpoint ( toyParameters , path )
+
+
+#### the compiled reader and writer, with a small driver : it reads a checkpoint and writes its cells back
+CHECKPOINT_DRIVER = """
+#include "Checkpoint.hpp"
+
+int main ( int argc , char** argv )
+{
+	ModelParameters* modelParameters = new ModelParameters () ;
+	Ran ran (7) ;
+	vector<CellState*> cells = readPopulationCheckpoint ( argv[1] , modelParameters , ran ) ;
+	writePopulationCheckpoint ( argv[2] , cells , modelParameters , ran , 7 ) ;
+	return 0 ;
+}
+"""
+
+def test_compiledCheckpointsRoundTrip ( toyModel , toyParameters , nrFolder , tmp_path ) :
+	folder = str ( tmp_path / "code" )
+	fpst.buildCppFromModel ( model=toyModel , targetFolderPath=folder )
+	for f in glob.glob ( nrFolder + "/*.h" ) : shutil.copy ( f , folder + "/libs" )
+	with open ( folder + "/checkpoint_driver.cpp" , 'w' ) as writeFile : writeFile.write (CHECKPOINT_DRIVER)
+	sources = [ f for f in sorted ( os.listdir (folder) ) if f.endswith (".cpp") and f != "main.cpp" ]
+	sources += [ "libs/" + f for f in sorted ( os.listdir ( folder + "/libs" ) ) if f.endswith (".cpp") ]
+	subprocess.check_call ( [ os.environ.get ( "CXX" , "g++" ) , "-O0" , "-w" , "-o" , "checkpoint_driver" ] + sources , cwd=folder )
+
+	population = giveSimulatedPopulation ( toyParameters , 5 )
+	population.saveCheckpoint ( folder + "/python.fpst" , randomSeed=5 )
+	subprocess.check_call ( [ "./checkpoint_driver" , "python.fpst" , "compiled.fpst" ] , cwd=folder )
+	with pytest.raises ( Exception , match="newStreams" ) : fpstpy.CellPopulation.loadCheckpoint ( toyParameters , folder + "/compiled.fpst" )
+	restored , randomSeed = fpstpy.CellPopulation.loadCheckpoint ( toyParameters , folder + "/compiled.fpst" , newStreams=True )
+	assert randomSeed == 7
+	assert np.array_equal ( restored.AllProts , population.AllProts )
+	assert np.array_equal ( restored.GeneMrnas , population.GeneMrnas )
+
+	patchHeader ( folder + "/python.fpst" , "numGenes" , 1000 )
+	assert subprocess.call ( [ "./checkpoint_driver" , "python.fpst" , "other.fpst" ] , cwd=folder , stdout=subprocess.DEVNULL ) != 0
+	assert not os.path.exists ( folder + "/other.fpst" )
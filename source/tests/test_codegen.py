@@ -0,0 +1,199 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Generated code : the unrolled rhs and jacobian, and the CSR arrays read by the sparse
+# kernels, compute the same values term by term, so that both rhs modes give bit-identical
+# simulations. Parameters baked in ModelParameters.cpp and parameters read from
+# parameters.txt are the same values, and the code of a model with parameters read at
+# runtime does not depend on these values. The python module of a model refuses to re-initialize
+# a simulator that another thread is running.
+##########################################################################################
+
+
+#### imports
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+import benchmark_codegen
+import FluctuProtST as fpst
+import FluctuProtSTPy as fpstpy
+
+
+#### generated statements and arrays, evaluated in python
+def giveCppParameters ( model ) :
+	values = fpst.giveParameterValues (model)
+	return types.SimpleNamespace ( ** dict ( ( "mf_" + name , np.array ( value , dtype=float ) ) for name,value in values.items () ) )
+
+def runUnrolledCode ( code , variables ) :
+	# the statements of the unrolled code are python statements, once the comments and the ";" removed
+	for line in code.split ("\n") :
+		statement = line.split ("//") [0].replace ( "mf_ModelParameters->" , "parameters." ).strip ().rstrip (";").strip ()
+		if statement != "" : exec ( statement , {} , variables )
+
+def giveSparseArrays ( model , speciesIndexes , rateDerivatives ) :
+	arrays = {}
+	for cppType,name,values in re.findall ( r"static const (\w+) (\w+)\[\] = \{(.*?)\} ;" , fpst.giveSparseRhsArrays ( model , speciesIndexes , rateDerivatives ) , re.S ) :
+		arrays[name] = [ ( int if cppType == "Int" else float ) ( value ) for value in values.replace ( "," , " " ).split () ]
+	return types.SimpleNamespace (**arrays)
+
+def runSparseKernels ( a , parameters , y , mrnas , numGenes , numDerivs ) :
+	# loop for loop as SPARSE_RHS_KERNEL and SPARSE_JACOBIAN_KERNEL
+	numSpecies , numReacs = len(y) , len(parameters.mf_kreacs)
+	rates , dydx = np.zeros (numReacs) , np.zeros (numSpecies)
+	for r in range(numReacs) :
+		rate = parameters.mf_kreacs[r]
+		for k in range(a.ReactantPtr[r],a.ReactantPtr[r+1]) : rate *= y[a.ReactantIndexes[k]]
+		rates[r] = rate
+	for i in range(numGenes) : dydx[i] = parameters.mf_ksps[i] * mrnas[i] - parameters.mf_rps[i] * y[i]
+	for i in range(numGenes,numSpecies) : dydx[i] = - parameters.mf_degrates[i-numGenes] * y[i]
+	for i in range(numSpecies) :
+		total = 0.
+		for k in range(a.StoichPtr[i],a.StoichPtr[i+1]) : total += a.StoichCoefs[k] * rates[a.StoichReacs[k]]
+		dydx[i] += total
+	dfdy , derivatives = np.zeros ( (numSpecies,numSpecies) ) , np.zeros (numDerivs)
+	for i in range(numGenes) : dfdy[i][i] = - parameters.mf_rps[i]
+	for i in range(numGenes,numSpecies) : dfdy[i][i] = - parameters.mf_degrates[i-numGenes]
+	for d in range(numDerivs) :
+		derivative = a.DerivMultiplicities[d] * parameters.mf_kreacs[a.DerivReacs[d]]
+		for k in range(a.DerivOthersPtr[d],a.DerivOthersPtr[d+1]) : derivative *= y[a.DerivOthers[k]]
+		derivatives[d] = derivative
+	for d in range(numDerivs) :
+		for k in range(a.ReacStoichPtr[a.DerivReacs[d]],a.ReacStoichPtr[a.DerivReacs[d]+1]) :
+			dfdy[a.ReacStoichSpecies[k]][a.DerivSpecies[d]] += a.ReacStoichCoefs[k] * derivatives[d]
+	return dydx , dfdy
+
+
+def giveModel ( name ) :
+	if name == "synthetic" : return benchmark_codegen.makeSyntheticModel ( 10 , 60 )
+	return benchmark_codegen.loadModelScript ( "model_" + name + ".py" )
+
+@pytest.mark.parametrize ( "name" , [ "ToyExample" , "hEARM" , "synthetic" ] )
+def test_unrolledAndSparseRhsAreIdentical ( name ) :
+	model = giveModel (name)
+	numGenes = len(model.nativeProteins)
+	speciesIndexes = dict ( (prot.name,idxProt) for idxProt,prot in enumerate(model.nativeProteins+model.modifiedProteins) )
+	rateDerivatives = model.giveRateDerivatives ()
+	parameters = giveCppParameters (model)
+	rng = np.random.default_rng (1)
+	y , mrnas = rng.uniform ( 0. , 1000. , len(speciesIndexes) ) , rng.uniform ( 0. , 10. , numGenes )
+
+	toInsertRhs , toInsertJacobian = fpst.giveUnrolledRhsCode ( model , speciesIndexes , rateDerivatives )
+	variables = { "parameters" : parameters , "y" : y , "mf_Mrnas" : mrnas , "dydx" : np.zeros (len(y)) , "dfdy" : np.zeros ( (len(y),len(y)) ) ,
+				"mf_computedReactionRates" : np.zeros (len(model.signalingReactions)) , "mf_computedRateDerivatives" : np.zeros (len(rateDerivatives)) }
+	runUnrolledCode ( toInsertRhs , variables )
+	runUnrolledCode ( toInsertJacobian , variables )
+	dydx , dfdy = runSparseKernels ( giveSparseArrays ( model , speciesIndexes , rateDerivatives ) , parameters , y , mrnas , numGenes , len(rateDerivatives) )
+	assert np.array_equal ( variables["dydx"] , dydx )
+	assert np.array_equal ( variables["dfdy"] , dfdy )
+
+	# and both are the rhs and jacobian of the python engine
+	modelParameters = fpstpy.ModelParameters (model)
+	assert np.allclose ( modelParameters.computeDerivatives ( y , mrnas ) , dydx , rtol=1e-12 , atol=1e-9 )
+	assert np.allclose ( modelParameters.computeJacobian (y).toarray () , dfdy , rtol=1e-12 , atol=1e-9 )
+
+
+#### baked parameters and parameter files
+def giveBakedParameters ( source ) :
+	values = dict ( ( name , {} ) for name in fpst.PARAMETER_ARRAYS )
+	for name,index,value in re.findall ( r"mf_(\w+)\[(\d+)\] = ([^ ;]+) ;" , source ) :
+		name = { "EventThresholds" : "eventThresholds" } .get ( name , name )
+		if name in values : values[name][int(index)] = float (value)
+	return dict ( ( name , [ indexed[k] for k in sorted (indexed) ] ) for name,indexed in values.items () )
+
+def giveChangedToyModel () :
+	model = benchmark_codegen.loadModelScript ( "model_ToyExample.py" )
+	model.signalingReactions[0].rate = ( model.signalingReactions[0].rate[0] , 2. * model.signalingReactions[0].rate[1] )
+	model.modifiedProteins[-1].degRate *= 3.
+	return model
+
+@pytest.mark.parametrize ( "name" , [ "ToyExample" , "hEARM" ] )
+def test_bakedParametersAreTheParameterFile ( name , tmp_path ) :
+	model = giveModel (name)
+	fpst.writeParameterFile ( model , str ( tmp_path / "parameters.txt" ) )
+	parameters = fpst.readParameterFile ( str ( tmp_path / "parameters.txt" ) )
+	source = fpst.giveGeneratedSources ( model , "unrolled" , True ) ["ModelParameters.cpp"]
+	assert parameters.pop ("topologyHash") == model.giveTopologyHash () and "mf_TopologyHash = \"" + model.giveTopologyHash () in source
+	assert parameters.pop ("modelHash") == model.giveModelHash () and "mf_ModelHash = \"" + model.giveModelHash () in source
+	assert parameters == fpst.giveParameterValues (model)
+	assert giveBakedParameters (source) == parameters
+
+def test_parameterFileBuildsOnlyRewriteTheParameters ( toyModel , tmp_path ) :
+	changedModel = giveChangedToyModel ()
+	assert changedModel.giveTopologyHash () == toyModel.giveTopologyHash () and changedModel.giveModelHash () != toyModel.giveModelHash ()
+	for rhsMode in ["unrolled","sparse"] :
+		assert fpst.giveGeneratedSources ( toyModel , rhsMode , False ) == fpst.giveGeneratedSources ( changedModel , rhsMode , False )
+	folder , cacheFolder = str ( tmp_path / "code" ) , str ( tmp_path / "cache" )
+	fpst.buildCppFromModel ( model=toyModel , targetFolderPath=folder , bakeParameters=False , cacheFolderPath=cacheFolder )
+	contents = dict ( ( f , open ( folder + "/" + f ).read () ) for f in os.listdir (folder) if f.endswith ( (".cpp",".hpp",".txt") ) )
+	mtimes = dict ( ( f , os.path.getmtime ( folder + "/" + f ) ) for f in contents )
+	fpst.buildCppFromModel ( model=changedModel , targetFolderPath=folder , bakeParameters=False , cacheFolderPath=cacheFolder )
+	changed = [ f for f in contents if open ( folder + "/" + f ).read () != contents[f] or os.path.getmtime ( folder + "/" + f ) != mtimes[f] ]
+	assert changed == [ "parameters.txt" ]
+	assert len ( os.listdir (cacheFolder) ) == 1
+
+
+#### the compiled simulators of both rhs modes, and of baked and file parameters
+def buildModule ( model , folder , nrFolder , **buildOptions ) :
+	fpst.buildCppFromModel ( model=model , targetFolderPath=folder , **buildOptions )
+	for f in glob.glob ( nrFolder + "/*.h" ) : shutil.copy ( f , folder + "/libs" )
+	return fpst.buildPythonModule ( model , folder )
+
+def simulateCompiledCells ( module , useStiffSolver ) :
+	simulator = module.HybridSimulator ( randomSeed=3 , useStiffSolver=useStiffSolver )
+	prots , mrnas = simulator.samplePopulation ( 4 , 1. )
+	prots[:,module.speciesNames.index ("DeathLigand")] = 1000.
+	simulator.simulatePopulation ( prots , mrnas , 2. )
+	return prots , mrnas
+
+@pytest.fixture (scope="module")
+def toyModules ( toyModel , nrFolder , tmp_path_factory ) :
+	folder = str ( tmp_path_factory.mktemp ("modules") )
+	modules = dict ( ( rhsMode , buildModule ( toyModel , folder + "/" + rhsMode , nrFolder , rhsMode=rhsMode ) ) for rhsMode in ["unrolled","sparse"] )
+	modules["file"] = buildModule ( toyModel , folder + "/file" , nrFolder , bakeParameters=False )
+	modules["changed"] = buildModule ( giveChangedToyModel () , folder + "/changed" , nrFolder )
+	return modules
+
+@pytest.mark.parametrize ( "useStiffSolver" , [ False , True ] )
+def test_compiledRhsModesAreIdentical ( toyModules , useStiffSolver ) :
+	unrolled = simulateCompiledCells ( toyModules["unrolled"] , useStiffSolver )
+	sparse = simulateCompiledCells ( toyModules["sparse"] , useStiffSolver )
+	assert np.all ( unrolled[0][:,toyModules["unrolled"].speciesNames.index ("CleavedCaspase")] > 0. )
+	assert np.array_equal ( unrolled[0] , sparse[0] )
+	assert np.array_equal ( unrolled[1] , sparse[1] )
+
+def test_compiledParameterFileIsBakedParameters ( toyModules , tmp_path ) :
+	module = toyModules["file"]
+	assert np.array_equal ( simulateCompiledCells ( module , False ) [0] , simulateCompiledCells ( toyModules["unrolled"] , False ) [0] )
+	fpst.writeParameterFile ( giveChangedToyModel () , str ( tmp_path / "changed.txt" ) )
+	module.loadParameterFile ( str ( tmp_path / "changed.txt" ) )
+	assert np.array_equal ( simulateCompiledCells ( module , False ) [0] , simulateCompiledCells ( toyModules["changed"] , False ) [0] )
+	assert not np.array_equal ( simulateCompiledCells ( module , False ) [0] , simulateCompiledCells ( toyModules["unrolled"] , False ) [0] )
+
+def test_busySimulatorIsNotReinitialized ( toyModules ) :
+	module = toyModules["unrolled"]
+	simulator = module.HybridSimulator ( randomSeed=1 )
+	prots , mrnas = simulator.samplePopulation ( 50 , 1. )
+	prots[:,module.speciesNames.index ("DeathLigand")] = 1000.
+	thread = threading.Thread ( target=simulator.simulatePopulation , args=(prots,mrnas,48.) )
+	thread.start ()
+	try :
+		time.sleep (0.2)
+		assert thread.is_alive ()
+		with pytest.raises ( RuntimeError , match="another thread" ) : simulator.__init__ ( randomSeed=2 )
+	finally :
+		thread.join ()
+	simulator.__init__ ( randomSeed=2 )
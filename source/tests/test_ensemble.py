@@ -0,0 +1,70 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# EnsembleRunner : a cell only depends on the master seed and its index, so the results are
+# bit-identical whatever the number of workers, the shard size or the kind of pool, including
+# the events of the cells and the cells stopped by a terminal event.
+##########################################################################################
+
+
+#### imports
+import numpy as np
+import pytest
+
+import FluctuProtSTEnsemble as fpste
+import FluctuProtSTPy as fpstpy
+
+
+def giveProtocol () :
+	protocol = fpste.SimulationProtocol ()
+	protocol.addNativeRelaxation (1.)
+	protocol.addSimulation (1.)
+	protocol.addStimulus ( "DeathLigand" , 1000. )
+	protocol.addSimulation (2.)
+	return protocol
+
+def assertSamePopulations ( population , reference ) :
+	for name in ["AllProts","GeneMrnas","CellIndexes","RandomCounters"] :
+		assert np.array_equal ( getattr(population,name) , getattr(reference,name) ) , name
+
+
+@pytest.mark.parametrize ( "withEvent" , [ False , True ] )
+@pytest.mark.parametrize ( "useStiffSolver,leapEpsilon" , [ (False,0.) , (True,0.1) ] )
+def test_workersAndShardsGiveIdenticalCells ( request , useStiffSolver , leapEpsilon , withEvent ) :
+	# with the terminal event, a part of the cells stops during the stimulation : the crossing tests, the event
+	# times and the states the stopped cells are moved back to must not depend on the batch either
+	modelParameters = request.getfixturevalue ( "toyEventParameters" if withEvent else "toyParameters" )
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( modelParameters , 10 , randomSeed=3 )
+	results , events = [] , []
+	for numWorkers,cellsPerShard,useThreads in [ (1,1000,False) , (3,4,False) , (2,3,True) , (1,1,False) ] :
+		runner = fpste.EnsembleRunner ( modelParameters , randomSeed=5 , numWorkers=numWorkers , cellsPerShard=cellsPerShard ,
+										useThreads=useThreads , useStiffSolver=useStiffSolver , leapEpsilon=leapEpsilon )
+		results.append ( runner.run ( giveProtocol () , population=population ) )
+		events.append ( ( runner.EventTimes , runner.StoppingEvents , runner.StopTimes ) )
+	for result in results[1:] : assertSamePopulations ( result , results[0] )
+	for values in events[1:] :
+		for value,reference in zip ( values , events[0] ) : assert np.array_equal ( value , reference , equal_nan=True )
+	assert not np.array_equal ( results[0].AllProts , population.AllProts )
+	if withEvent : assert 0 < np.sum ( events[0][1] >= 0 ) < population.NumCells
+
+def test_subPopulationContinuesLikeFullPopulation ( toyParameters ) :
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( toyParameters , 6 , randomSeed=3 )
+	runner = fpste.EnsembleRunner ( toyParameters , randomSeed=5 )
+	full = runner.run ( giveProtocol () , population=population )
+	part = runner.run ( giveProtocol () , population=population.getSubPopulation ( slice(2,5) ) )
+	assertSamePopulations ( part , full.getSubPopulation ( slice(2,5) ) )
+
+def test_nativeCellsOnlyDependOnSeedAndIndex ( toyParameters ) :
+	small = fpstpy.CellPopulation.fromNativeSteadyState ( toyParameters , 5 , randomSeed=3 )
+	large = fpstpy.CellPopulation.fromNativeSteadyState ( toyParameters , 20 , randomSeed=3 )
+	shifted = fpstpy.CellPopulation.fromNativeSteadyState ( toyParameters , 4 , randomSeed=3 , firstCellIndex=2 )
+	assertSamePopulations ( small , large.getSubPopulation ( slice(0,5) ) )
+	assertSamePopulations ( shifted , large.getSubPopulation ( slice(2,6) ) )
+	other = fpstpy.CellPopulation.fromNativeSteadyState ( toyParameters , 5 , randomSeed=4 )
+	assert not np.array_equal ( other.AllProts , small.AllProts )
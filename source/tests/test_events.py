@@ -0,0 +1,155 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# Events : with the genes and mrnas frozen, the protein trajectory of a cell is deterministic,
+# so the event times of both python simulators are checked against a fine-step reference and
+# against each other. A cell stopped by a terminal event keeps its state at the stop, genes
+# and mrnas included : they are those of a simulation of the same cell up to the stop time.
+##########################################################################################
+
+
+#### imports
+import copy
+import glob
+import shutil
+
+import numpy as np
+import pytest
+import scipy.integrate
+
+import FluctuProtST as fpst
+import FluctuProtSTPy as fpstpy
+
+
+DURATION = 6.
+LIGANDS = [ 1000. , 0. , 1000. , 100. , 1000. , 10. ] # the cells with 1000 reach the terminal event
+
+
+@pytest.fixture (scope="module")
+def eventModel ( toyModel ) :
+	# ToyExample, with a first event that does not stop the cell and a terminal one
+	model = copy.deepcopy (toyModel)
+	model.addEvent ( name="Onset" , species="CleavedCaspase" , threshold=0.05 , relativeTo=["Caspase","Caspase_ActiveDeathReceptor","CleavedCaspase"] , terminal=False )
+	model.addEvent ( name="Death" , species="CleavedCaspase" , threshold=0.15 , relativeTo=["Caspase","Caspase_ActiveDeathReceptor","CleavedCaspase"] )
+	return model
+
+@pytest.fixture (scope="module")
+def stimulatedCells ( eventModel ) :
+	population = fpstpy.CellPopulation.fromNativeSteadyState ( fpstpy.ModelParameters (eventModel) , len(LIGANDS) , randomSeed=3 )
+	population.setLevels ( "DeathLigand" , LIGANDS )
+	return population
+
+@pytest.fixture (scope="module")
+def frozenParameters ( eventModel ) :
+	# no gene switch and no mrna reaction : the mrnas keep their levels
+	modelParameters = fpstpy.ModelParameters (eventModel)
+	for name in ["kons","koffs","ksms","rms"] : getattr ( modelParameters , name ) [:] = 0.
+	return modelParameters
+
+def solveReference ( modelParameters , population , i ) :
+	p = modelParameters
+	mrnas = population.GeneMrnas[i:i+1,2::3]
+	rhs = lambda t,y : p.computeDerivatives ( y[None] , mrnas ) [0]
+	events = [ ( lambda t,y,e=e : p.computeEventFunctions (y[None]) [0,e] ) for e in range(p.NumEvents) ]
+	return scipy.integrate.solve_ivp ( rhs , (0.,DURATION) , population.AllProts[i] , rtol=1e-12 , atol=1e-9 , events=events , dense_output=True )
+
+def simulatePopulation ( modelParameters , population , duration , **options ) :
+	simulator = fpstpy.PopulationSimulator ( modelParameters , randomSeed=5 , **options )
+	observationTimes = np.linspace ( 0. , duration , 13 )
+	observations = simulator.simulate ( population , duration , observationTimes=observationTimes , speciesNames=["CleavedCaspase"] )
+	return simulator , observationTimes , observations
+
+
+@pytest.mark.parametrize ( "useStiffSolver" , [ False , True ] )
+def test_eventTimesMatchFineStepReference ( frozenParameters , stimulatedCells , useStiffSolver ) :
+	population = stimulatedCells.getSubPopulation ( slice(None) )
+	simulator , observationTimes , observations = simulatePopulation ( frozenParameters , population , DURATION , useStiffSolver=useStiffSolver )
+	stopped = np.array (LIGANDS) == 1000.
+	assert np.array_equal ( simulator.StoppingEvents , np.where ( stopped , 1 , -1 ) )
+	for i in range(population.NumCells) :
+		reference = solveReference ( frozenParameters , stimulatedCells , i )
+		stopTime = reference.t_events[1][0] if stopped[i] else DURATION
+		assert simulator.StopTimes[i] == pytest.approx ( stopTime , abs=1e-8 )
+		if stopped[i] :
+			assert simulator.EventTimes[i,0] == pytest.approx ( reference.t_events[0][0] , abs=1e-8 )
+			assert simulator.EventTimes[i,1] == simulator.StopTimes[i]
+		else :
+			assert np.all ( np.isnan ( simulator.EventTimes[i] ) )
+		# the state of the cell is the one at its stop, and it is not observed after it
+		assert population.AllProts[i] == pytest.approx ( reference.sol (stopTime) , rel=1e-4 , abs=1e-3 )
+		assert np.array_equal ( population.GeneMrnas[i] , stimulatedCells.GeneMrnas[i] )
+		assert np.all ( np.isfinite ( observations[0,i,observationTimes<=stopTime] ) )
+		assert np.all ( np.isnan ( observations[0,i,observationTimes>stopTime] ) )
+
+def test_bothSimulatorsGiveSameEvents ( frozenParameters , stimulatedCells ) :
+	population = stimulatedCells.getSubPopulation ( slice(None) )
+	simulator , _ , _ = simulatePopulation ( frozenParameters , population , DURATION )
+	for i in range(population.NumCells) :
+		cell = stimulatedCells.getCellState (i)
+		cellSimulator = fpstpy.HybridSimulator ( frozenParameters , randomSeed=1 )
+		cellSimulator.simulate ( cell , DURATION )
+		assert cellSimulator.StoppingEvent == simulator.StoppingEvents[i]
+		assert cellSimulator.StopTime == pytest.approx ( simulator.StopTimes[i] , abs=1e-8 )
+		assert np.allclose ( cellSimulator.EventTimes , simulator.EventTimes[i] , rtol=0. , atol=1e-8 , equal_nan=True )
+		assert cell.AllProts == pytest.approx ( population.AllProts[i] , rel=1e-4 , abs=1e-3 )
+
+def test_stoppedCellsKeepGenesAndMrnasOfStop ( eventModel , stimulatedCells ) :
+	# genes and mrnas of a stopped cell against the same cell (same random draws) simulated up to its stop without
+	# the events : the switches and mrna reactions drawn after the stop must not be kept. The genes are on half of
+	# the time, so that the switches after the stop do not mostly come in pairs that leave the gene as it was
+	modelParameters = fpstpy.ModelParameters (eventModel)
+	modelParameters.kons[:] = modelParameters.koffs
+	stopped = np.flatnonzero ( np.array (LIGANDS) == 1000. )
+	changedGenes = 0
+	for i in stopped :
+		cell = stimulatedCells.getCellState (i)
+		simulator = fpstpy.HybridSimulator ( modelParameters , randomSeed=int(i) )
+		simulator.simulate ( cell , DURATION )
+		assert simulator.StoppingEvent == 1
+		chunk = simulator.mf_MrnaChunk
+		undone = chunk.switchGenes[:chunk.numSwitches][ chunk.switchTimes[:chunk.numSwitches] > simulator.StopTime ]
+		changedGenes += int ( np.sum ( np.bincount ( undone , minlength=modelParameters.NumGenes ) % 2 ) )
+		reference = stimulatedCells.getCellState (i)
+		referenceSimulator = fpstpy.HybridSimulator ( modelParameters , randomSeed=int(i) )
+		referenceSimulator.CheckEvents = False
+		referenceSimulator.simulate ( reference , simulator.StopTime )
+		assert np.array_equal ( cell.GeneMrnas , reference.GeneMrnas )
+	assert changedGenes > 0
+	population = stimulatedCells.getSubPopulation (stopped)
+	simulator , _ , _ = simulatePopulation ( modelParameters , population , DURATION )
+	assert np.all ( simulator.StoppingEvents == 1 )
+	for k,i in enumerate(stopped) :
+		reference = stimulatedCells.getSubPopulation ( [i] )
+		referenceSimulator = fpstpy.PopulationSimulator ( modelParameters , randomSeed=5 )
+		referenceSimulator.CheckEvents = False
+		referenceSimulator.simulate ( reference , simulator.StopTimes[k] )
+		assert np.array_equal ( population.GeneMrnas[k] , reference.GeneMrnas[0] )
+
+
+#### the compiled simulator : its stopped cells also keep the genes and mrnas of the stop
+def test_compiledStoppedCellsKeepGenesAndMrnasOfStop ( eventModel , nrFolder , tmp_path ) :
+	folder = str(tmp_path) + "/events"
+	fpst.buildCppFromModel ( model=eventModel , targetFolderPath=folder )
+	for f in glob.glob ( nrFolder + "/*.h" ) : shutil.copy ( f , folder + "/libs" )
+	module = fpst.buildPythonModule ( eventModel , folder )
+	ligand = module.speciesNames.index ("DeathLigand")
+	numStopped = 0
+	for seed in range(1,5) :
+		cells = []
+		for checkEvents in [True,False] :
+			simulator = module.HybridSimulator ( randomSeed=seed )
+			simulator.checkEvents = checkEvents
+			cell = simulator.sampleFromTelegraphSteadyState (1.)
+			cell.allProts[ligand] = 1000.
+			simulator.simulate ( cell , DURATION if checkEvents else stopTime )
+			if checkEvents : stopTime = simulator.statistics["stopTime"]
+			cells.append (cell)
+		if stopTime < DURATION : numStopped += 1
+		assert np.array_equal ( cells[0].geneMrnas , cells[1].geneMrnas )
+	assert numStopped > 0
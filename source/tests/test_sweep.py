@@ -0,0 +1,52 @@
+################################################
+# FluctuProtST, Version 1.2
+# Francois Bertaux, Inria Paris-Rocquencourt
+# francois.bertaux@inria.fr
+# March 2015
+################################################
+
+
+#########################################################################################
+# ParameterSweep : points are streamed one by one, with a bounded number of points in flight,
+# and their results do not depend on the number of workers, the shard size or that bound.
+##########################################################################################
+
+
+#### imports
+import FluctuProtSTEnsemble as fpste
+import FluctuProtSTSweep as fpsts
+
+
+def giveSweep ( model , **options ) :
+	sweep = fpsts.ParameterSweep ( model , numCells=6 , relaxationDuration=1. , equilibrationDuration=1. , **options )
+	sweep.addRateFactor ( "kbFactor" , reactions=[model.signalingReactions[0].name] )
+	sweep.addStimulus ( "DeathLigand" , species="DeathLigand" )
+	return sweep
+
+def giveProtocol () :
+	protocol = fpste.SimulationProtocol ()
+	protocol.addSimulation (1.)
+	return protocol
+
+DESIGN = fpsts.giveGridDesign ( { "kbFactor" : [1.,2.] , "DeathLigand" : [10.,100.,1000.] } )
+
+
+def test_workersShardsAndPointsInFlightGiveIdenticalResults ( toyEventModel ) :
+	results = []
+	for options in [ {} , { "numWorkers" : 2 , "cellsPerShard" : 4 , "useThreads" : True } , { "numWorkers" : 2 , "maxPointsInFlight" : 3 } ] :
+		results.append ( sorted ( giveSweep ( toyEventModel , **options ).run ( DESIGN , giveProtocol () , ["CleavedCaspase"] ) , key=lambda r : r[0] ) )
+	assert [ r[0] for r in results[0] ] == list ( range ( len(DESIGN) ) )
+	for result in results[1:] : assert result == results[0]
+
+def test_pointsAreSubmittedLazily ( toyEventModel ) :
+	sweep = giveSweep ( toyEventModel , numWorkers=2 , useThreads=True , maxPointsInFlight=2 )
+	protocol = giveProtocol ()
+	submitted = []
+	makeShardTasks = sweep.makeShardTasks
+	def countingMakeShardTasks ( modelParameters , shardProtocol , population , stimuli = [] ) :
+		if shardProtocol is protocol : submitted.append (stimuli)
+		return makeShardTasks ( modelParameters , shardProtocol , population , stimuli )
+	sweep.makeShardTasks = countingMakeShardTasks
+	for numYielded,result in enumerate ( sweep.iterateResults ( DESIGN , protocol ) , 1 ) :
+		# the points of a group are yielded in order, with at most 2 points submitted and not yet yielded
+		assert numYielded <= len(submitted) <= numYielded + 1